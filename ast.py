@@ -1,8 +1,15 @@
 class AstNode:
+    """Base of the AST nodes. The node kind is the class-level name, and pos
+    is the source offset of the node's first token, -1 if unknown."""
+    __slots__ = ('pos',)
     tree_tag = '+--- '
+    name = 'ast_node'
+    # (attribute, is a list) for the attributes holding child nodes, in
+    # source order; a child that is not in a list may be None
+    child_fields = ()
 
-    def __init__(self, name):
-        self.name = name
+    def __init__(self, pos=-1):
+        self.pos = pos
 
     def __str__(self):
         return '<%s>' % (self.name)
@@ -23,9 +30,13 @@ class AstNode:
 
 
 class Block(AstNode):
-    def __init__(self, stats=[], name='block'):
-        super().__init__(name)
-        self.stats = stats
+    __slots__ = ('stats',)
+    name = 'block'
+    child_fields = (('stats', True),)
+
+    def __init__(self, stats=None, pos=-1):
+        self.pos = pos
+        self.stats = [] if stats is None else stats
 
     def print(self, pre_num=0):
         super().print(pre_num)
@@ -37,30 +48,46 @@ class Block(AstNode):
 
 
 class EmptyStat(AstNode):
-    def __init__(self, name="empty_stat"):
-        super().__init__(name)
+    __slots__ = ()
+    name = 'empty_stat'
+
+    def __init__(self, pos=-1):
+        self.pos = pos
 
 
 class BreakStat(AstNode):
-    def __init__(self, name='break_stat'):
-        super().__init__(name)
+    __slots__ = ()
+    name = 'break_stat'
+
+    def __init__(self, pos=-1):
+        self.pos = pos
 
 
 class LabelStat(AstNode):
-    def __init__(self, label, name='label_stat'):
-        super().__init__(name)
+    __slots__ = ('label',)
+    name = 'label_stat'
+
+    def __init__(self, label, pos=-1):
+        self.pos = pos
         self.label = label
 
 
 class GotoStat(AstNode):
-    def __init__(self, label, name='goto_stat'):
-        super().__init__(name)
+    __slots__ = ('label',)
+    name = 'goto_stat'
+
+    def __init__(self, label, pos=-1):
+        self.pos = pos
         self.label = label
 
 
 class DoStat(AstNode):
-    def __init__(self, block, name='do_stat'):
-        super().__init__(name)
+    __slots__ = ('block',)
+    name = 'do_stat'
+    child_fields = (('block', False),)
+
+    def __init__(self, block, pos=-1):
+        self.pos = pos
         self.block = block
 
     def print(self, pre_num=0):
@@ -68,8 +95,12 @@ class DoStat(AstNode):
         self.block.print(pre_num+1)
 
 class LocalDeclStat(AstNode):
-    def __init__(self, var_list, exp_list, name = 'local_decl_stat'):
-        super().__init__(name)
+    __slots__ = ('val_list', 'exp_list')
+    name = 'local_decl_stat'
+    child_fields = (('val_list', True), ('exp_list', True))
+
+    def __init__(self, var_list, exp_list, pos=-1):
+        self.pos = pos
         self.val_list = var_list
         self.exp_list = exp_list
 
@@ -82,9 +113,19 @@ class LocalDeclStat(AstNode):
         for it in self.exp_list:
             it.print(pre_num+2)
 
+class LocalFuncDefStat(LocalDeclStat):
+    """local function Name funcbody, where Name is in scope in the body."""
+    __slots__ = ()
+    name = 'local_func_def_stat'
+
+
 class WhileStat(AstNode):
-    def __init__(self, exp, block, name='while_stat'):
-        super().__init__(name)
+    __slots__ = ('exp', 'block')
+    name = 'while_stat'
+    child_fields = (('exp', False), ('block', False))
+
+    def __init__(self, exp, block, pos=-1):
+        self.pos = pos
         self.exp = exp
         self.block = block
 
@@ -95,8 +136,12 @@ class WhileStat(AstNode):
 
 
 class RepeatStat(AstNode):
-    def __init__(self, exp, block, name='repeat_stat'):
-        super().__init__(name)
+    __slots__ = ('exp', 'block')
+    name = 'repeat_stat'
+    child_fields = (('block', False), ('exp', False))
+
+    def __init__(self, exp, block, pos=-1):
+        self.pos = pos
         self.exp = exp
         self.block = block
 
@@ -106,8 +151,12 @@ class RepeatStat(AstNode):
         self.block.print(pre_num+1)
 
 class IfStat(AstNode):
-    def __init__(self, exp_list, block_list, name='if_stat'):
-        super().__init__(name)
+    __slots__ = ('exp_list', 'block_list')
+    name = 'if_stat'
+    child_fields = (('exp_list', True), ('block_list', True))
+
+    def __init__(self, exp_list, block_list, pos=-1):
+        self.pos = pos
         self.exp_list = exp_list
         self.block_list = block_list
 
@@ -121,8 +170,12 @@ class IfStat(AstNode):
             it.print(pre_num+2)
 
 class ForNumStat(AstNode):
-    def __init__(self, var_name, init_exp, limit_exp, step_exp, block, name = 'for_num_stat'):
-        super().__init__(name)
+    __slots__ = ('var_name', 'init_exp', 'limit_exp', 'step_exp', 'block')
+    name = 'for_num_stat'
+    child_fields = (('var_name', False), ('init_exp', False), ('limit_exp', False), ('step_exp', False), ('block', False))
+
+    def __init__(self, var_name, init_exp, limit_exp, step_exp, block, pos=-1):
+        self.pos = pos
         self.var_name = var_name
         self.init_exp = init_exp
         self.limit_exp = limit_exp
@@ -139,8 +192,12 @@ class ForNumStat(AstNode):
         self.block.print(pre_num+1)
 
 class ForInStat(AstNode):
-    def __init__(self, name_list, exp_list, block, name = 'for_in_stat'):
-        super().__init__(name)
+    __slots__ = ('name_list', 'exp_list', 'block')
+    name = 'for_in_stat'
+    child_fields = (('name_list', True), ('exp_list', True), ('block', False))
+
+    def __init__(self, name_list, exp_list, block, pos=-1):
+        self.pos = pos
         self.name_list = name_list
         self.exp_list = exp_list
         self.block = block
@@ -156,8 +213,12 @@ class ForInStat(AstNode):
         self.block.print(pre_num+1)
 
 class AssignStat(AstNode):
-    def __init__(self, var_list, exp_list, name='assign_stat'):
-        super().__init__(name)
+    __slots__ = ('var_list', 'exp_list')
+    name = 'assign_stat'
+    child_fields = (('var_list', True), ('exp_list', True))
+
+    def __init__(self, var_list, exp_list, pos=-1):
+        self.pos = pos
         self.var_list = var_list
         self.exp_list = exp_list
 
@@ -172,8 +233,12 @@ class AssignStat(AstNode):
 
 
 class RetStat(AstNode):
-    def __init__(self, exp_list, name='ret_stat'):
-        super().__init__(name)
+    __slots__ = ('exp_list',)
+    name = 'ret_stat'
+    child_fields = (('exp_list', True),)
+
+    def __init__(self, exp_list, pos=-1):
+        self.pos = pos
         self.exp_list = exp_list
     
     def print(self, pre_num=0):
@@ -182,17 +247,39 @@ class RetStat(AstNode):
             it.print(pre_num+1)
 
 class StringExp(AstNode):
-    def __init__(self, string, name='string_exp'):
-        super().__init__(name)
+    __slots__ = ('string',)
+    name = 'string_exp'
+
+    def __init__(self, string, pos=-1):
+        self.pos = pos
         self.string = string
 
     def __str__(self):
         return '<%s "%s">'%(self.name, self. string)
 
 
+class ParensExp(AstNode):
+    """( exp ) around a call or '...', cutting it down to one value."""
+    __slots__ = ('exp',)
+    name = 'parens_exp'
+    child_fields = (('exp', False),)
+
+    def __init__(self, exp, pos=-1):
+        self.pos = pos
+        self.exp = exp
+
+    def print(self, pre_num=0):
+        super().print(pre_num)
+        self.exp.print(pre_num+1)
+
+
 class BinopExp(AstNode):
-    def __init__(self, op_left, op_right, binop, name='binop_exp'):
-        super().__init__(name)
+    __slots__ = ('op_left', 'op_right', 'binop')
+    name = 'binop_exp'
+    child_fields = (('op_left', False), ('op_right', False))
+
+    def __init__(self, op_left, op_right, binop, pos=-1):
+        self.pos = pos
         self.op_left = op_left
         self.op_right = op_right
         self.binop = binop
@@ -207,8 +294,12 @@ class BinopExp(AstNode):
 
 
 class UnopExp(AstNode):
-    def __init__(self, op_num, unop, name='unop_exp'):
-        super().__init__(name)
+    __slots__ = ('op_num', 'unop')
+    name = 'unop_exp'
+    child_fields = (('op_num', False),)
+
+    def __init__(self, op_num, unop, pos=-1):
+        self.pos = pos
         self.op_num = op_num
         self.unop = unop
 
@@ -221,13 +312,19 @@ class UnopExp(AstNode):
 
 
 class NilExp(AstNode):
-    def __init__(self, name='nil_exp'):
-        super().__init__(name)
+    __slots__ = ()
+    name = 'nil_exp'
+
+    def __init__(self, pos=-1):
+        self.pos = pos
 
 
 class BoolConstExp(AstNode):
-    def __init__(self, bool_val, name='bool_constant_exp'):
-        super().__init__(name)
+    __slots__ = ('bool_val',)
+    name = 'bool_constant_exp'
+
+    def __init__(self, bool_val, pos=-1):
+        self.pos = pos
         self.bool_val = bool_val
 
     def __str__(self):
@@ -235,21 +332,31 @@ class BoolConstExp(AstNode):
 
 
 class VarargExp(AstNode):
-    def __init__(self, name='vararg_exp'):
-        super().__init__(name)
+    __slots__ = ()
+    name = 'vararg_exp'
+
+    def __init__(self, pos=-1):
+        self.pos = pos
 
 
 class NameExp(AstNode):
-    def __init__(self, id_name, name='name_exp'):
-        super().__init__(name)
+    __slots__ = ('id_name',)
+    name = 'name_exp'
+
+    def __init__(self, id_name, pos=-1):
+        self.pos = pos
         self.id_name = id_name
     
     def __str__(self):
         return '<%s %s>'%(self.name, self. id_name)
 
 class TableAccessExp(AstNode):
-    def __init__(self, exp, idx_exp, name='table_access_exp'):
-        super().__init__(name)
+    __slots__ = ('exp', 'idx_exp')
+    name = 'table_access_exp'
+    child_fields = (('exp', False), ('idx_exp', False))
+
+    def __init__(self, exp, idx_exp, pos=-1):
+        self.pos = pos
         self.exp = exp
         self.idx_exp = idx_exp
 
@@ -259,8 +366,12 @@ class TableAccessExp(AstNode):
         self.idx_exp.print(pre_num+1)
 
 class TableConstructorExp(AstNode):
-    def __init__(self, key_list, val_list, name = 'table_constructor_exp'):
-        super().__init__(name)
+    __slots__ = ('key_list', 'val_list')
+    name = 'table_constructor_exp'
+    child_fields = (('key_list', True), ('val_list', True))
+
+    def __init__(self, key_list, val_list, pos=-1):
+        self.pos = pos
         self.key_list = key_list
         self.val_list = val_list
 
@@ -274,20 +385,33 @@ class TableConstructorExp(AstNode):
             it.print(pre_num+2)
 
 class FunctionCallExp(AstNode):
-    def __init__(self, prefix_exp, args_exp, name='function_call_exp'):
-        super().__init__(name)
+    """prefix_exp(args) or, with method set to the name's StringExp,
+    prefix_exp:method(args), where prefix_exp is the receiver."""
+    __slots__ = ('prefix_exp', 'method', 'args_exp')
+    name = 'function_call_exp'
+    child_fields = (('prefix_exp', False), ('method', False), ('args_exp', True))
+
+    def __init__(self, prefix_exp, method, args_exp, pos=-1):
+        self.pos = pos
         self.prefix_exp = prefix_exp
+        self.method = method
         self.args_exp = args_exp
 
     def print(self, pre_num=0):
         super().print(pre_num)
         self.prefix_exp.print(pre_num+1)
+        if self.method:
+            self.method.print(pre_num+1)
         for it in self.args_exp:
             it.print(pre_num+1)
 
 class FunctionDefExp(AstNode):
-    def __init__(self, parlist, is_var_arg, body, name = 'function_def_exp'):
-        super().__init__(name)
+    __slots__ = ('parlist', 'is_var_arg', 'body')
+    name = 'function_def_exp'
+    child_fields = (('parlist', True), ('body', False))
+
+    def __init__(self, parlist, is_var_arg, body, pos=-1):
+        self.pos = pos
         self.parlist = parlist
         self.is_var_arg = is_var_arg
         self.body = body
@@ -298,17 +422,44 @@ class FunctionDefExp(AstNode):
             it.print(pre_num+1)
         self.body.print(pre_num+1)
 
+class LazyFunctionDefExp(FunctionDefExp):
+    """A function whose body is skipped at parse time. The tokens from
+    body_start up to the 'end' at body_end are parsed on first access of body."""
+    __slots__ = ('parser', 'body_start', 'body_end', 'parsed_body')
+
+    def __init__(self, parlist, is_var_arg, parser, body_start, body_end, pos=-1):
+        self.parser = parser
+        self.body_start = body_start
+        self.body_end = body_end
+        super().__init__(parlist, is_var_arg, None, pos)
+
+    @property
+    def body(self):
+        if self.parsed_body is None:
+            self.parsed_body = self.parser.parse_body_range(self.body_start, self.body_end)
+        return self.parsed_body
+
+    @body.setter
+    def body(self, body):
+        self.parsed_body = body
+
 class IntegerExp(AstNode):
-    def __init__(self, int_val, name = 'integer_exp'):
-        super().__init__(name)
+    __slots__ = ('int_val',)
+    name = 'integer_exp'
+
+    def __init__(self, int_val, pos=-1):
+        self.pos = pos
         self.int_val = int_val
 
     def __str__(self):
         return '<%s %d>'%(self.name, self. int_val)
 
 class FloatExp(AstNode):
-    def __init__(self, float_val, name = 'float_exp'):
-        super().__init__(name)
+    __slots__ = ('float_val',)
+    name = 'float_exp'
+
+    def __init__(self, float_val, pos=-1):
+        self.pos = pos
         self.float_val = float_val
 
     def __str__(self):
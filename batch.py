@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+# The modules here come first on sys.path, so none may be named like a
+# stdlib module the worker pool imports: empty token.py and opcode.py
+# files were removed for that, as tokenize failed to import in workers.
+import lexer
+import binchunk
+import peephole
+from cache import CompileCache
+from parser import Parser
+from code import CodeGenerator
+from constfold import fold_constants
+
+
+# compile one file in a worker, looking in the cache directory first if given:
+# (path, binary chunk or None, error or None, cache lookup), the lookup being
+# True for a hit, False for a miss and None if the cache was not looked up
+def compile_file(path, cache_dir=None, reuse_regs=False):
+    hit = None
+    try:
+        with open(path, 'rb') as f:
+            src = f.read()
+        source = '@' + path
+        if cache_dir:
+            cache = CompileCache(cache_dir)
+            # the source name is part of the chunk
+            key = cache.key(src, source + (' reuse_regs' if reuse_regs else ''))
+            chunk = cache.get(key)
+            if chunk is not None:
+                return path, chunk, None, True
+            hit = False
+        parser = Parser(lexer.Lexer(src, path).tokenize(recover=True), recover=True)
+        block = parser.parse()
+        if parser.diagnostics:
+            return path, None, '\n'.join(str(e) for e in parser.diagnostics), hit
+        proto = peephole.optimize(CodeGenerator(reuse_regs=reuse_regs).gen_main_proto(fold_constants(block)))
+        chunk = binchunk.dump(proto, source)
+        if cache_dir:
+            cache.put(key, chunk)
+        return path, chunk, None, hit
+    except Exception as e:
+        return path, None, '%s: %s' % (path, e), hit
+
+
+# expand directories to the .lua files below them, as (path, path relative
+# to the directory given) pairs
+def find_sources(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith('.lua'):
+                        file_path = os.path.join(root, name)
+                        yield file_path, os.path.relpath(file_path, path)
+        else:
+            yield path, os.path.basename(path)
+
+
+# compile files over jobs processes, yields the results in file order
+def compile_files(paths, jobs=None, cache_dir=None, reuse_regs=False):
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1:
+        yield from map(compile_file, paths, repeat(cache_dir), repeat(reuse_regs))
+        return
+    # batches of files per task keep the pickling overhead small
+    chunksize = max(1, len(paths) // (jobs * 8))
+    with ProcessPoolExecutor(jobs) as executor:
+        yield from executor.map(compile_file, paths, repeat(cache_dir), repeat(reuse_regs), chunksize=chunksize)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Compile Lua files to binary chunks.')
+    arg_parser.add_argument('paths', nargs='+', help='.lua files or directories')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: cpu count)')
+    arg_parser.add_argument('-o', '--output', help='directory for the .luac files (default: check only)')
+    arg_parser.add_argument('--cache', help='directory of the compile cache (default: no cache)')
+    arg_parser.add_argument('--cache-size', type=int, default=256,
+                            help='cache size cap in MB, applied when the batch is done (default: 256)')
+    arg_parser.add_argument('--reuse-regs', action='store_true',
+                            help='reuse the registers of dead locals, for smaller stack frames')
+    args = arg_parser.parse_args(argv)
+
+    sources = list(find_sources(args.paths))
+    paths = [path for path, _ in sources]
+    begin = time.perf_counter()
+    failed = 0
+    cache = CompileCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    for (path, chunk, error, hit), (_, rel_path) in zip(compile_files(paths, args.jobs, args.cache, args.reuse_regs), sources):
+        if hit:
+            cache.hits += 1
+        elif hit is False:
+            cache.misses += 1
+        if error is not None:
+            failed += 1
+            print(error, file=sys.stderr)
+        elif args.output:
+            out_path = os.path.join(args.output, os.path.splitext(rel_path)[0] + '.luac')
+            os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+            with open(out_path, 'wb') as f:
+                f.write(chunk)
+    print('compiled %d files, %d failed, in %.3f s' % (len(paths) - failed, failed, time.perf_counter() - begin))
+    if cache:
+        size = cache.evict()
+        print('cache: %d hits, %d misses, %.1f MB' % (cache.hits, cache.misses, size / (1024 * 1024)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
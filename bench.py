@@ -0,0 +1,317 @@
+import sys
+import time
+import random
+import tracemalloc
+import lexer
+from parser import Parser
+from flatast import FlatAst, FlatVisitor
+from code import CodeGenerator
+import peephole
+import binchunk
+
+
+def timed(func):
+    begin = time.perf_counter()
+    func()
+    return time.perf_counter() - begin
+
+
+def lex_all(src, use_re):
+    lex = lexer.Lexer(src, 'bench.lua', use_re)
+    while lex.next_token().kind != lexer.TokenKind.EOF:
+        pass
+
+
+# time per MB should stay flat as literals grow
+def bench_string_literals(sizes=(1, 2, 5, 10)):
+    line = 'x' * 60 + '\\t\\x41\\065\\u{48}\\n'
+    print('string literals            MB   char(s)  regex(s)   MB/s')
+    for size in sizes:
+        count = size * 1024 * 1024 // len(line)
+        for name, src in [('short', 'local s = "' + line * count + '"'),
+                          ('long', 'local s = [==[\n' + line * count + ']==]')]:
+            char_time = timed(lambda: lex_all(src, False))
+            re_time = timed(lambda: lex_all(src, True))
+            print('%-24s %4d  %8.3f  %8.3f  %5.0f' % (name, size, char_time, re_time, size / re_time))
+
+
+def parse_all(src):
+    Parser(lexer.Lexer(src, 'bench.lua').tokenize()).parse()
+
+
+# a serialized data table, mostly numeric literals
+def bench_numbers(count=200000):
+    rand = random.Random(0)
+    literals = ['%d' % rand.randrange(1000), '%d.%d' % (rand.randrange(100), rand.randrange(100)),
+                '0x%X' % rand.randrange(1 << 20), '%de%d' % (rand.randrange(10), rand.randrange(10)), '3.']
+    src = 'return {' + ', '.join(rand.choice(literals) if rand.random() < 0.5 else str(rand.randrange(100000))
+                                 for _ in range(count)) + '}'
+    print('numbers: %d literals parsed in %.3f s' % (count, timed(lambda: parse_all(src))))
+
+
+# operator-dense expressions, best of a few runs
+def bench_expressions(count=20000, repeat=3):
+    rand = random.Random(0)
+    operands = ['a', 'b.c', '1', '2.5', '"s"', 't[i]', 'f(x)', 'nil', 'true']
+    ops = ['+', '-', '*', '/', '//', '%', '^', '..', '==', '~=', '<', '<=', '>', '>=',
+           'and', 'or', '&', '|', '~', '<<', '>>']
+
+    def exp(depth):
+        if depth == 0 or rand.random() < 0.2:
+            return rand.choice(operands)
+        roll = rand.random()
+        if roll < 0.15:
+            return rand.choice(['- ', 'not ', '#', '~ ']) + exp(depth - 1)
+        if roll < 0.25:
+            return '(' + exp(depth - 1) + ')'
+        return exp(depth - 1) + ' ' + rand.choice(ops) + ' ' + exp(depth - 1)
+    src = '\n'.join('local v%d = %s' % (i, exp(6)) for i in range(count))
+    stream = lexer.Lexer(src, 'bench.lua').tokenize()
+
+    def parse(use_stack):
+        stream.pos = 0
+        Parser(stream, use_stack).parse()
+    for use_stack in (False, True):
+        best = min(timed(lambda: parse(use_stack)) for _ in range(repeat))
+        print('expressions (%s): %d tokens parsed in %.3f s, %.0f tokens/s'
+              % ('stack' if use_stack else 'recursive', len(stream), best, len(stream) / best))
+
+
+# nesting far deeper than the recursion limit
+def bench_nesting(depth=100000):
+    for name, src in [('concat', 'local a = ' + ' .. '.join(['x'] * depth)),
+                      ('tables', 'local a = ' + '{' * depth + '}' * depth),
+                      ('calls', 'local a = ' + 'f(' * depth + ')' * depth)]:
+        stream = lexer.Lexer(src, 'bench.lua').tokenize()
+        print('nesting %-8s depth %d parsed in %.3f s' % (name, depth, timed(lambda: Parser(stream).parse())))
+
+
+# top level structure only: function bodies skipped, then all forced
+def bench_lazy(count=5000):
+    body = '''
+local function f%d(a, b, ...)
+    local t = {x = 1, y = "str", [a] = b, 1.5, 0x10}
+    if a > b and not t.x or #t == 3 then
+        return a .. b .. 'lit', f(a - 1, b * 2 ^ 3)
+    elseif a <= 2 then
+        for k, v in pairs(t) do print(k, v) end
+    else
+        while a ~= nil do a = a // 2 end
+    end
+    return obj:method(t, function() return a end, {1, 2, 3})
+end
+'''
+    src = ''.join(body % i for i in range(count))
+    stream = lexer.Lexer(src, 'bench.lua').tokenize()
+
+    def parse(lazy):
+        stream.pos = 0
+        return Parser(stream, lazy=lazy).parse()
+    print('lazy: eager parse %.3f s, lazy parse %.3f s' % (timed(lambda: parse(False)), timed(lambda: parse(True))))
+    tree = parse(True)
+    print('lazy: forcing all %d bodies %.3f s' % (count, timed(lambda: [stat.exp_list[0].body for stat in tree.stats])))
+
+
+# memory held by the AST of a large file
+def functions_source(count):
+    return ''.join('''
+local function f%d(a, b, ...)
+    local t = {x = 1, y = "str", [a] = b, 1.5, 0x10}
+    if a > b and not t.x or #t == 3 then
+        return a .. b .. 'lit', f(a - 1, b * 2 ^ 3)
+    else
+        while a ~= nil do a = a // 2 end
+    end
+    return obj:method(t, function() return a end, {1, 2, 3})
+end
+''' % i for i in range(count))
+
+
+def bench_ast_memory(count=2000):
+    src = functions_source(count)
+    stream = lexer.Lexer(src, 'bench.lua').tokenize()
+    tracemalloc.start()
+    tree = Parser(stream).parse()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('ast memory: %d KB source, %.1f MB held, %.1f MB peak' % (len(src) // 1024, current / 2**20, peak / 2**20))
+    return tree
+
+
+def bench_flat_ast(count=2000):
+    tree = Parser(lexer.Lexer(functions_source(count), 'bench.lua').tokenize()).parse()
+    tracemalloc.start()
+    flat = FlatAst.from_tree(tree)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    buf = flat.dumps()
+    print('flat ast: %d nodes, %.1f MB held, %d KB serialized' % (len(flat), current / 2**20, len(buf) // 1024))
+    print('  encode %.3f s, decode %.3f s, load %.3f s, walk %.3f s' % (
+        timed(lambda: FlatAst.from_tree(tree)), timed(flat.to_tree),
+        timed(lambda: FlatAst.loads(buf)), timed(lambda: FlatVisitor().visit(flat))))
+
+
+# straight-line functions whose locals are each used once or twice
+def locals_source(count, length=12):
+    lines = ['    local x1 = a + b']
+    lines += ['    local x%d = x%d * %d' % (i, i - 1, i) for i in range(2, length + 1)]
+    body = '\n'.join(lines)
+    return ''.join('''
+function g%d(a, b)
+%s
+    return x%d
+end
+''' % (i, body, length) for i in range(count))
+
+
+def stack_sizes(proto):
+    return [proto.max_stack_size] + [size for sub in proto.sub_proto_list for size in stack_sizes(sub)]
+
+
+# frame sizes with locals stacked as luac does, and with dead locals' registers reused
+def bench_registers(count=500):
+    for name, src in [('functions', functions_source(count).replace('local function', 'function')),
+                      ('locals', locals_source(count))]:
+        tree = Parser(lexer.Lexer(src, 'bench.lua').tokenize()).parse()
+        sizes = []
+        for reuse in (False, True):
+            begin = time.perf_counter()
+            proto = CodeGenerator(reuse_regs=reuse).gen_main_proto(tree)
+            sizes.append((sum(stack_sizes(proto)), time.perf_counter() - begin))
+        (stacked, stacked_time), (reused, reused_time) = sizes
+        print('registers %-9s max_stack_size total %d stacked, %d reused (-%.1f%%), in %.3f s / %.3f s' % (
+            name, stacked, reused, 100.0 * (stacked - reused) / stacked, stacked_time, reused_time))
+
+
+# loops and branches whose jumps the peephole pass threads or drops
+def branches_source(count):
+    return ''.join('''
+function h%d(t, n)
+    local s = 0
+    for i = 1, n do
+        if t[i] then
+            if i > 2 then s = s + i else s = s - i end
+        elseif not t[i + 1] then
+            while s > 100 do
+                if s %% 2 == 0 then s = s // 2 else s = s - 1 end
+            end
+        else
+            break
+        end
+    end
+    return s
+end
+''' % i for i in range(count))
+
+
+def inst_count(proto):
+    return len(proto.inst_list) + sum(inst_count(sub) for sub in proto.sub_proto_list)
+
+
+# luac's main prototype of src, from lupa's Lua 5.3 if it is installed
+def luac_proto(src):
+    try:
+        from lupa import lua53
+    except ImportError:
+        return None
+    dump = lua53.LuaRuntime(encoding=None).eval(b'function(src) return string.dump(assert(load(src)), true) end')
+    return binchunk.undump(bytes(dump(src.encode())))
+
+
+# instructions and frame sizes of proto, compiled from src, against luac's
+def print_against_luac(name, src, proto):
+    luac = luac_proto(src)
+    if luac is None:
+        print('%s %d instructions, max_stack_size total %d (no lupa, no luac baseline)' % (
+            name, inst_count(proto), sum(stack_sizes(proto))))
+        return
+    print('%s %d instructions, max_stack_size total %d; luac %d, %d' % (
+        name, inst_count(proto), sum(stack_sizes(proto)), inst_count(luac), sum(stack_sizes(luac))))
+
+
+def bench_peephole(count=500):
+    src = branches_source(count)
+    tree = Parser(lexer.Lexer(src, 'bench.lua').tokenize()).parse()
+    proto = CodeGenerator().gen_main_proto(tree)
+    before = inst_count(proto)
+    begin = time.perf_counter()
+    peephole.optimize(proto)
+    print('peephole instructions %d -> %d (-%.1f%%), in %.3f s' % (
+        before, inst_count(proto), 100.0 * (before - inst_count(proto)) / before, time.perf_counter() - begin))
+    print_against_luac('peephole', src, proto)
+
+
+# option checks in the style of config code
+def config_source(count):
+    return ''.join('''
+function check%d(opt)
+    if opt.width ~= nil and (opt.width < 1 or opt.width > 4096) then return false end
+    local mode = opt.fast and "fast" or opt.mode or "normal"
+    if not opt.name or #opt.name == 0 then opt.name = "default" end
+    while opt.retries > 0 and not opt.ok do opt.retries = opt.retries - 1 end
+    return mode == "fast" or opt.level >= 2 and opt.level <= 9
+end
+''' % i for i in range(count))
+
+
+def bench_conditions(count=1000):
+    src = config_source(count)
+    tree = Parser(lexer.Lexer(src, 'bench.lua').tokenize()).parse()
+    begin = time.perf_counter()
+    proto = CodeGenerator().gen_main_proto(tree)
+    print('conditions %d functions in %.3f s' % (count, time.perf_counter() - begin))
+    print_against_luac('conditions', src, proto)
+
+
+# method calls on receivers reached through fields; without method_calls
+# the receivers are passed explicitly, so each is evaluated twice
+def methods_source(count, method_calls=True):
+    def call(receiver, name, args):
+        if method_calls:
+            return '%s:%s(%s)' % (receiver, name, args)
+        return '%s.%s(%s)' % (receiver, name, ', '.join(filter(None, [receiver, args])))
+    body = '''
+    %s
+    %s
+    if %s then %s end''' % (
+        call('game.world.player', 'move', 'dt'),
+        call('game.world.player.body', 'apply', 'game.world.gravity, dt'),
+        call('game.ui', 'visible', ''),
+        call('game.ui.hud', 'draw', call('game.world.player', 'stats', '')))
+    return ''.join('''
+function update%d(game, dt)%s
+end
+''' % (i, body) for i in range(count))
+
+
+# method calls against the same calls with explicit receivers
+def bench_methods(count=1000):
+    counts = []
+    for method_calls in (False, True):
+        tree = Parser(lexer.Lexer(methods_source(count, method_calls), 'bench.lua').tokenize()).parse()
+        begin = time.perf_counter()
+        proto = CodeGenerator().gen_main_proto(tree)
+        counts.append((inst_count(proto), time.perf_counter() - begin))
+    (explicit, explicit_time), (methods, methods_time) = counts
+    print('methods %d functions, instructions %d explicit -> %d (-%.1f%%), in %.3f s / %.3f s' % (
+        count, explicit, methods, 100.0 * (explicit - methods) / explicit, explicit_time, methods_time))
+    print_against_luac('methods', methods_source(count), proto)
+
+
+benchmarks = {
+    'strings': bench_string_literals,
+    'numbers': bench_numbers,
+    'expressions': bench_expressions,
+    'nesting': bench_nesting,
+    'lazy': bench_lazy,
+    'ast_memory': bench_ast_memory,
+    'flat_ast': bench_flat_ast,
+    'registers': bench_registers,
+    'peephole': bench_peephole,
+    'conditions': bench_conditions,
+    'methods': bench_methods,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()
@@ -0,0 +1,202 @@
+import struct
+from code import Prototype
+
+# Lua 5.3 binary chunk, as written by luac and read by lua_load
+LUA_SIGNATURE = b'\x1bLua'
+LUAC_VERSION = 0x53
+LUAC_FORMAT = 0
+LUAC_DATA = b'\x19\x93\r\n\x1a\n'
+CINT_SIZE = 4
+CSIZET_SIZE = 8
+INSTRUCTION_SIZE = 4
+LUA_INTEGER_SIZE = 8
+LUA_NUMBER_SIZE = 8
+LUAC_INT = 0x5678
+LUAC_NUM = 370.5
+
+TAG_NIL = 0x00
+TAG_BOOLEAN = 0x01
+TAG_NUMBER = 0x03
+TAG_INTEGER = 0x13
+TAG_SHORT_STR = 0x04
+TAG_LONG_STR = 0x14
+
+# longest string stored as a short string
+LUAI_MAXSHORTLEN = 40
+
+
+class ChunkWriter:
+    """Serializes a Prototype tree to a binary chunk. Debug information
+    (line info, local and upvalue names) is stripped, as with luac -s."""
+    def __init__(self):
+        self.buf = bytearray()
+
+    def write_byte(self, val):
+        self.buf.append(val)
+
+    def write_uint32(self, val):
+        self.buf += struct.pack('<I', val)
+
+    def write_lua_integer(self, val):
+        self.buf += struct.pack('<q', val)
+
+    def write_lua_number(self, val):
+        self.buf += struct.pack('<d', val)
+
+    def write_bytes(self, data):
+        size = len(data) + 1
+        if size < 0xff:
+            self.write_byte(size)
+        else:
+            self.write_byte(0xff)
+            self.buf += struct.pack('<Q', size)
+        self.buf += data
+
+    def write_string(self, val):
+        if val is None:
+            self.write_byte(0)
+        else:
+            self.write_bytes(val.encode('utf-8', 'surrogateescape'))
+
+    def write_header(self):
+        self.buf += LUA_SIGNATURE
+        self.write_byte(LUAC_VERSION)
+        self.write_byte(LUAC_FORMAT)
+        self.buf += LUAC_DATA
+        self.write_byte(CINT_SIZE)
+        self.write_byte(CSIZET_SIZE)
+        self.write_byte(INSTRUCTION_SIZE)
+        self.write_byte(LUA_INTEGER_SIZE)
+        self.write_byte(LUA_NUMBER_SIZE)
+        self.write_lua_integer(LUAC_INT)
+        self.write_lua_number(LUAC_NUM)
+
+    def write_constant(self, val):
+        if val is None:
+            self.write_byte(TAG_NIL)
+        elif isinstance(val, bool):
+            self.write_byte(TAG_BOOLEAN)
+            self.write_byte(int(val))
+        elif isinstance(val, int):
+            self.write_byte(TAG_INTEGER)
+            self.write_lua_integer(val)
+        elif isinstance(val, float):
+            self.write_byte(TAG_NUMBER)
+            self.write_lua_number(val)
+        else:
+            data = val.encode('utf-8', 'surrogateescape')
+            self.write_byte(TAG_SHORT_STR if len(data) <= LUAI_MAXSHORTLEN else TAG_LONG_STR)
+            self.write_bytes(data)
+
+    def write_proto(self, proto, source, parent_source=None):
+        # sub functions from the same source leave it out
+        self.write_string(None if source == parent_source else source)
+        self.write_uint32(0)  # line defined
+        self.write_uint32(0)  # last line defined
+        self.write_byte(proto.num_params)
+        self.write_byte(1 if proto.is_vararg else 0)
+        self.write_byte(proto.max_stack_size)
+        self.write_uint32(len(proto.inst_list))
+        self.buf += struct.pack('<%dI' % len(proto.inst_list), *proto.inst_list)
+        self.write_uint32(len(proto.k_list))
+        for val in proto.k_list:
+            self.write_constant(val)
+        self.write_uint32(len(proto.upvalue_list))
+        for instack, idx in proto.upvalue_list:
+            self.write_byte(instack)
+            self.write_byte(idx)
+        self.write_uint32(len(proto.sub_proto_list))
+        for sub_proto in proto.sub_proto_list:
+            self.write_proto(sub_proto, source, source)
+        self.write_uint32(0)  # line info
+        self.write_uint32(0)  # local vars
+        self.write_uint32(0)  # upvalue names
+
+
+# binary chunk of a main function prototype, source is like '@main.lua'
+def dump(proto, source):
+    writer = ChunkWriter()
+    writer.write_header()
+    writer.write_byte(len(proto.upvalue_list))
+    writer.write_proto(proto, source)
+    return bytes(writer.buf)
+
+
+class ChunkReader:
+    """Reads a binary chunk back into a Prototype tree, as written by
+    ChunkWriter or luac. Debug information is skipped."""
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read_byte(self):
+        self.pos += 1
+        return self.data[self.pos - 1]
+
+    def read_unpack(self, fmt):
+        val, = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return val
+
+    def read_uint32(self):
+        return self.read_unpack('<I')
+
+    def read_string(self):
+        size = self.read_byte()
+        if size == 0xff:
+            size = self.read_unpack('<Q')
+        if size == 0:
+            return None
+        self.pos += size - 1
+        return self.data[self.pos - size + 1:self.pos].decode('utf-8', 'surrogateescape')
+
+    def check_header(self):
+        if self.data[:len(LUA_SIGNATURE)] != LUA_SIGNATURE:
+            raise Exception('not a binary chunk')
+        self.pos = len(LUA_SIGNATURE)
+        if self.read_byte() != LUAC_VERSION or self.read_byte() != LUAC_FORMAT:
+            raise Exception('version mismatch')
+        # data check, sizes and the test integer and number
+        self.pos += len(LUAC_DATA) + 5 + LUA_INTEGER_SIZE + LUA_NUMBER_SIZE
+
+    def read_constant(self):
+        tag = self.read_byte()
+        if tag == TAG_NIL:
+            return None
+        if tag == TAG_BOOLEAN:
+            return self.read_byte() != 0
+        if tag == TAG_INTEGER:
+            return self.read_unpack('<q')
+        if tag == TAG_NUMBER:
+            return self.read_unpack('<d')
+        return self.read_string()
+
+    def read_proto(self, parent=None):
+        proto = Prototype(parent)
+        self.read_string()  # source
+        self.pos += 8  # line defined, last line defined
+        proto.num_params = self.read_byte()
+        proto.is_vararg = self.read_byte() != 0
+        proto.max_stack_size = self.read_byte()
+        count = self.read_uint32()
+        proto.inst_list = list(struct.unpack_from('<%dI' % count, self.data, self.pos))
+        self.pos += count * INSTRUCTION_SIZE
+        proto.k_list = [self.read_constant() for _ in range(self.read_uint32())]
+        proto.upvalue_list = [(self.read_byte(), self.read_byte()) for _ in range(self.read_uint32())]
+        proto.sub_proto_list = [self.read_proto(proto) for _ in range(self.read_uint32())]
+        count = self.read_uint32()  # line info
+        self.pos += count * CINT_SIZE
+        for _ in range(self.read_uint32()):  # local vars
+            self.read_string()
+            self.pos += 2 * CINT_SIZE
+        for _ in range(self.read_uint32()):  # upvalue names
+            self.read_string()
+        return proto
+
+
+# main function prototype of a binary chunk
+def undump(data):
+    reader = ChunkReader(data)
+    reader.check_header()
+    reader.read_byte()  # number of upvalues
+    return reader.read_proto()
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import tempfile
+
+# modules whose code decides the compiled output; batch.py chooses the passes
+compiler_modules = ['lexer.py', 'parser.py', 'ast.py', 'number.py', 'visitor.py', 'constfold.py', 'scope.py',
+                    'code.py', 'peephole.py', 'binchunk.py', 'batch.py']
+
+
+# hash of the compiler sources, so any change to the compiler misses the cache
+def compiler_version():
+    h = hashlib.sha256()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in compiler_modules:
+        with open(os.path.join(base, name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class CompileCache:
+    """Compiled chunks on disk, keyed by a hash of the compiler version, the
+    options and the source bytes. Entries are written to a temporary file and
+    renamed into place, so processes can share a cache directory. A hit
+    touches the entry, and evict() removes the least recently used entries
+    until the cache fits in max_size bytes."""
+    version = None
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        if CompileCache.version is None:
+            CompileCache.version = compiler_version()
+
+    def key(self, src, options=''):
+        h = hashlib.sha256()
+        h.update(self.version.encode())
+        h.update(b'\0' + options.encode() + b'\0')
+        h.update(src)
+        return h.hexdigest()
+
+    def path_of(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        path = self.path_of(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self.path_of(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def evict(self):
+        entries = []
+        total = 0
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.startswith('.tmp'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+        return total
@@ -0,0 +1,86 @@
+import sys
+import lexer
+import binchunk
+import peephole
+from parser import Parser
+from code import CodeGenerator
+from constfold import fold_constants
+
+# Regression checks: each chunk is compiled here and run in lupa's Lua 5.3,
+# and what it prints has to match what Lua prints running the source.
+
+
+def compile_chunk(src, reuse_regs=False, fold=True):
+    block = Parser(lexer.Lexer(src, 'check.lua').tokenize()).parse()
+    if fold:
+        block = fold_constants(block)
+    proto = peephole.optimize(CodeGenerator(reuse_regs=reuse_regs).gen_main_proto(block))
+    return binchunk.dump(proto, '@check.lua')
+
+
+# lines printed by chunk, loaded as source or as a binary chunk
+def run_lua(chunk, mode):
+    from lupa import lua53
+    lua = lua53.LuaRuntime(encoding=None)
+    run = lua.eval(b'''function(chunk, mode)
+        local out = {}
+        local env = setmetatable({print = function(...)
+            local t = table.pack(...)
+            for i = 1, t.n do t[i] = tostring(t[i]) end
+            out[#out + 1] = table.concat(t, '\\t')
+        end}, {__index = _G})
+        assert(load(chunk, '=check', mode, env))()
+        return table.concat(out, '\\n')
+    end''')
+    return run(chunk, mode).decode()
+
+
+# src must print the same compiled here, in both register modes, as in Lua
+def check_output(name, src, **options):
+    expected = run_lua(src.encode(), b't')
+    for reuse_regs in (False, True):
+        got = run_lua(compile_chunk(src, reuse_regs, **options), b'b')
+        if got != expected:
+            print('%s FAILED (reuse_regs=%s)\n  lua:  %r\n  ours: %r' % (name, reuse_regs, expected, got))
+            return False
+    print('%s ok' % name)
+    return True
+
+
+# a local assigned in a multiple assignment that is also the table or key
+# of an earlier target is read before the assignment
+def check_assign_conflicts():
+    ok = check_output('assign key', 'local a = {} local i = 3 a[i], i = i, 5 print(a[3], a[5], i)')
+    ok &= check_output('assign table', 'local t = {} local u = t t.x, t = 1, {} print(u.x, t.x)')
+    ok &= check_output('assign upvalue', '''
+local g = {}
+local function f() g.y, g = 2, {} end
+local old = g
+f()
+print(old.y, g.y)''')
+    return ok
+
+
+# arithmetic on strings gives floats, bitwise operators on them integers
+def check_string_arith():
+    src = '''
+print("10" + 5, -"2", '3' * '4', "7" // 2, "0x10" % 3, 2 ^ "2")
+print(math.type("10" + 5), "3" | 0, ~"0x10", "1.0" << 2)'''
+    ok = check_output('string arith folded', src)
+    ok &= check_output('string arith unfolded', src, fold=False)
+    return ok
+
+
+checks = {
+    'assign_conflicts': check_assign_conflicts,
+    'string_arith': check_string_arith,
+}
+
+if __name__ == '__main__':
+    try:
+        import lupa.lua53
+    except ImportError:
+        print('lupa is not installed, nothing to check against')
+        sys.exit(0)
+    results = [checks[name]() for name in sys.argv[1:] or checks]
+    sys.exit(0 if all(results) else 1)
@@ -1,5 +1,8 @@
 import ast
+import lexer
+import scope
 from enum import Enum
+from visitor import DispatchTable
 
 SIZE_C = 9
 SIZE_B = 9
@@ -19,6 +22,12 @@ MAXARG_sBx = MAXARG_Bx >> 1
 MAXARG_A = ((1 << SIZE_A)-1)
 MAXARG_B = ((1 << SIZE_B)-1)
 MAXARG_C = ((1 << SIZE_C)-1)
+MAXARG_Ax = ((1 << SIZE_Ax)-1)
+# RK operands with this bit set are constant indexes
+BITRK = (1 << (SIZE_B - 1))
+MAXINDEXRK = (BITRK - 1)
+# array items stored per SETLIST
+LFIELDS_PER_FLUSH = 50
 
 
 class OpCode(Enum):
@@ -71,6 +80,48 @@ class OpCode(Enum):
     OP_EXTRAARG = 46
 
 
+ABX_OPS = (OpCode.OP_LOADK, OpCode.OP_LOADKX, OpCode.OP_CLOSURE)
+ASBX_OPS = (OpCode.OP_JMP, OpCode.OP_FORLOOP, OpCode.OP_FORPREP, OpCode.OP_TFORLOOP)
+ARITH_OPS = (OpCode.OP_ADD, OpCode.OP_SUB, OpCode.OP_MUL, OpCode.OP_MOD, OpCode.OP_POW,
+             OpCode.OP_DIV, OpCode.OP_IDIV, OpCode.OP_BAND, OpCode.OP_BOR, OpCode.OP_BXOR,
+             OpCode.OP_SHL, OpCode.OP_SHR)
+COMPARE_OPS = (OpCode.OP_EQ, OpCode.OP_LT, OpCode.OP_LE)
+# operands that may be constants (RK), shown as -1-index in listings
+RK_B_OPS = (OpCode.OP_SETTABUP, OpCode.OP_SETTABLE) + ARITH_OPS + COMPARE_OPS
+RK_C_OPS = (OpCode.OP_GETTABUP, OpCode.OP_GETTABLE, OpCode.OP_SETTABUP, OpCode.OP_SETTABLE,
+            OpCode.OP_SELF) + ARITH_OPS + COMPARE_OPS
+
+
+class Instruction:
+    def __init__(self, code):
+        self.code = code
+        self.op = OpCode(code >> POS_OP & ((1 << SIZE_OP) - 1))
+        self.a = code >> POS_A & MAXARG_A
+        self.b = code >> POS_B & MAXARG_B
+        self.c = code >> POS_C & MAXARG_C
+        self.bx = code >> POS_Bx & MAXARG_Bx
+        self.sbx = self.bx - MAXARG_sBx
+        self.ax = code >> POS_Ax & MAXARG_Ax
+
+    @staticmethod
+    def rk(arg):
+        return -1 - (arg & ~BITRK) if arg & BITRK else arg
+
+    def __str__(self):
+        op = self.op
+        if op in ABX_OPS:
+            args = (self.a, -1 - self.bx if op == OpCode.OP_LOADK else self.bx)
+        elif op in ASBX_OPS:
+            args = (self.a, self.sbx)
+        elif op == OpCode.OP_EXTRAARG:
+            args = (self.ax,)
+        else:
+            b = self.rk(self.b) if op in RK_B_OPS else self.b
+            c = self.rk(self.c) if op in RK_C_OPS else self.c
+            args = (self.a, b, c)
+        return '%-9s\t%s' % (op.name[3:], ' '.join(str(arg) for arg in args))
+
+
 class Prototype:
     def __init__(self, parent):
         # 固定参数的数目
@@ -118,46 +169,181 @@ class Prototype:
             print('\t%d\t%s' % (idx+1, item))
 
 
-class LocalVarInfo:
-    def __init__(self, name, prev, scope_level, slot):
-        self.name = name
-        self.prev = prev
-        self.scope_level = scope_level
-        self.slot = slot
+class BlockInfo:
+    def __init__(self, parent, nactvar, reg_level, is_loop):
+        self.parent = parent
+        # 进入块时活跃的局部变量数目
+        self.nactvar = nactvar
+        # 进入块时局部变量占用的寄存器数目, 块内被捕获的局部变量都在它之上
+        self.reg_level = reg_level
+        self.is_loop = is_loop
+        # 标签名 -> (pc, 活跃局部变量数目, 寄存器数目)
+        self.labels = {}
+        # 未解决的goto: [标签名, pc, 活跃局部变量数目, 寄存器数目]
+        self.gotos = []
+        # 语句序号 -> 在该语句之后不再使用的局部变量的序号
+        self.dying = {}
 
 
 class FunctionInfo:
-    def __init__(self, parent, func_def_exp):
+    """State of the function being generated. active_vars holds the
+    LocalVar of each local in scope, numbered as in the symbol table, and
+    active_regs the register of each. reg_vars holds the local in each
+    register below the free ones, None for a hole left by a dead local.
+
+    With reuse_regs, a local not captured by a closure frees its register
+    after the last statement of its scope that uses it, and new single
+    locals take the lowest hole. Otherwise locals are stacked as luac does."""
+    def __init__(self, parent, func_def_exp, func_scope, reuse_regs=False):
         self.parent = parent
+        self.reuse_regs = reuse_regs
+        self.func_scope = func_scope
         self.sub_func_list = []
-        self.local_var_list = []
-        self.local_var_table = {}
+        self.local_var_list = func_scope.local_vars
+        # constant index by (type, value), so 1, 1.0 and true stay apart
         self.constants_table = {}
-        self.unvalue_table = {}
-        self.break_list = []
+        self.constants = []
         self.inst_list = []
-        self.scope_level = 0
+        self.active_vars = []
+        self.active_regs = []
+        self.reg_vars = []
+        self.block = None
         self.used_reg = 0
         self.max_reg = 0
         self.param_num = len(func_def_exp.parlist)
         self.is_var_arg = func_def_exp.is_var_arg
+        self.upvalues = [(upval.instack, upval.idx) for upval in func_scope.upvalues]
+        if parent is not None:
+            # captured locals by their register in the parent, at the closure
+            self.upvalues = [(instack, parent.active_regs[idx] if instack else idx)
+                             for instack, idx in self.upvalues]
 
     def add_sub_func(self, fi):
         self.sub_func_list.append(fi)
 
-    def add_local_vars(self, names):
-        for name in names:
-            self.add_local_var(name)
+    def pc(self):
+        return len(self.inst_list)
 
-    def add_local_var(self, name):
-        local_var = LocalVarInfo(name, self.local_var_table.get(
-            name), self.scope_level, self.alloc_reg())
-        self.local_var_list.append(local_var)
-        self.local_var_table[name] = local_var
-        return local_var.slot
+    # bring local var into scope in register reg, allocated already
+    def add_local_var(self, var, reg):
+        idx = len(self.active_vars)
+        if var.slot != idx:
+            raise Exception("local '%s' declared out of order" % var.name)
+        self.active_vars.append(var)
+        self.active_regs.append(reg)
+        reg_vars = self.reg_vars
+        if reg >= len(reg_vars):
+            reg_vars.extend([None] * (reg + 1 - len(reg_vars)))
+        reg_vars[reg] = var
+        if self.reuse_regs and var.last_use is not None and not var.captured:
+            self.block.dying.setdefault(var.last_use, []).append(idx)
 
-    def exit_scope(self):
-        pass
+    # the three locals of a for loop from register base on
+    def add_hidden_vars(self, names, base):
+        for idx, name in enumerate(names):
+            self.add_local_var(scope.LocalVar(name, len(self.active_vars)), base + idx)
+
+    # register for a new local: the lowest hole if it may take one, else a new one
+    def alloc_local_reg(self, var):
+        if self.reuse_regs and not var.captured and None in self.reg_vars:
+            reg = self.reg_vars.index(None)
+            # keep the hole for this local until it is added
+            self.reg_vars[reg] = True
+            return reg
+        return self.alloc_reg()
+
+    # free the register of the local numbered idx
+    def release_var(self, idx):
+        reg_vars = self.reg_vars
+        reg = self.active_regs[idx]
+        if reg < len(reg_vars) and reg_vars[reg] is self.active_vars[idx]:
+            reg_vars[reg] = None
+            while reg_vars and reg_vars[-1] is None:
+                reg_vars.pop()
+
+    def release_dying(self, stat_idx):
+        for idx in self.block.dying.pop(stat_idx, ()):
+            self.release_var(idx)
+
+    # whether register reg may be used as scratch, holding no local
+    def is_temp(self, reg):
+        return reg >= len(self.reg_vars) or not isinstance(self.reg_vars[reg], scope.LocalVar)
+
+    def enter_block(self, is_loop):
+        self.block = BlockInfo(self.block, len(self.active_vars), len(self.reg_vars), is_loop)
+
+    def captures_from(self, level, end=None):
+        return any(var.captured for var in self.active_vars[level:end])
+
+    def exit_block(self):
+        block = self.block
+        nactvar = block.nactvar
+        reg_level = block.reg_level
+        has_upval = self.captures_from(nactvar)
+        if has_upval and block.parent is not None:
+            # jump to here, closing the upvalues of the block
+            self.emit_jmp(reg_level + 1, 0)
+        if block.is_loop:
+            # break jumps to the end of the loop
+            for goto in block.gotos:
+                if goto[0] == 'break':
+                    self.patch_to_here([goto[1]])
+            block.gotos = [goto for goto in block.gotos if goto[0] != 'break']
+        self.block = block.parent
+        for idx in range(len(self.active_vars) - 1, nactvar - 1, -1):
+            self.release_var(idx)
+        del self.active_vars[nactvar:]
+        del self.active_regs[nactvar:]
+        self.used_reg = len(self.reg_vars)
+        for goto in block.gotos:
+            if block.parent is None:
+                if goto[0] == 'break':
+                    raise Exception("break outside a loop")
+                raise Exception("no visible label '%s' for <goto>" % goto[0])
+            if goto[2] > nactvar:
+                if has_upval:
+                    self.patch_close(goto[1], reg_level)
+                goto[2] = nactvar
+                goto[3] = reg_level
+            if not self.find_label(block.parent, goto):
+                block.parent.gotos.append(goto)
+
+    def add_goto(self, name):
+        goto = [name, self.emit_jmp(0, 0), len(self.active_vars), len(self.reg_vars)]
+        if not self.find_label(self.block, goto):
+            self.block.gotos.append(goto)
+
+    # close a goto with a label defined before it in block
+    def find_label(self, block, goto):
+        label = block.labels.get(goto[0])
+        if label is None:
+            return False
+        pc, nactvar, reg_level = label
+        if goto[2] > nactvar and self.captures_from(nactvar, goto[2]):
+            self.patch_close(goto[1], reg_level)
+        self.patch_list([goto[1]], pc)
+        return True
+
+    # at_end: only void statements follow, so the block's locals are out of scope
+    def add_label(self, name, at_end):
+        block = self.block
+        if name in block.labels:
+            raise Exception("label '%s' already defined" % name)
+        if at_end:
+            block.labels[name] = (self.pc(), block.nactvar, block.reg_level)
+        else:
+            block.labels[name] = (self.pc(), len(self.active_vars), len(self.reg_vars))
+        nactvar = block.labels[name][1]
+        pending = []
+        for goto in block.gotos:
+            if goto[0] != name:
+                pending.append(goto)
+                continue
+            if goto[2] < nactvar:
+                raise Exception("<goto %s> jumps into the scope of local '%s'"
+                                % (name, self.active_vars[goto[2]].name))
+            self.patch_to_here([goto[1]])
+        block.gotos = pending
 
     def alloc_reg(self):
         self.used_reg = self.used_reg + 1
@@ -167,28 +353,127 @@ class FunctionInfo:
             self.max_reg = self.used_reg
         return self.used_reg - 1
 
+    def alloc_regs(self, num):
+        for _ in range(num):
+            self.alloc_reg()
+        return self.used_reg - num
+
     def free_reg(self):
         if self.used_reg <= 0:
             raise Exception("used_reg <= 0")
         self.used_reg = self.used_reg - 1
 
+    # make sure num registers above the used ones exist
+    def check_stack(self, num):
+        if self.used_reg + num > self.max_reg:
+            self.max_reg = self.used_reg + num
+
+    def index_of_constant(self, val):
+        # floats by their bits, so 0.0 and -0.0 are different constants
+        key = (float, val.hex()) if type(val) is float else (type(val), val)
+        idx = self.constants_table.get(key)
+        if idx is None:
+            idx = self.constants_table[key] = len(self.constants)
+            self.constants.append(val)
+        return idx
+
+    # RK operand of a constant, or a register it is loaded into
+    def constant_rk(self, val):
+        idx = self.index_of_constant(val)
+        if idx <= MAXINDEXRK:
+            return idx | BITRK
+        reg = self.alloc_reg()
+        self.emit_loadk(reg, val)
+        return reg
+
     def emit_ABC(self, op, a, b, c):
         if a > MAXARG_A or b > MAXARG_B or c > MAXARG_C:
             raise Exception("emit_ABC arg is to big")
         inst = (c << POS_C | b << POS_B | a << POS_A | op << POS_OP) & INS_MASK
         self.inst_list.append(inst)
+        return len(self.inst_list) - 1
 
     def emit_ABx(self, op, a, bx):
         if a > MAXARG_A or bx > MAXARG_Bx:
             raise Exception("emit_ABx arg is to big")
         inst = (bx << POS_Bx | a << POS_A | op << POS_OP) & INS_MASK
         self.inst_list.append(inst)
+        return len(self.inst_list) - 1
 
     def emit_AsBx(self, op, a, sbx):
         if a > MAXARG_A or sbx > MAXARG_sBx or sbx < -MAXARG_sBx:
             raise Exception("emit_AsBx arg is to big")
-        inst = ((sbx+MAXARG_sBx) << POS_Bx | a << POS_A) & INS_MASK
+        inst = ((sbx+MAXARG_sBx) << POS_Bx | a << POS_A | op << POS_OP) & INS_MASK
         self.inst_list.append(inst)
+        return len(self.inst_list) - 1
+
+    def emit_Ax(self, op, ax):
+        if ax > MAXARG_Ax:
+            raise Exception("emit_Ax arg is to big")
+        self.inst_list.append((ax << POS_Ax | op << POS_OP) & INS_MASK)
+        return len(self.inst_list) - 1
+
+    # set the sBx of the jump at pc
+    def fix_sbx(self, pc, sbx):
+        if sbx > MAXARG_sBx or sbx < -MAXARG_sBx:
+            raise Exception("control structure too long")
+        inst = self.inst_list[pc] & ~(MAXARG_Bx << POS_Bx)
+        self.inst_list[pc] = inst | (sbx + MAXARG_sBx) << POS_Bx
+
+    # jump lists are lists of the pcs of jumps to the same target, patched
+    # when it is known
+    def patch_list(self, jumps, target):
+        for pc in jumps:
+            self.fix_sbx(pc, target - pc - 1)
+
+    def patch_to_here(self, jumps):
+        self.patch_list(jumps, len(self.inst_list))
+
+    # make the jump at pc close the upvalues from register level on
+    def patch_close(self, pc, level):
+        a = self.inst_list[pc] >> POS_A & MAXARG_A
+        if a == 0 or a > level + 1:
+            inst = self.inst_list[pc] & ~(MAXARG_A << POS_A)
+            self.inst_list[pc] = inst | (level + 1) << POS_A
+
+    # change the opcode of the instruction at pc, keeping its operands
+    def set_opcode(self, pc, op):
+        mask = ((1 << SIZE_OP) - 1) << POS_OP
+        self.inst_list[pc] = self.inst_list[pc] & ~mask | op << POS_OP
+
+    # OP_MOVE,/*	A B	R(A) := R(B)					*/
+    def emit_move(self, a, b):
+        self.emit_ABC(OpCode.OP_MOVE.value, a, b, 0)
+
+    # OP_LOADK,/*	A Bx	R(A) := Kst(Bx)					*/
+    # OP_LOADKX,/*	A 	R(A) := Kst(extra arg)				*/
+    def emit_loadk(self, a, val):
+        idx = self.index_of_constant(val)
+        if idx <= MAXARG_Bx:
+            self.emit_ABx(OpCode.OP_LOADK.value, a, idx)
+        else:
+            self.emit_ABx(OpCode.OP_LOADKX.value, a, 0)
+            self.emit_Ax(OpCode.OP_EXTRAARG.value, idx)
+
+    # OP_LOADBOOL,/*	A B C	R(A) := (Bool)B; if (C) pc++			*/
+    def emit_loadbool(self, a, b, c):
+        self.emit_ABC(OpCode.OP_LOADBOOL.value, a, b, c)
+
+    # OP_LOADNIL,/*	A B	R(A), R(A+1), ..., R(A+B) := nil		*/
+    def emit_loadnil(self, a, num):
+        self.emit_ABC(OpCode.OP_LOADNIL.value, a, num - 1, 0)
+
+    # OP_JMP,/*	A sBx	pc+=sBx; if (A) close all upvalues >= R(A - 1)	*/
+    def emit_jmp(self, a, sbx):
+        return self.emit_AsBx(OpCode.OP_JMP.value, a, sbx)
+
+    # OP_TEST,/*	A C	if not (R(A) <=> C) then pc++			*/
+    def emit_test(self, a, c):
+        self.emit_ABC(OpCode.OP_TEST.value, a, 0, c)
+
+    # OP_TESTSET,/*	A B C	if (R(B) <=> C) then R(A) := R(B) else pc++	*/
+    def emit_testset(self, a, b, c):
+        self.emit_ABC(OpCode.OP_TESTSET.value, a, b, c)
 
     # OP_RETURN,/*	A B	return R(A), ... ,R(A+B-2)	(see note)	*/
     def emit_return(self, first_slot, num):
@@ -198,10 +483,26 @@ class FunctionInfo:
     def emit_closure(self, des_reg, idx):
         self.emit_ABx(OpCode.OP_CLOSURE.value, des_reg, idx)
 
+    # OP_SETLIST,/*	A B C	R(A)[(C-1)*FPF+i] := R(A+i), 1 <= i <= B	*/
+    def emit_setlist(self, a, num, batch):
+        if batch <= MAXARG_C:
+            self.emit_ABC(OpCode.OP_SETLIST.value, a, num, batch)
+        else:
+            self.emit_ABC(OpCode.OP_SETLIST.value, a, num, 0)
+            self.emit_Ax(OpCode.OP_EXTRAARG.value, batch)
+
+    # (instack, idx) of each upvalue, in upvalue order
+    def get_upvalues(self):
+        return self.upvalues
+
+    def get_constants(self):
+        return self.constants
+
     def to_proto(self, parent):
         curr = Prototype(parent)
         curr.is_vararg = self.is_var_arg
-        curr.max_stack_size = self.max_reg
+        # registers 0 and 1 are always valid
+        curr.max_stack_size = max(self.max_reg, 2)
         curr.num_params = self.param_num
         curr.inst_list = self.inst_list
         curr.upvalue_list = self.get_upvalues()
@@ -212,26 +513,709 @@ class FunctionInfo:
         return curr
 
 
+# expressions built at the top of the stack
+TOP_EXPS = ('function_call_exp', 'table_constructor_exp')
+CONSTANT_EXPS = ('nil_exp', 'bool_constant_exp', 'integer_exp', 'float_exp', 'string_exp')
+
+
+# "floating point byte" of a table size hint, as luaO_int2fb
+def int2fb(x):
+    if x < 8:
+        return x
+    e = 0
+    while x >= (8 << 4):
+        x = (x + 0xf) >> 4
+        e += 4
+    while x >= (8 << 1):
+        x = (x + 1) >> 1
+        e += 1
+    return ((e + 1) << 3) | (x - 8)
+
+
+def is_multi_value(exp):
+    return exp.name == 'function_call_exp' or exp.name == 'vararg_exp'
+
+
 class CodeGenerator:
-    def __init__(self):
+    """Generates the prototypes of a chunk. gen_<node name> methods are
+    looked up through a dispatch table by node class; statements take
+    (fi, node), expressions (fi, node, a, n) and put n values in the
+    registers from a on, or all of them if n is -1. An expression may
+    target any register, and ones that need the registers above their
+    target (calls, table constructors) work at the top and move the result
+    down. Locals are used in place as operands, without a MOVE."""
+    arith_ops = {
+        lexer.TokenKind.OP_ADD: OpCode.OP_ADD,
+        lexer.TokenKind.OP_MINUS: OpCode.OP_SUB,
+        lexer.TokenKind.OP_MUL: OpCode.OP_MUL,
+        lexer.TokenKind.OP_MOD: OpCode.OP_MOD,
+        lexer.TokenKind.OP_POW: OpCode.OP_POW,
+        lexer.TokenKind.OP_DIV: OpCode.OP_DIV,
+        lexer.TokenKind.OP_IDIV: OpCode.OP_IDIV,
+        lexer.TokenKind.OP_BAND: OpCode.OP_BAND,
+        lexer.TokenKind.OP_BOR: OpCode.OP_BOR,
+        lexer.TokenKind.OP_WAVE: OpCode.OP_BXOR,
+        lexer.TokenKind.OP_SHL: OpCode.OP_SHL,
+        lexer.TokenKind.OP_SHR: OpCode.OP_SHR,
+    }
+    # (opcode, A, operands swapped)
+    compare_ops = {
+        lexer.TokenKind.OP_EQ: (OpCode.OP_EQ, 1, False),
+        lexer.TokenKind.OP_NE: (OpCode.OP_EQ, 0, False),
+        lexer.TokenKind.OP_LT: (OpCode.OP_LT, 1, False),
+        lexer.TokenKind.OP_LE: (OpCode.OP_LE, 1, False),
+        lexer.TokenKind.OP_GT: (OpCode.OP_LT, 1, True),
+        lexer.TokenKind.OP_GE: (OpCode.OP_LE, 1, True),
+    }
+    unop_ops = {
+        lexer.TokenKind.OP_MINUS: OpCode.OP_UNM,
+        lexer.TokenKind.OP_WAVE: OpCode.OP_BNOT,
+        lexer.TokenKind.OP_NOT: OpCode.OP_NOT,
+        lexer.TokenKind.OP_LEN: OpCode.OP_LEN,
+    }
+
+    def __init__(self, symbols=None, reuse_regs=False):
         super().__init__()
+        self.symbols = symbols
+        self.reuse_regs = reuse_regs
 
     def gen_main_proto(self, main_block):
-        entry_fd = ast.FunctionDefExp([], True, None)
-        entry_fi = FunctionInfo(None, entry_fd)
-        entry_fi.add_local_var('_ENV')
+        if self.symbols is None:
+            self.symbols = scope.resolve(main_block)
         main_fd = ast.FunctionDefExp([], True, main_block)
-        self.gen_func_def_exp(entry_fi, main_fd, 0)
-        return entry_fi.sub_func_list[0].to_proto(None)
+        fi = FunctionInfo(None, main_fd, self.symbols.main, self.reuse_regs)
+        self.gen_func_body(fi, main_fd)
+        return fi.to_proto(None)
 
-    def gen_func_def_exp(self, fi, fd, alloc_reg):
-        sub_fi = FunctionInfo(fi, fd)
-        fi.add_sub_func(sub_fi)
-        sub_fi.add_local_vars(fd.parlist)
-        self.gen_block(sub_fi, fd.body)
-        sub_fi.exit_scope()
-        sub_fi.emit_return(0, 0)
-        fi.emit_closure(alloc_reg, len(fi.sub_func_list)-1)
+    def gen_func_body(self, fi, fd):
+        fi.enter_block(False)
+        base = fi.alloc_regs(len(fd.parlist))
+        for idx, param in enumerate(fd.parlist):
+            fi.add_local_var(self.symbols.decls[param], base + idx)
+        self.gen_stats(fi, fd.body.stats)
+        fi.exit_block()
+        # a body ending in return needs no final one
+        if not fd.body.stats or fd.body.stats[-1].name != 'ret_stat':
+            fi.emit_return(0, 0)
+
+    def gen_stats(self, fi, stats, in_repeat=False):
+        table = self.gen_table
+        # unused parameters and loop variables
+        fi.release_dying(-1)
+        for idx, stat in enumerate(stats):
+            if stat.name == 'label_stat':
+                # a label followed only by void statements is at the end of its block
+                at_end = not in_repeat and all(
+                    it.name == 'label_stat' or it.name == 'empty_stat' for it in stats[idx+1:])
+                fi.add_label(stat.label, at_end)
+            elif stat.name == 'function_call_exp':
+                # a call statement keeps no results
+                self.gen_function_call_exp(fi, stat, fi.alloc_reg(), 0)
+            else:
+                table[type(stat)](self, fi, stat)
+            fi.release_dying(idx)
+            # free the temporaries of the statement
+            fi.used_reg = len(fi.reg_vars)
 
     def gen_block(self, fi, block):
+        fi.enter_block(False)
+        self.gen_stats(fi, block.stats)
+        fi.exit_block()
+
+    def gen_exp(self, fi, node, a, n=1):
+        self.gen_table[type(node)](self, fi, node, a, n)
+
+    # resolution of a name, with locals given by register
+    def resolve(self, fi, node):
+        kind, idx = self.symbols.names[node]
+        if kind == scope.LOCAL:
+            return kind, fi.active_regs[idx]
+        if kind == scope.GLOBAL and idx[0] == scope.LOCAL:
+            return kind, (scope.LOCAL, fi.active_regs[idx[1]])
+        return kind, idx
+
+    # register holding the value of node: its own for a local, else a new one
+    def exp_to_reg(self, fi, node):
+        if node.name == 'name_exp':
+            kind, idx = self.resolve(fi, node)
+            if kind == scope.LOCAL:
+                return idx
+        reg = fi.alloc_reg()
+        self.gen_exp(fi, node, reg, 1)
+        return reg
+
+    # RK operand of node: a constant index if it is a constant, else a register
+    def exp_to_rk(self, fi, node):
+        name = node.name
+        if name == 'integer_exp':
+            return fi.constant_rk(node.int_val)
+        if name == 'float_exp':
+            return fi.constant_rk(node.float_val)
+        if name == 'string_exp':
+            return fi.constant_rk(node.string)
+        if name == 'bool_constant_exp':
+            return fi.constant_rk(node.bool_val)
+        if name == 'nil_exp':
+            return fi.constant_rk(None)
+        return self.exp_to_reg(fi, node)
+
+    # like exp_to_reg, but a temporary target register a is used for the value
+    def exp_to_target(self, fi, node, a):
+        if not fi.is_temp(a):
+            return self.exp_to_reg(fi, node)
+        if node.name == 'name_exp':
+            kind, idx = self.resolve(fi, node)
+            if kind == scope.LOCAL:
+                return idx
+        self.gen_exp(fi, node, a, 1)
+        return a
+
+    # evaluate exps into n new consecutive registers, or into as many as the
+    # last exp has values if n is -1; returns the first register
+    def gen_exp_list(self, fi, exps, n):
+        base = fi.used_reg
+        count = len(exps)
+        for idx, exp in enumerate(exps):
+            if idx == count - 1 and is_multi_value(exp):
+                want = -1 if n < 0 else max(n - idx, 0)
+                reg = fi.alloc_regs(max(want, 1))
+                self.gen_exp(fi, exp, reg, want)
+                if want == 0:
+                    fi.free_reg()
+                return base
+            reg = fi.alloc_reg()
+            self.gen_exp(fi, exp, reg, 1)
+            if 0 <= n <= idx:
+                # extra values are evaluated and dropped
+                fi.free_reg()
+        if count < n:
+            fi.emit_loadnil(fi.alloc_regs(n - count), n - count)
+        return base
+
+    # jumps taken when node is true if jump_if, else when it is false; the
+    # other case falls through, like the t/f lists of luac's expdesc. A free
+    # temporary register a may be given to compute operands in.
+    def gen_cond_jump(self, fi, node, jump_if=False, a=-1):
+        name = node.name
+        # 'not' swaps the sense of the test instead of making a value
+        while name == 'unop_exp' and node.unop == lexer.TokenKind.OP_NOT:
+            node = node.op_num
+            name = node.name
+            jump_if = not jump_if
+        if name == 'binop_exp':
+            op = node.binop
+            if op in self.compare_ops:
+                return [self.gen_compare_jump(fi, node, jump_if, a)]
+            if op == lexer.TokenKind.OP_AND or op == lexer.TokenKind.OP_OR:
+                if jump_if == (op == lexer.TokenKind.OP_OR):
+                    # a or b jumps when either is true, a and b when either is false
+                    return self.gen_cond_jump(fi, node.op_left, jump_if, a) + \
+                        self.gen_cond_jump(fi, node.op_right, jump_if, a)
+                # the left value decides alone when it jumps the other way
+                jumps_skip = self.gen_cond_jump(fi, node.op_left, not jump_if, a)
+                jumps = self.gen_cond_jump(fi, node.op_right, jump_if, a)
+                fi.patch_to_here(jumps_skip)
+                return jumps
+        if name in ('integer_exp', 'float_exp', 'string_exp', 'function_def_exp'):
+            truthy = True
+        elif name == 'nil_exp' or name == 'bool_constant_exp':
+            truthy = name == 'bool_constant_exp' and node.bool_val
+        else:
+            save = fi.used_reg
+            reg = self.exp_to_reg(fi, node) if a < 0 else self.exp_to_target(fi, node, a)
+            # OP_TEST,/*	A C	if not (R(A) <=> C) then pc++			*/
+            fi.emit_test(reg, 1 if jump_if else 0)
+            fi.used_reg = save
+            return [fi.emit_jmp(0, 0)]
+        return [fi.emit_jmp(0, 0)] if truthy == jump_if else []
+
+    # like gen_cond_jump, for the left operand of an and/or whose value is
+    # kept: a plain value jumps with itself in a, these jumps are returned
+    # apart; the others stand for the boolean jump_if
+    def gen_cond_exits(self, fi, node, jump_if, a):
+        if node.name == 'binop_exp' and node.binop in (lexer.TokenKind.OP_AND, lexer.TokenKind.OP_OR):
+            if jump_if == (node.binop == lexer.TokenKind.OP_OR):
+                jumps, value_jumps = self.gen_cond_exits(fi, node.op_left, jump_if, a)
+                right_jumps, right_value_jumps = self.gen_cond_exits(fi, node.op_right, jump_if, a)
+                return jumps + right_jumps, value_jumps + right_value_jumps
+            jumps_skip = self.gen_cond_jump(fi, node.op_left, not jump_if, a)
+            jumps, value_jumps = self.gen_cond_exits(fi, node.op_right, jump_if, a)
+            fi.patch_to_here(jumps_skip)
+            return jumps, value_jumps
+        if self.is_bool_exp(node):
+            return self.gen_cond_jump(fi, node, jump_if, a), []
+        save = fi.used_reg
+        b = self.exp_to_target(fi, node, a)
+        if b == a:
+            fi.emit_test(a, 1 if jump_if else 0)
+        else:
+            fi.emit_testset(a, b, 1 if jump_if else 0)
+        fi.used_reg = save
+        return [], [fi.emit_jmp(0, 0)]
+
+    # Code for the value of node in a, leaving (true_jumps, false_jumps,
+    # value_jumps, is_jump): jumps standing for true or false, jumps with
+    # the value in a, and whether falling through stands for false rather
+    # than a value in a. Nested and/or share the lists, so one LOADBOOL
+    # pair serves the whole expression, as luac's exp2reg.
+    def gen_bool_exp(self, fi, node, a):
+        if node.name == 'binop_exp' and node.binop in (lexer.TokenKind.OP_AND, lexer.TokenKind.OP_OR):
+            jump_if = node.binop == lexer.TokenKind.OP_OR
+            jumps, value_jumps = self.gen_cond_exits(fi, node.op_left, jump_if, a)
+            true_jumps, false_jumps, right_value_jumps, is_jump = self.gen_bool_exp(fi, node.op_right, a)
+            (true_jumps if jump_if else false_jumps).extend(jumps)
+            return true_jumps, false_jumps, value_jumps + right_value_jumps, is_jump
+        if self.is_bool_exp(node):
+            return self.gen_cond_jump(fi, node, True, a), [], [], True
+        self.gen_exp(fi, node, a)
+        return [], [], [], False
+
+    def gen_bool_value(self, fi, node, a):
+        save = fi.used_reg
+        true_jumps, false_jumps, value_jumps, is_jump = self.gen_bool_exp(fi, node, a)
+        if true_jumps or false_jumps or is_jump:
+            if not is_jump:
+                value_jumps.append(fi.emit_jmp(0, 0))
+            fi.patch_to_here(false_jumps)
+            fi.emit_loadbool(a, 0, 1)
+            fi.patch_to_here(true_jumps)
+            fi.emit_loadbool(a, 1, 0)
+        fi.patch_to_here(value_jumps)
+        fi.used_reg = save
+
+    # a comparison, or a 'not' of a condition: only the jumps of a
+    # condition are made for it, with the value loaded where it is needed
+    def is_bool_exp(self, node):
+        if node.name == 'unop_exp' and node.unop == lexer.TokenKind.OP_NOT:
+            while node.name == 'unop_exp' and node.unop == lexer.TokenKind.OP_NOT:
+                node = node.op_num
+            return node.name == 'binop_exp' and (node.binop in self.compare_ops or
+                                                 node.binop in (lexer.TokenKind.OP_AND, lexer.TokenKind.OP_OR))
+        return node.name == 'binop_exp' and node.binop in self.compare_ops
+
+    # a comparison and the jump it guards, taken when the result is jump_if;
+    # > and >= swap the operands of LT and LE. The first operand that needs
+    # code goes to the free temporary register a if one is given.
+    def gen_compare_jump(self, fi, node, jump_if, a=-1):
+        opcode, cond, swap = self.compare_ops[node.binop]
+        save = fi.used_reg
+        if a >= 0 and node.op_left.name not in CONSTANT_EXPS:
+            b = self.exp_to_target(fi, node.op_left, a)
+            c = self.exp_to_rk(fi, node.op_right)
+        else:
+            b = self.exp_to_rk(fi, node.op_left)
+            if a >= 0 and node.op_right.name not in CONSTANT_EXPS:
+                c = self.exp_to_target(fi, node.op_right, a)
+            else:
+                c = self.exp_to_rk(fi, node.op_right)
+        if swap:
+            b, c = c, b
+        # OP_EQ,/*	A B C	if ((RK(B) == RK(C)) ~= A) then pc++		*/
+        fi.emit_ABC(opcode.value, cond if jump_if else 1 - cond, b, c)
+        fi.used_reg = save
+        return fi.emit_jmp(0, 0)
+
+    def gen_empty_stat(self, fi, node):
         pass
+
+    def gen_break_stat(self, fi, node):
+        fi.add_goto('break')
+
+    def gen_goto_stat(self, fi, node):
+        fi.add_goto(node.label)
+
+    def gen_do_stat(self, fi, node):
+        self.gen_block(fi, node.block)
+
+    def gen_local_decl_stat(self, fi, node):
+        decls = [self.symbols.decls[name] for name in node.val_list]
+        exps = node.exp_list
+        if fi.reuse_regs and len(exps) >= len(decls) and \
+                not any(exp.name in TOP_EXPS for exp in exps[:len(decls)]):
+            # each value goes straight to the register of its local, which
+            # may be a hole
+            regs = []
+            for idx, exp in enumerate(exps):
+                if idx < len(decls):
+                    reg = fi.alloc_local_reg(decls[idx])
+                    regs.append(reg)
+                    self.gen_exp(fi, exp, reg, 1)
+                else:
+                    # extra values are evaluated and dropped
+                    save = fi.used_reg
+                    self.gen_exp(fi, exp, fi.alloc_reg(), 0 if is_multi_value(exp) else 1)
+                    fi.used_reg = save
+        else:
+            base = self.gen_exp_list(fi, exps, len(decls))
+            regs = range(base, base + len(decls))
+        for var, reg in zip(decls, regs):
+            fi.add_local_var(var, reg)
+
+    def gen_local_func_def_stat(self, fi, node):
+        var = self.symbols.decls[node.val_list[0]]
+        reg = fi.alloc_local_reg(var)
+        fi.add_local_var(var, reg)
+        self.gen_exp(fi, node.exp_list[0], reg)
+
+    def gen_while_stat(self, fi, node):
+        fi.enter_block(True)
+        pc_before = fi.pc()
+        jmps_end = self.gen_cond_jump(fi, node.exp)
+        self.gen_block(fi, node.block)
+        fi.patch_list([fi.emit_jmp(0, 0)], pc_before)
+        fi.patch_to_here(jmps_end)
+        fi.exit_block()
+
+    def gen_repeat_stat(self, fi, node):
+        fi.enter_block(True)
+        pc_before = fi.pc()
+        # the condition is in the scope of the body
+        fi.enter_block(False)
+        self.gen_stats(fi, node.block.stats, True)
+        jmps_back = self.gen_cond_jump(fi, node.exp)
+        if fi.captures_from(fi.block.nactvar):
+            for jmp in jmps_back:
+                fi.patch_close(jmp, fi.block.reg_level)
+        fi.patch_list(jmps_back, pc_before)
+        fi.exit_block()
+        fi.exit_block()
+
+    def gen_if_stat(self, fi, node):
+        jmps_to_end = []
+        last = len(node.exp_list) - 1
+        for idx, (exp, block) in enumerate(zip(node.exp_list, node.block_list)):
+            jmps_false = self.gen_cond_jump(fi, exp)
+            self.gen_block(fi, block)
+            if idx < last:
+                jmps_to_end.append(fi.emit_jmp(0, 0))
+            fi.patch_to_here(jmps_false)
+        fi.patch_to_here(jmps_to_end)
+
+    def gen_for_num_stat(self, fi, node):
+        fi.enter_block(True)
+        step_exp = node.step_exp if node.step_exp is not None else ast.IntegerExp(1)
+        base = self.gen_exp_list(fi, [node.init_exp, node.limit_exp, step_exp], 3)
+        fi.add_hidden_vars(['(for index)', '(for limit)', '(for step)'], base)
+        fi.enter_block(False)
+        fi.add_local_var(self.symbols.decls[node.var_name], fi.alloc_reg())
+        # OP_FORPREP,/*	A sBx	R(A)-=R(A+2); pc+=sBx				*/
+        pc_prep = fi.emit_AsBx(OpCode.OP_FORPREP.value, base, 0)
+        self.gen_stats(fi, node.block.stats)
+        fi.exit_block()
+        # OP_FORLOOP,/*	A sBx	R(A)+=R(A+2); if R(A) <?= R(A+1) then { pc+=sBx; R(A+3)=R(A) }*/
+        pc_loop = fi.emit_AsBx(OpCode.OP_FORLOOP.value, base, 0)
+        fi.fix_sbx(pc_prep, pc_loop - pc_prep - 1)
+        fi.fix_sbx(pc_loop, pc_prep - pc_loop)
+        fi.exit_block()
+
+    def gen_for_in_stat(self, fi, node):
+        fi.enter_block(True)
+        base = self.gen_exp_list(fi, node.exp_list, 3)
+        fi.add_hidden_vars(['(for generator)', '(for state)', '(for control)'], base)
+        # the generator is called above the loop variables' slots
+        fi.check_stack(3)
+        fi.enter_block(False)
+        first = fi.alloc_regs(len(node.name_list))
+        for idx, name in enumerate(node.name_list):
+            fi.add_local_var(self.symbols.decls[name], first + idx)
+        jmp_call = fi.emit_jmp(0, 0)
+        self.gen_stats(fi, node.block.stats)
+        fi.exit_block()
+        fi.patch_to_here([jmp_call])
+        # OP_TFORCALL,/*	A C	R(A+3), ... ,R(A+2+C) := R(A)(R(A+1), R(A+2));	*/
+        fi.emit_ABC(OpCode.OP_TFORCALL.value, base, 0, len(node.name_list))
+        # OP_TFORLOOP,/*	A sBx	if R(A+1) ~= nil then { R(A)=R(A+1); pc += sBx }*/
+        pc_loop = fi.emit_AsBx(OpCode.OP_TFORLOOP.value, base + 2, 0)
+        fi.fix_sbx(pc_loop, jmp_call - pc_loop)
+        fi.exit_block()
+
+    # store the value in register reg to a variable
+    def gen_store(self, fi, var, reg):
+        if var.name == 'name_exp':
+            kind, idx = self.resolve(fi, var)
+            if kind == scope.LOCAL:
+                if idx != reg:
+                    fi.emit_move(idx, reg)
+            elif kind == scope.UPVALUE:
+                # OP_SETUPVAL,/*	A B	UpValue[B] := R(A)			*/
+                fi.emit_ABC(OpCode.OP_SETUPVAL.value, reg, idx, 0)
+            else:
+                self.gen_table_store(fi, idx, fi.constant_rk(var.id_name), reg)
+        else:
+            table = self.table_operand(fi, var.exp)
+            self.gen_table_store(fi, table, self.exp_to_rk(fi, var.idx_exp), reg)
+
+    # a table operand: (UPVALUE, index) or (LOCAL, register)
+    def table_operand(self, fi, node, a=None):
+        if node.name == 'name_exp':
+            found = self.resolve(fi, node)
+            if found[0] == scope.UPVALUE:
+                return found
+        if a is None:
+            return scope.LOCAL, self.exp_to_reg(fi, node)
+        return scope.LOCAL, self.exp_to_target(fi, node, a)
+
+    def gen_table_store(self, fi, table, key, reg):
+        kind, idx = table
+        if kind == scope.UPVALUE:
+            # OP_SETTABUP,/*	A B C	UpValue[A][RK(B)] := RK(C)			*/
+            fi.emit_ABC(OpCode.OP_SETTABUP.value, idx, key, reg)
+        else:
+            # OP_SETTABLE,/*	A B C	R(A)[RK(B)] := RK(C)				*/
+            fi.emit_ABC(OpCode.OP_SETTABLE.value, idx, key, reg)
+
+    def gen_table_load(self, fi, a, table, key):
+        kind, idx = table
+        if kind == scope.UPVALUE:
+            # OP_GETTABUP,/*	A B C	R(A) := UpValue[B][RK(C)]			*/
+            fi.emit_ABC(OpCode.OP_GETTABUP.value, a, idx, key)
+        else:
+            # OP_GETTABLE,/*	A B C	R(A) := R(B)[RK(C)]				*/
+            fi.emit_ABC(OpCode.OP_GETTABLE.value, a, idx, key)
+
+    def gen_assign_stat(self, fi, node):
+        var_list, exp_list = node.var_list, node.exp_list
+        if len(var_list) == 1 and len(exp_list) == 1:
+            var, exp = var_list[0], exp_list[0]
+            if var.name == 'name_exp' and self.resolve(fi, var)[0] == scope.LOCAL:
+                # compute straight into the local
+                self.gen_exp(fi, exp, self.resolve(fi, var)[1], 1)
+                return
+            if var.name == 'table_access_exp':
+                table = self.table_operand(fi, var.exp)
+                key = self.exp_to_rk(fi, var.idx_exp)
+                self.gen_table_store(fi, table, key, self.exp_to_rk(fi, exp))
+            elif self.resolve(fi, var)[0] == scope.GLOBAL:
+                key = fi.constant_rk(var.id_name)
+                self.gen_table_store(fi, self.resolve(fi, var)[1], key, self.exp_to_rk(fi, exp))
+            else:
+                self.gen_store(fi, var, self.exp_to_reg(fi, exp))
+            return
+        # tables and keys are evaluated before the values, and all values
+        # before any store
+        targets = []
+        for var in var_list:
+            if var.name == 'table_access_exp':
+                table = self.table_operand(fi, var.exp)
+                targets.append((var, table, self.exp_to_rk(fi, var.idx_exp)))
+            else:
+                targets.append((var, None, None))
+        self.copy_conflicts(fi, targets)
+        base = self.gen_exp_list(fi, exp_list, len(var_list))
+        # stored from the last target on, as luac does
+        for idx in range(len(targets) - 1, -1, -1):
+            var, table, key = targets[idx]
+            if table is None:
+                self.gen_store(fi, var, base + idx)
+            else:
+                self.gen_table_store(fi, table, key, base + idx)
+
+    # A local or upvalue assigned by a later target is stored before the
+    # earlier targets are, so where it is the table or key of one of them
+    # it is copied to a new register first, as luac's check_conflict.
+    def copy_conflicts(self, fi, targets):
+        for idx, (var, _, _) in enumerate(targets):
+            if var.name != 'name_exp':
+                continue
+            kind, slot = self.resolve(fi, var)
+            if kind == scope.GLOBAL:
+                continue
+            reg = None
+            for pos in range(idx):
+                other, table, key = targets[pos]
+                if table is None:
+                    continue
+                conflict_table = table == (kind, slot)
+                conflict_key = kind == scope.LOCAL and key == slot
+                if not (conflict_table or conflict_key):
+                    continue
+                if reg is None:
+                    reg = fi.alloc_reg()
+                    self.gen_exp(fi, var, reg, 1)
+                targets[pos] = (other, (scope.LOCAL, reg) if conflict_table else table,
+                                reg if conflict_key else key)
+
+    def gen_ret_stat(self, fi, node):
+        exps = node.exp_list
+        if not exps:
+            fi.emit_return(0, 0)
+        elif len(exps) == 1 and exps[0].name == 'name_exp' and \
+                self.resolve(fi, exps[0])[0] == scope.LOCAL:
+            fi.emit_return(self.resolve(fi, exps[0])[1], 1)
+        elif len(exps) == 1 and exps[0].name == 'function_call_exp':
+            # a call in tail position takes over the frame, its CALL with
+            # all results becomes a TAILCALL
+            base = self.gen_exp_list(fi, exps, -1)
+            # OP_TAILCALL,/*	A B C	return R(A)(R(A+1), ... ,R(A+B-1))		*/
+            fi.set_opcode(fi.pc() - 1, OpCode.OP_TAILCALL.value)
+            fi.emit_return(base, -1)
+        else:
+            base = self.gen_exp_list(fi, exps, -1)
+            fi.emit_return(base, -1 if is_multi_value(exps[-1]) else len(exps))
+
+    def gen_nil_exp(self, fi, node, a, n):
+        fi.emit_loadnil(a, max(n, 1))
+
+    def gen_bool_constant_exp(self, fi, node, a, n):
+        fi.emit_loadbool(a, 1 if node.bool_val else 0, 0)
+
+    def gen_integer_exp(self, fi, node, a, n):
+        fi.emit_loadk(a, node.int_val)
+
+    def gen_float_exp(self, fi, node, a, n):
+        fi.emit_loadk(a, node.float_val)
+
+    def gen_string_exp(self, fi, node, a, n):
+        fi.emit_loadk(a, node.string)
+
+    def gen_vararg_exp(self, fi, node, a, n):
+        if not fi.is_var_arg:
+            raise Exception("cannot use '...' outside a vararg function")
+        # OP_VARARG,/*	A B	R(A), R(A+1), ..., R(A+B-2) = vararg		*/
+        fi.emit_ABC(OpCode.OP_VARARG.value, a, n + 1, 0)
+
+    def gen_parens_exp(self, fi, node, a, n):
+        self.gen_exp(fi, node.exp, a, 1)
+
+    def gen_function_def_exp(self, fi, node, a, n):
+        # the GC check of OP_CLOSURE takes the registers above A as dead, so a
+        # closure is made at the top, as OP_NEWTABLE is
+        if a + 1 != fi.used_reg:
+            self.gen_at_top(fi, self.gen_function_def_exp, node, a)
+            return
+        sub_fi = FunctionInfo(fi, node, self.symbols.functions[node], self.reuse_regs)
+        self.gen_func_body(sub_fi, node)
+        fi.add_sub_func(sub_fi)
+        fi.emit_closure(a, len(fi.sub_func_list) - 1)
+
+    def gen_name_exp(self, fi, node, a, n):
+        kind, idx = self.resolve(fi, node)
+        if kind == scope.LOCAL:
+            if idx != a:
+                fi.emit_move(a, idx)
+        elif kind == scope.UPVALUE:
+            # OP_GETUPVAL,/*	A B	R(A) := UpValue[B]				*/
+            fi.emit_ABC(OpCode.OP_GETUPVAL.value, a, idx, 0)
+        else:
+            save = fi.used_reg
+            self.gen_table_load(fi, a, idx, fi.constant_rk(node.id_name))
+            fi.used_reg = save
+
+    def gen_table_access_exp(self, fi, node, a, n):
+        save = fi.used_reg
+        table = self.table_operand(fi, node.exp, a)
+        key = node.idx_exp
+        if key.name not in CONSTANT_EXPS and table != (scope.LOCAL, a):
+            # the table is not in a, which can take the key
+            key_rk = self.exp_to_target(fi, key, a)
+        else:
+            key_rk = self.exp_to_rk(fi, key)
+        self.gen_table_load(fi, a, table, key_rk)
+        fi.used_reg = save
+
+    # run gen at a new top register and move its value to a
+    def gen_at_top(self, fi, gen, node, a):
+        reg = fi.alloc_reg()
+        gen(fi, node, reg, 1)
+        fi.emit_move(a, reg)
+        fi.free_reg()
+
+    def gen_function_call_exp(self, fi, node, a, n):
+        # a local target is read until the call is made
+        if a + max(n, 1) != fi.used_reg or not fi.is_temp(a):
+            self.gen_at_top(fi, self.gen_function_call_exp, node, a)
+            return
+        save = fi.used_reg
+        fi.used_reg = a + 1
+        args = node.args_exp
+        if node.method is None:
+            self.gen_exp(fi, node.prefix_exp, a)
+        else:
+            # the receiver is evaluated once, for both the lookup and self
+            b = self.exp_to_target(fi, node.prefix_exp, a)
+            fi.alloc_reg()
+            c = fi.constant_rk(node.method.string)
+            # OP_SELF,/*	A B C	R(A+1) := R(B); R(A) := R(B)[RK(C)]		*/
+            fi.emit_ABC(OpCode.OP_SELF.value, a, b, c)
+            fi.used_reg = a + 2
+        self.gen_exp_list(fi, args, -1)
+        num_args = -1 if args and is_multi_value(args[-1]) else len(args) + (node.method is not None)
+        # OP_CALL,/*	A B C	R(A), ... ,R(A+C-2) := R(A)(R(A+1), ... ,R(A+B-1)) */
+        fi.emit_ABC(OpCode.OP_CALL.value, a, num_args + 1, n + 1)
+        fi.used_reg = save
+
+    def gen_table_constructor_exp(self, fi, node, a, n):
+        if a + 1 != fi.used_reg or not fi.is_temp(a):
+            self.gen_at_top(fi, self.gen_table_constructor_exp, node, a)
+            return
+        keys, vals = node.key_list, node.val_list
+        count = len(vals)
+        multi = count > 0 and keys[-1].name == 'nil_exp' and is_multi_value(vals[-1])
+        num_arr = sum(1 for key in keys if key.name == 'nil_exp') - multi
+        # OP_NEWTABLE,/*	A B C	R(A) := {} (size = B,C)				*/
+        fi.emit_ABC(OpCode.OP_NEWTABLE.value, a, int2fb(num_arr), int2fb(count - num_arr - multi))
+        stored = 0
+        pending = 0
+        for idx, (key, val) in enumerate(zip(keys, vals)):
+            if key.name == 'nil_exp':
+                reg = fi.alloc_reg()
+                if multi and idx == count - 1:
+                    self.gen_exp(fi, val, reg, -1)
+                    fi.emit_setlist(a, 0, stored // LFIELDS_PER_FLUSH + 1)
+                    pending = 0
+                    break
+                self.gen_exp(fi, val, reg, 1)
+                pending += 1
+                if pending == LFIELDS_PER_FLUSH:
+                    fi.emit_setlist(a, pending, stored // LFIELDS_PER_FLUSH + 1)
+                    stored += pending
+                    pending = 0
+                    fi.used_reg = a + 1
+            else:
+                save = fi.used_reg
+                key_rk = self.exp_to_rk(fi, key)
+                fi.emit_ABC(OpCode.OP_SETTABLE.value, a, key_rk, self.exp_to_rk(fi, val))
+                fi.used_reg = save
+        if pending:
+            fi.emit_setlist(a, pending, stored // LFIELDS_PER_FLUSH + 1)
+        fi.used_reg = a + 1
+
+    def gen_unop_exp(self, fi, node, a, n):
+        if self.is_bool_exp(node):
+            self.gen_bool_value(fi, node, a)
+            return
+        save = fi.used_reg
+        reg = self.exp_to_target(fi, node.op_num, a)
+        fi.emit_ABC(self.unop_ops[node.unop].value, a, reg, 0)
+        fi.used_reg = save
+
+    def gen_binop_exp(self, fi, node, a, n):
+        op = node.binop
+        save = fi.used_reg
+        if op == lexer.TokenKind.OP_AND or op == lexer.TokenKind.OP_OR or op in self.compare_ops:
+            self.gen_bool_value(fi, node, a)
+        elif op == lexer.TokenKind.OP_CONCAT:
+            # a..b..c is one CONCAT over consecutive registers
+            parts = [node.op_left]
+            right = node.op_right
+            while right.name == 'binop_exp' and right.binop == lexer.TokenKind.OP_CONCAT:
+                parts.append(right.op_left)
+                right = right.op_right
+            parts.append(right)
+            base = fi.used_reg
+            for part in parts:
+                self.gen_exp(fi, part, fi.alloc_reg())
+            # OP_CONCAT,/*	A B C	R(A) := R(B).. ... ..R(C)			*/
+            fi.emit_ABC(OpCode.OP_CONCAT.value, a, base, fi.used_reg - 1)
+        else:
+            left = node.op_left
+            if left.name in CONSTANT_EXPS:
+                b = self.exp_to_rk(fi, left)
+            else:
+                b = self.exp_to_target(fi, left, a)
+            c = self.exp_to_rk(fi, node.op_right)
+            fi.emit_ABC(self.arith_ops[op].value, a, b, c)
+        fi.used_reg = save
+
+
+CodeGenerator.gen_table = DispatchTable(CodeGenerator, 'gen_')
@@ -0,0 +1,222 @@
+import math
+import ast
+import lexer
+import number
+from visitor import Transformer
+
+TokenKind = lexer.TokenKind
+
+
+# value of a constant expression, the node itself if it is not one
+def const_value(node):
+    name = node.name
+    if name == 'integer_exp':
+        return node.int_val
+    if name == 'float_exp':
+        return node.float_val
+    if name == 'string_exp':
+        return node.string
+    if name == 'bool_constant_exp':
+        return node.bool_val
+    if name == 'nil_exp':
+        return None
+    return node
+
+
+def is_number(val):
+    return type(val) is int or type(val) is float
+
+
+# operand of an arithmetic operator; like luac, strings are not folded, as
+# Lua converts them to floats at run time
+def to_arith(val):
+    return val if is_number(val) else None
+
+
+def arith_add(a, b):
+    if type(a) is int and type(b) is int:
+        return number.wrap_integer(a + b)
+    return float(a) + float(b)
+
+
+def arith_sub(a, b):
+    if type(a) is int and type(b) is int:
+        return number.wrap_integer(a - b)
+    return float(a) - float(b)
+
+
+def arith_mul(a, b):
+    if type(a) is int and type(b) is int:
+        return number.wrap_integer(a * b)
+    return float(a) * float(b)
+
+
+def arith_div(a, b):
+    return float(a) / float(b)
+
+
+def arith_pow(a, b):
+    return math.pow(a, b)
+
+
+# floor division and modulo round towards minus infinity, like Python's
+def arith_idiv(a, b):
+    if type(a) is int and type(b) is int:
+        return number.wrap_integer(a // b)
+    return float(math.floor(float(a) / float(b)))
+
+
+def arith_mod(a, b):
+    if type(a) is int and type(b) is int:
+        return a % b
+    a, b = float(a), float(b)
+    m = math.fmod(a, b)
+    if m * b < 0:
+        m += b
+    return m
+
+
+def shift_left(a, b):
+    if b <= -64 or b >= 64:
+        return 0
+    if b >= 0:
+        return number.wrap_integer(a << b)
+    # logical shift of the unsigned value
+    return number.wrap_integer((a & 0xffffffffffffffff) >> -b)
+
+
+arith_ops = {
+    TokenKind.OP_ADD: arith_add,
+    TokenKind.OP_MINUS: arith_sub,
+    TokenKind.OP_MUL: arith_mul,
+    TokenKind.OP_DIV: arith_div,
+    TokenKind.OP_POW: arith_pow,
+    TokenKind.OP_IDIV: arith_idiv,
+    TokenKind.OP_MOD: arith_mod,
+}
+bitwise_ops = {
+    TokenKind.OP_BAND: lambda a, b: a & b,
+    TokenKind.OP_BOR: lambda a, b: a | b,
+    TokenKind.OP_WAVE: lambda a, b: a ^ b,
+    TokenKind.OP_SHL: shift_left,
+    TokenKind.OP_SHR: lambda a, b: shift_left(a, number.wrap_integer(-b)),
+}
+order_ops = {
+    TokenKind.OP_LT: lambda a, b: a < b,
+    TokenKind.OP_LE: lambda a, b: a <= b,
+    TokenKind.OP_GT: lambda a, b: a > b,
+    TokenKind.OP_GE: lambda a, b: a >= b,
+}
+# operators where a zero divisor is left to fail or give inf/nan at run time
+division_ops = (TokenKind.OP_DIV, TokenKind.OP_IDIV, TokenKind.OP_MOD)
+
+
+def raw_equal(a, b):
+    if is_number(a) and is_number(b):
+        return a == b
+    return type(a) is type(b) and a == b
+
+
+# result of a binary operator on constants, None if it is not folded
+def fold_binop(op, a, b):
+    if op in arith_ops:
+        a, b = to_arith(a), to_arith(b)
+        if a is None or b is None or (op in division_ops and b == 0):
+            return None
+        try:
+            return arith_ops[op](a, b)
+        except (ArithmeticError, ValueError):
+            return None
+    if op in bitwise_ops:
+        a, b = number.to_integer(a), number.to_integer(b)
+        if a is None or b is None:
+            return None
+        return bitwise_ops[op](a, b)
+    if op == TokenKind.OP_CONCAT:
+        if not (type(a) is str or is_number(a)) or not (type(b) is str or is_number(b)):
+            return None
+        if a != a or b != b:
+            # nan prints differently across platforms
+            return None
+        a = a if type(a) is str else number.number_to_string(a)
+        b = b if type(b) is str else number.number_to_string(b)
+        return a + b
+    # strings compare by locale at run time, so only numbers are ordered here
+    if op in order_ops:
+        if is_number(a) and is_number(b):
+            return order_ops[op](a, b)
+        return None
+    if op == TokenKind.OP_EQ:
+        return raw_equal(a, b)
+    if op == TokenKind.OP_NE:
+        return not raw_equal(a, b)
+    return None
+
+
+# result of a unary operator on a constant, None if it is not folded
+def fold_unop(op, a):
+    if op == TokenKind.OP_NOT:
+        return a is None or a is False
+    if op == TokenKind.OP_MINUS:
+        a = to_arith(a)
+        if a is None:
+            return None
+        return number.wrap_integer(-a) if type(a) is int else -a
+    if op == TokenKind.OP_WAVE:
+        a = number.to_integer(a)
+        return None if a is None else ~a
+    if op == TokenKind.OP_LEN:
+        if type(a) is str:
+            return len(a.encode('utf-8', 'surrogateescape'))
+    return None
+
+
+def const_node(val, pos):
+    if type(val) is bool:
+        return ast.BoolConstExp(val, pos)
+    if type(val) is int:
+        return ast.IntegerExp(val, pos)
+    if type(val) is float:
+        return ast.FloatExp(val, pos)
+    return ast.StringExp(val, pos)
+
+
+# folded node, or the node itself; like luac, float results that are nan
+# or zero (which may be -0.0) stay as they are
+def folded(node, val):
+    if val is None or (type(val) is float and (val != val or val == 0)):
+        return node
+    return const_node(val, node.pos)
+
+
+class ConstantFolder(Transformer):
+    """Folds operators on constant operands, bottom-up, with Lua 5.3
+    semantics. 'and' and 'or' with a constant left operand are reduced to
+    the operand they yield, unless that is a call or '...', whose extra
+    results the operator would have cut off."""
+    def visit_binop_exp(self, node):
+        left = const_value(node.op_left)
+        op = node.binop
+        if op == TokenKind.OP_AND or op == TokenKind.OP_OR:
+            if left is node.op_left:
+                return node
+            truthy = left is not None and left is not False
+            if truthy == (op == TokenKind.OP_OR):
+                return node.op_left
+            if node.op_right.name in ('function_call_exp', 'vararg_exp'):
+                return node
+            return node.op_right
+        right = const_value(node.op_right)
+        if left is node.op_left or right is node.op_right:
+            return node
+        return folded(node, fold_binop(op, left, right))
+
+    def visit_unop_exp(self, node):
+        val = const_value(node.op_num)
+        if val is node.op_num:
+            return node
+        return folded(node, fold_unop(node.unop, val))
+
+
+def fold_constants(tree):
+    return ConstantFolder().transform(tree)
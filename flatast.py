@@ -0,0 +1,253 @@
+from array import array
+import marshal
+import struct
+import ast
+import lexer
+
+# field types of the node classes
+NODE = 0   # a child node
+OPT = 1    # a child node or None
+LIST = 2   # a list of child nodes
+VALUE = 3  # a string or number, stored in the literal pool
+BOOL = 4   # stored as 0 or 1
+OP = 5     # a TokenKind, stored as its code
+
+# fields of each node class in constructor order
+node_fields = [
+    (ast.Block, [('stats', LIST)]),
+    (ast.EmptyStat, []),
+    (ast.BreakStat, []),
+    (ast.LabelStat, [('label', VALUE)]),
+    (ast.GotoStat, [('label', VALUE)]),
+    (ast.DoStat, [('block', NODE)]),
+    (ast.LocalDeclStat, [('val_list', LIST), ('exp_list', LIST)]),
+    (ast.WhileStat, [('exp', NODE), ('block', NODE)]),
+    (ast.RepeatStat, [('exp', NODE), ('block', NODE)]),
+    (ast.IfStat, [('exp_list', LIST), ('block_list', LIST)]),
+    (ast.ForNumStat, [('var_name', NODE), ('init_exp', NODE), ('limit_exp', NODE), ('step_exp', OPT), ('block', NODE)]),
+    (ast.ForInStat, [('name_list', LIST), ('exp_list', LIST), ('block', NODE)]),
+    (ast.AssignStat, [('var_list', LIST), ('exp_list', LIST)]),
+    (ast.RetStat, [('exp_list', LIST)]),
+    (ast.StringExp, [('string', VALUE)]),
+    (ast.BinopExp, [('op_left', NODE), ('op_right', NODE), ('binop', OP)]),
+    (ast.UnopExp, [('op_num', NODE), ('unop', OP)]),
+    (ast.NilExp, []),
+    (ast.BoolConstExp, [('bool_val', BOOL)]),
+    (ast.VarargExp, []),
+    (ast.NameExp, [('id_name', VALUE)]),
+    (ast.TableAccessExp, [('exp', NODE), ('idx_exp', NODE)]),
+    (ast.TableConstructorExp, [('key_list', LIST), ('val_list', LIST)]),
+    (ast.FunctionCallExp, [('prefix_exp', NODE), ('method', OPT), ('args_exp', LIST)]),
+    (ast.FunctionDefExp, [('parlist', LIST), ('is_var_arg', BOOL), ('body', OPT)]),
+    (ast.IntegerExp, [('int_val', VALUE)]),
+    (ast.FloatExp, [('float_val', VALUE)]),
+    (ast.LocalFuncDefStat, [('val_list', LIST), ('exp_list', LIST)]),
+    (ast.ParensExp, [('exp', NODE)]),
+]
+node_classes = [cls for cls, _ in node_fields]
+kind_of_class = {cls: kind for kind, cls in enumerate(node_classes)}
+# lazy functions are stored with their body parsed
+kind_of_class[ast.LazyFunctionDefExp] = kind_of_class[ast.FunctionDefExp]
+fields_of_kind = [fields for _, fields in node_fields]
+# the scalar field of each kind, at most one per class
+value_field_of_kind = [next(((name, field_type) for name, field_type in fields if field_type >= VALUE), None)
+                       for fields in fields_of_kind]
+# where the scalar goes among the constructor arguments
+value_index_of_kind = [fields.index(field) if field else -1
+                       for fields, field in zip(fields_of_kind, value_field_of_kind)]
+# pseudo nodes for list fields and missing optional nodes
+KIND_LIST = len(node_classes)
+KIND_NONE = KIND_LIST + 1
+kind_names = [cls.name for cls in node_classes] + ['list', 'none']
+
+
+class FlatAst:
+    """An AST as columns indexed by node: kinds, source offsets, values
+    (pool index, operator code or bool) and the range of each node's
+    children in the children column. Nodes are in post-order, so children
+    come before their parent and the root is the last node. Strings and
+    numbers are kept once each in the literal pool."""
+    header = struct.Struct('<5I')
+
+    def __init__(self, kinds, poses, values, firsts, children, pool):
+        self.kinds = kinds
+        self.poses = poses
+        self.values = values
+        # children of node i are children[firsts[i]:firsts[i+1]]
+        self.firsts = firsts
+        self.children = children
+        self.pool = pool
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @property
+    def root(self):
+        return len(self.kinds) - 1
+
+    def kind_name(self, idx):
+        return kind_names[self.kinds[idx]]
+
+    def child_list(self, idx):
+        return self.children[self.firsts[idx]:self.firsts[idx+1]]
+
+    # the scalar field of a node as in the object tree
+    def value(self, idx):
+        field = value_field_of_kind[self.kinds[idx]] if self.kinds[idx] < KIND_LIST else None
+        if field is None:
+            return None
+        val = self.values[idx]
+        if field[1] == VALUE:
+            return self.pool[val]
+        if field[1] == BOOL:
+            return bool(val)
+        return lexer.TokenStream.kind_list[val]
+
+    @classmethod
+    def from_tree(cls, tree):
+        kinds = array('B')
+        poses = array('i')
+        values = array('i')
+        firsts = array('I')
+        children = array('I')
+        pool = []
+        pool_index = {}
+
+        def add_value(val):
+            # floats by their hex, so 1 and 1.0 or 0.0 and -0.0 stay apart
+            key = (type(val), val.hex() if isinstance(val, float) else val)
+            idx = pool_index.get(key)
+            if idx is None:
+                idx = pool_index[key] = len(pool)
+                pool.append(val)
+            return idx
+
+        # post-order with an explicit stack of (item, is list, child indexes
+        # or None before the first visit, child indexes of the parent)
+        root = []
+        stack = [(tree, False, None, root)]
+        while stack:
+            item, is_list, child_idxs, parent_idxs = stack[-1]
+            if child_idxs is None:
+                # first visit: push the children, last child on top
+                if is_list:
+                    items = [(child, False) for child in item]
+                elif item is None:
+                    items = []
+                else:
+                    items = []
+                    for name, field_type in fields_of_kind[kind_of_class[type(item)]]:
+                        if field_type == NODE or field_type == OPT:
+                            items.append((getattr(item, name), False))
+                        elif field_type == LIST:
+                            items.append((getattr(item, name), True))
+                child_idxs = []
+                stack[-1] = (item, is_list, child_idxs, parent_idxs)
+                for child, child_is_list in reversed(items):
+                    stack.append((child, child_is_list, None, child_idxs))
+                continue
+            stack.pop()
+            if is_list:
+                kind, pos, val = KIND_LIST, -1, -1
+            elif item is None:
+                kind, pos, val = KIND_NONE, -1, -1
+            else:
+                kind = kind_of_class[type(item)]
+                pos = item.pos
+                val = -1
+                field = value_field_of_kind[kind]
+                if field is not None:
+                    val = getattr(item, field[0])
+                    if field[1] == VALUE:
+                        val = add_value(val)
+                    elif field[1] == BOOL:
+                        val = 1 if val else 0
+                    else:
+                        val = val.value
+            firsts.append(len(children))
+            children.extend(child_idxs)
+            idx = len(kinds)
+            kinds.append(kind)
+            poses.append(pos)
+            values.append(val)
+            parent_idxs.append(idx)
+        firsts.append(len(children))
+        return cls(kinds, poses, values, firsts, children, pool)
+
+    def to_tree(self):
+        kinds, poses, values, firsts, children, pool = \
+            self.kinds, self.poses, self.values, self.firsts, self.children, self.pool
+        kind_list = lexer.TokenStream.kind_list
+        objs = [None] * len(kinds)
+        for idx in range(len(kinds)):
+            kind = kinds[idx]
+            args = [objs[child] for child in children[firsts[idx]:firsts[idx+1]]]
+            if kind == KIND_LIST:
+                objs[idx] = args
+            elif kind == KIND_NONE:
+                objs[idx] = None
+            else:
+                field = value_field_of_kind[kind]
+                if field is not None:
+                    val = values[idx]
+                    if field[1] == VALUE:
+                        val = pool[val]
+                    elif field[1] == BOOL:
+                        val = bool(val)
+                    else:
+                        val = kind_list[val]
+                    args.insert(value_index_of_kind[kind], val)
+                args.append(poses[idx])
+                objs[idx] = node_classes[kind](*args)
+        return objs[-1]
+
+    # one buffer: a header of counts, the columns, then the marshalled pool
+    def dumps(self):
+        pool = marshal.dumps(self.pool)
+        return b''.join([self.header.pack(len(self.kinds), len(self.children), len(pool), 0, 0),
+                         bytes(self.poses), bytes(self.values), bytes(self.firsts),
+                         bytes(self.children), bytes(self.kinds), pool])
+
+    # columns of the result are views on the buffer, which may be an mmap
+    @classmethod
+    def loads(cls, buf):
+        view = memoryview(buf)
+        count, child_count, pool_size, _, _ = cls.header.unpack_from(view)
+        offset = cls.header.size
+
+        def column(fmt, length):
+            nonlocal offset
+            size = length * struct.calcsize(fmt)
+            col = view[offset:offset+size].cast(fmt)
+            offset += size
+            return col
+        poses = column('i', count)
+        values = column('i', count)
+        firsts = column('I', count + 1)
+        children = column('I', child_count)
+        kinds = column('B', count)
+        pool = marshal.loads(view[offset:offset+pool_size])
+        return cls(kinds, poses, values, firsts, children, pool)
+
+    def __reduce__(self):
+        return FlatAst.loads, (self.dumps(),)
+
+
+class FlatVisitor:
+    """Walks a FlatAst in pre-order with an explicit stack, calling
+    visit_<kind name>(flat, idx) for each node that has such a method. A
+    method returning False skips the node's children."""
+    def __init__(self):
+        # method per kind code, looked up once per visitor
+        self.methods = [getattr(self, 'visit_' + name, None) for name in kind_names]
+
+    def visit(self, flat, idx=None):
+        methods = self.methods
+        kinds, firsts, children = flat.kinds, flat.firsts, flat.children
+        stack = [flat.root if idx is None else idx]
+        while stack:
+            idx = stack.pop()
+            method = methods[kinds[idx]]
+            if method is not None and method(flat, idx) is False:
+                continue
+            stack.extend(reversed(children[firsts[idx]:firsts[idx+1]]))
@@ -1,8 +1,12 @@
 from enum import Enum
+from array import array
+from bisect import bisect_left, bisect_right
 import re
+import sys
 
 class TokenKind(Enum):
     EOF = 0            # end-of-file
+    ERROR = 1          # lexical error, data is its message
     VARARG = 2         # ...
     SEP_SEMI = 3       # ;
     SEP_COMMA = 4      # ,
@@ -66,21 +70,223 @@ class TokenKind(Enum):
     OP_BNOT = OP_WAVE
     OP_BXOR = OP_WAVE
 
+# bytes version of a str pattern, for scanning bytes, memoryview or mmap chunks
+def bytes_pattern(pattern):
+    return re.compile(pattern.pattern.encode(), pattern.flags & ~re.UNICODE)
+
+# str of a slice of the chunk, which may be bytes-like
+def decode_text(text):
+    if isinstance(text, str):
+        return text
+    return str(text, 'utf-8', 'surrogateescape')
+
+
+class LineTable:
+    """Start offsets of the lines of a chunk, built on first lookup, so line and
+    column of an offset are found by bisection instead of being counted while
+    scanning. '\\r\\n', '\\n\\r', '\\n' and '\\r' each end one line."""
+    re_new_line = re.compile(r'\r\n|\n\r|\n|\r')
+    re_new_line_bytes = bytes_pattern(re_new_line)
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.line_starts = None
+
+    def build(self):
+        re_new_line = self.re_new_line if isinstance(self.chunk, str) else self.re_new_line_bytes
+        line_starts = array('I', [0])
+        line_starts.extend(m.end() for m in re_new_line.finditer(self.chunk))
+        self.line_starts = line_starts
+
+    def line_of(self, pos):
+        if self.line_starts is None:
+            self.build()
+        return bisect_right(self.line_starts, pos)
+
+    def column_of(self, pos):
+        line = self.line_of(pos)
+        return pos - self.line_starts[line-1] + 1
+
+
 class Token:
-    def __init__(self, kind, line, data):
+    def __init__(self, kind, pos, data, line_table=None):
         self.kind = kind
-        self.line = line
+        self.pos = pos
         self.data = data
+        self.line_table = line_table
+
+    @property
+    def line(self):
+        return self.line_table.line_of(self.pos)
+
+    @property
+    def column(self):
+        return self.line_table.column_of(self.pos)
 
     def __str__(self):
         return "{kind:'%s', line:'%d', data:'%s'}" % (self.kind.name, self.line, self.data)
 
+
+class ParseError(Exception):
+    """A syntax error with the file, line and column it was found at."""
+    def __init__(self, msg, file_name, line, column):
+        super().__init__('%s:%d:%d: %s' % (file_name, line, column, msg))
+        self.msg = msg
+        self.file_name = file_name
+        self.line = line
+        self.column = column
+
+# error for an unexpected token, worded like Lua's; an error token
+# reports its own lexical error
+def unexpected_token(token, file_name, msg='syntax error'):
+    if token.kind == TokenKind.ERROR:
+        return ParseError(token.data, file_name, token.line, token.column)
+    near = '<eof>' if token.kind == TokenKind.EOF else "'%s'" % token.data
+    return ParseError('%s near %s' % (msg, near), file_name, token.line, token.column)
+
+class TokenStream:
+    """Tokens of a whole chunk in columns: kind codes and start/end offsets.
+    Token text is sliced out of the chunk, and lines looked up in the line
+    table, only when asked for. It offers the same look_ahead/next_token
+    interface as Lexer, reading by index. errors maps the index of each
+    ERROR token to its message."""
+    kind_list = [None] * 256
+    for kind in TokenKind:
+        kind_list[kind.value] = kind
+    del kind
+    string_code = TokenKind.STRING.value
+    eof_code = TokenKind.EOF.value
+    identifier_code = TokenKind.IDENTIFIER.value
+    error_code = TokenKind.ERROR.value
+
+    def __init__(self, chunk, file_name, kinds, starts, ends, line_table, errors=None):
+        self.chunk = chunk
+        self.file_name = file_name
+        self.kinds = kinds
+        self.starts = starts
+        self.ends = ends
+        self.line_table = line_table
+        self.errors = errors
+        self.pos = 0
+        self.cached_idx = -1
+        self.cached_token = None
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def kind(self, idx):
+        return self.kind_list[self.kinds[idx]]
+
+    def text(self, idx):
+        return decode_text(self.chunk[self.starts[idx]:self.ends[idx]])
+
+    def line(self, idx):
+        return self.line_table.line_of(self.starts[idx])
+
+    def data(self, idx):
+        kind = self.kinds[idx]
+        if kind == self.string_code:
+            try:
+                return Lexer.decode_string(self.text(idx))
+            except ValueError as e:
+                pos = self.starts[idx]
+                raise ParseError(str(e), self.file_name, self.line_table.line_of(pos), self.line_table.column_of(pos))
+        if kind == self.eof_code:
+            return None
+        if kind == self.error_code:
+            return self.errors[idx]
+        if kind == self.identifier_code:
+            # names repeat a lot, share one str per name across the AST
+            return sys.intern(decode_text(self.chunk[self.starts[idx]:self.ends[idx]]))
+        return decode_text(self.chunk[self.starts[idx]:self.ends[idx]])
+
+    def token(self, idx):
+        if idx != self.cached_idx:
+            self.cached_token = Token(self.kind_list[self.kinds[idx]], self.starts[idx], self.data(idx), self.line_table)
+            self.cached_idx = idx
+        return self.cached_token
+
+    def look_ahead(self):
+        return self.token(self.pos)
+
+    def look_kind(self):
+        return self.kind_list[self.kinds[self.pos]]
+
+    def look_code(self):
+        return self.kinds[self.pos]
+
+    def look_pos(self):
+        return self.starts[self.pos]
+
+    # consume the look ahead token without building it
+    def skip_token(self):
+        if self.pos < len(self.kinds) - 1:
+            self.pos += 1
+
+    def next_token(self):
+        idx = self.pos
+        # the last token is EOF, keep returning it
+        if idx < len(self.kinds) - 1:
+            self.pos = idx + 1
+        if idx == self.cached_idx:
+            return self.cached_token
+        return Token(self.kind_list[self.kinds[idx]], self.starts[idx], self.data(idx), self.line_table)
+
+    # the token is left unconsumed on error, so a recovering parser sees it again
+    def next_token_of_kind(self, kind):
+        if self.kind_list[self.kinds[self.pos]] is not kind:
+            raise unexpected_token(self.look_ahead(), self.file_name)
+        return self.next_token()
+
 class Lexer:
     re_Identifier = re.compile(r'[_A-Za-z][_A-Za-z0-9]*')
     re_number = re.compile(r"0[xX][0-9a-fA-F]*(\.[0-9a-fA-F]*)?([pP][+\-]?[0-9]+)?|"
                            r"[0-9]*(\.[0-9]*)?([eE][+\-]?[0-9]+)?")
     re_opening_long_bracket = re.compile(r'\[=*\[')
-    re_short_string = re.compile(r"(?s)('(\\\\|\\'|\\\n|\\z\s*|[^'\n])*')|(\"(\\\\|\\\"|\\\n|\\z\s*|[^\"\n])*\")")
+    # runs of plain characters are matched in bulk between escape sequences
+    re_short_string = re.compile(r'''
+        '[^'\\\r\n]*(?:\\(?:z[ \t\n\v\f\r]*|\r\n|\n\r|.)[^'\\\r\n]*)*'
+      | "[^"\\\r\n]*(?:\\(?:z[ \t\n\v\f\r]*|\r\n|\n\r|.)[^"\\\r\n]*)*"
+    ''', re.S | re.X)
+    re_new_line = LineTable.re_new_line
+    re_rest_of_line = re.compile(r'[^\r\n]*')
+    re_escape = re.compile(r'''\\(?:
+        (?P<char>[abfnrtv\\"'])
+      | (?P<new_line>\r\n|\n\r|\n|\r)
+      | (?P<skip>z[ \t\n\v\f\r]*)
+      | x(?P<hex>[0-9A-Fa-f]{2})
+      | (?P<dec>[0-9]{1,3})
+      | u\{(?P<utf8>[0-9A-Fa-f]+)\}
+      | (?P<invalid>.?))
+    ''', re.S | re.X)
+    # characters standing for raw bytes, see decode_string
+    re_raw_byte = re.compile('[\udc80-\udcff]')
+
+    # white spaces and comments
+    re_skip = re.compile(r'''(?:[ \t\n\v\f\r]+
+                               |--\[(?P<comment_sep>=*)\[.*?\](?P=comment_sep)\]
+                               |--(?!\[=*\[)[^\r\n]*)*''', re.S | re.X)
+
+    # master regex for the regex scanner: leading white spaces and comments,
+    # then one token alternative, dispatched on match.lastgroup
+    # (?=(?P<skip>...))(?P=skip) keeps the skip part from backtracking into a comment
+    re_token = re.compile(r'(?=(?P<skip>' + re_skip.pattern + r'))(?P=skip)' + r'''
+        (?:(?P<identifier>[_A-Za-z][_A-Za-z0-9]*)
+          | (?P<number>0[xX](?:[0-9a-fA-F]+\.?[0-9a-fA-F]*|\.[0-9a-fA-F]+)(?:[pP][+\-]?[0-9]+)?
+                     |(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+\-]?[0-9]+)?)
+          | (?P<long_string>\[=*\[)
+          | (?P<invalid_long_string_delimiter>\[=+)
+          | (?P<unfinished_long_comment>--\[=*\[)
+          | (?P<symbol>\.\.\.|\.\.|==|~=|<=|>=|<<|>>|//|::|[-+*/%^#&~|<>=(){}\[\];:,.])
+          | (?P<short_string>'[^'\\\r\n]*(?:\\(?:z[ \t\n\v\f\r]*|\r\n|\n\r|.)[^'\\\r\n]*)*'
+                            |"[^"\\\r\n]*(?:\\(?:z[ \t\n\v\f\r]*|\r\n|\n\r|.)[^"\\\r\n]*)*")
+          | (?P<unfinished_short_string>['"])
+          | (?P<eof>\Z))
+    ''', re.S | re.X)
+
+    re_skip_bytes = bytes_pattern(re_skip)
+    re_token_bytes = bytes_pattern(re_token)
+    re_rest_of_line_bytes = bytes_pattern(re_rest_of_line)
 
     keywords_tokens = {
         "and":      TokenKind.OP_AND,
@@ -125,100 +331,162 @@ class Lexer:
         '#':        TokenKind.OP_LEN,
     }
 
+    symbol_tokens = dict(single_symbol_tokens, **{
+        '...':      TokenKind.VARARG,
+        '..':       TokenKind.OP_CONCAT,
+        '.':        TokenKind.SEP_DOT,
+        '::':       TokenKind.SEP_LABEL,
+        ':':        TokenKind.SEP_COLON,
+        '~=':       TokenKind.OP_NE,
+        '~':        TokenKind.OP_WAVE,
+        '<<':       TokenKind.OP_SHL,
+        '<=':       TokenKind.OP_LE,
+        '<':        TokenKind.OP_LT,
+        '>>':       TokenKind.OP_SHR,
+        '>=':       TokenKind.OP_GE,
+        '>':        TokenKind.OP_GT,
+        '//':       TokenKind.OP_IDIV,
+        '/':        TokenKind.OP_DIV,
+        '==':       TokenKind.OP_EQ,
+        '=':        TokenKind.OP_ASSIGN,
+        '[':        TokenKind.SEP_LBRACK,
+    })
+
+    # plain lookups for the regex scanner, cheaper than Enum attribute access
+    identifier = TokenKind.IDENTIFIER
+    number = TokenKind.NUMBER
+    string = TokenKind.STRING
+
+    # kind codes used by tokenize
+    keyword_codes = dict((k, v.value) for k, v in keywords_tokens.items())
+    symbol_codes = dict((k, v.value) for k, v in symbol_tokens.items())
+    keyword_codes_bytes = dict((k.encode(), v) for k, v in keyword_codes.items())
+    symbol_codes_bytes = dict((k.encode(), v) for k, v in symbol_codes.items())
+
+    esc_table = {'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\', '"': '"', "'": "'"}
+
     special_symbols = {
         'new_line': ['\r', '\n'],
         'white_space': ['\t', '\n', '\v', '\f', '\r', ' ']
     }
 
-    def __init__(self, chunk, file_name):
+    def __init__(self, chunk, file_name, use_re=False):
         self.chunk = chunk
         self.file_name = file_name
-        self.cur_line = 1
+        self.line_table = LineTable(chunk)
         self.cur_pos = 0
         self.cached_token = None
+        # messages of the ERROR tokens by index, None to raise instead
+        self.errors = None
+        # scan with the master regex instead of the per-character dispatch
+        self.use_re = use_re
+        if not isinstance(chunk, str):
+            # bytes, memoryview or mmap of the source, scanned in place with
+            # the bytes patterns; only the text of tokens read gets decoded
+            self.use_re = True
+            self.re_skip = self.re_skip_bytes
+            self.re_token = self.re_token_bytes
+            self.re_rest_of_line = self.re_rest_of_line_bytes
+            self.keyword_codes = self.keyword_codes_bytes
+            self.symbol_codes = self.symbol_codes_bytes
 
     def look_ahead(self):
         if self.cached_token:
             return self.cached_token
         self.cached_token = self.next_token()
         return self.cached_token
-    
+
+    def look_kind(self):
+        return self.look_ahead().kind
+
+    def look_code(self):
+        return self.look_ahead().kind.value
+
+    def look_pos(self):
+        return self.look_ahead().pos
+
+    def skip_token(self):
+        self.next_token()
+
     def next_token_of_kind(self, kind):
-        token = self.next_token()
+        token = self.look_ahead()
         if token.kind != kind:
-            raise Exception("syntax error near '%s'" % token)
-        return token
+            raise unexpected_token(token, self.file_name)
+        return self.next_token()
     
     def next_token(self):
         if self.cached_token:
             token = self.cached_token
             self.cached_token = None
             return token
+        if self.use_re:
+            return self.scan_token_re()
         self.skip_white_spaces()
+        start = self.cur_pos
         if self.cur_pos >= len(self.chunk):
-            return Token(TokenKind.EOF, self.cur_line, None)
+            return Token(TokenKind.EOF, start, None, self.line_table)
         c = self.chunk[self.cur_pos]
         if c in self.single_symbol_tokens:
             self.move_point(1)
-            return Token(self.single_symbol_tokens[c], self.cur_line, c)
+            return Token(self.single_symbol_tokens[c], start, c, self.line_table)
         elif c == ':':
             if self.is_start_with('::'):
                 self.move_point(2)
-                return Token(TokenKind.SEP_LABEL, self.cur_line, '::')
+                return Token(TokenKind.SEP_LABEL, start, '::', self.line_table)
             self.move_point(1)
-            return Token(TokenKind.SEP_COLON, self.cur_line, ':')
+            return Token(TokenKind.SEP_COLON, start, ':', self.line_table)
         elif c == '~':
             if self.is_start_with('~='):
                 self.move_point(2)
-                return Token(TokenKind.OP_NE, self.cur_line, '~=')
+                return Token(TokenKind.OP_NE, start, '~=', self.line_table)
             self.move_point(1)
-            return Token(TokenKind.OP_WAVE, self.cur_line, '~')
+            return Token(TokenKind.OP_WAVE, start, '~', self.line_table)
         elif c == '<':
             if self.is_start_with('<<'):
                 self.move_point(2)
-                return Token(TokenKind.OP_SHL, self.cur_line, '<<')
+                return Token(TokenKind.OP_SHL, start, '<<', self.line_table)
             elif self.is_start_with('<='):
                 self.move_point(2)
-                return Token(TokenKind.OP_LE, self.cur_line, '<=')
+                return Token(TokenKind.OP_LE, start, '<=', self.line_table)
             self.move_point(1)
-            return Token(TokenKind.OP_LT, self.cur_line, '<')
+            return Token(TokenKind.OP_LT, start, '<', self.line_table)
         elif c == '>':
             if self.is_start_with('>>'):
                 self.move_point(2)
-                return Token(TokenKind.OP_SHR, self.cur_line, '>>')
+                return Token(TokenKind.OP_SHR, start, '>>', self.line_table)
             elif self.is_start_with('>='):
                 self.move_point(2)
-                return Token(TokenKind.OP_GE, self.cur_line, '>=')
+                return Token(TokenKind.OP_GE, start, '>=', self.line_table)
             self.move_point(1)
-            return Token(TokenKind.OP_GT, self.cur_line, '>')
+            return Token(TokenKind.OP_GT, start, '>', self.line_table)
         elif c == '/':
             if self.is_start_with('//'):
                 self.move_point(2)
-                return Token(TokenKind.OP_IDIV, self.cur_line, '//')
+                return Token(TokenKind.OP_IDIV, start, '//', self.line_table)
             self.move_point(1)
-            return Token(TokenKind.OP_DIV, self.cur_line, '/')
+            return Token(TokenKind.OP_DIV, start, '/', self.line_table)
         elif c == '=':
             if self.is_start_with('=='):
                 self.move_point(2)
-                return Token(TokenKind.OP_EQ, self.cur_line, '==')
+                return Token(TokenKind.OP_EQ, start, '==', self.line_table)
             self.move_point(1)
-            return Token(TokenKind.OP_ASSIGN, self.cur_line, '=')
+            return Token(TokenKind.OP_ASSIGN, start, '=', self.line_table)
         elif c == '.':
             if self.is_start_with('...'):
                 self.move_point(3)
-                return Token(TokenKind.VARARG, self.cur_line, '...')
+                return Token(TokenKind.VARARG, start, '...', self.line_table)
             elif self.is_start_with('..'):
                 self.move_point(2)
-                return Token(TokenKind.OP_CONCAT, self.cur_line, '..')
+                return Token(TokenKind.OP_CONCAT, start, '..', self.line_table)
             elif self.isdigit(self.chunk[self.cur_pos+1]):
                 return self.scan_number()
             self.move_point(1)
-            return Token(TokenKind.SEP_DOT, self.cur_line, '.')
+            return Token(TokenKind.SEP_DOT, start, '.', self.line_table)
         elif c == '[':
             if self.is_start_with('[[') or self.is_start_with('[='):
                 return self.scan_long_string()
             self.move_point(1)
-            return Token(TokenKind.SEP_LBRACK, self.cur_line, '[')
+            return Token(TokenKind.SEP_LBRACK, start, '[', self.line_table)
         elif c == "'" or c == '"':
             return self.scan_short_string()
         elif self.isdigit(c):
@@ -226,34 +494,307 @@ class Lexer:
         elif c == '_' or c.isalpha():
             token = self.scan_identifier()
             if token.data in self.keywords_tokens:
-                return Token(self.keywords_tokens[token.data], self.cur_line, token.data)
+                return Token(self.keywords_tokens[token.data], start, token.data, self.line_table)
             return token
         else:
-            raise Exception("unexpected symbol near %s" % c)
+            msg, self.cur_pos = self.bad_token('unexpected_symbol', start, start)
+            raise self.error(msg, start)
+
+    def scan_token_re(self):
+        m = self.re_token.match(self.chunk, self.cur_pos)
+        if m is None:
+            start = self.re_skip.match(self.chunk, self.cur_pos).end()
+            msg, self.cur_pos = self.bad_token('unexpected_symbol', start, start)
+            raise self.error(msg, start)
+        group = m.lastgroup
+        start, self.cur_pos = m.span(group)
+        if group == 'identifier':
+            data = decode_text(m.group(group))
+            return Token(self.keywords_tokens.get(data, self.identifier), start, data, self.line_table)
+        elif group == 'symbol':
+            data = decode_text(m.group(group))
+            return Token(self.symbol_tokens[data], start, data, self.line_table)
+        elif group == 'number':
+            return Token(self.number, start, decode_text(m.group(group)), self.line_table)
+        elif group == 'short_string':
+            return Token(self.string, start, self.string_value(decode_text(m.group(group)), start), self.line_table)
+        elif group == 'long_string':
+            self.cur_pos = self.find_long_bracket_end(start, self.cur_pos)
+            return Token(self.string, start, self.string_value(self.text(start, self.cur_pos), start), self.line_table)
+        elif group == 'eof':
+            return Token(TokenKind.EOF, start, None, self.line_table)
+        msg, self.cur_pos = self.bad_token(group, start, self.cur_pos)
+        raise self.error(msg, start)
+
+    # lex the rest of the chunk at once into a TokenStream; with recover a
+    # lexical error becomes an ERROR token and scanning goes on after it
+    def tokenize(self, recover=False):
+        kinds = array('B')
+        starts = array('I')
+        ends = array('I')
+        self.errors = {} if recover else None
+        self.scan_tokens(kinds, starts, ends)
+        return TokenStream(self.chunk, self.file_name, kinds, starts, ends, self.line_table, self.errors)
+
+    # Append the tokens from cur_pos on to the columns, up to EOF, or up to the
+    # first token at or after sync_pos that starts delta after a token of
+    # old_starts. Returns the index of that old token, or -1 at EOF.
+    def scan_tokens(self, kinds, starts, ends, old_starts=None, sync_pos=sys.maxsize, delta=0):
+        chunk = self.chunk
+        match = self.re_token.match
+        keyword_codes = self.keyword_codes
+        symbol_codes = self.symbol_codes
+        identifier = self.identifier.value
+        number = self.number.value
+        string = self.string.value
+        pos = self.cur_pos
+        while True:
+            m = match(chunk, pos)
+            if m is None:
+                group = 'unexpected_symbol'
+                start = pos = self.re_skip.match(chunk, pos).end()
+            else:
+                group = m.lastgroup
+                start, pos = m.span(group)
+            if start >= sync_pos:
+                idx = bisect_left(old_starts, start - delta)
+                if idx < len(old_starts) and old_starts[idx] == start - delta:
+                    self.cur_pos = start
+                    return idx
+            if group == 'identifier':
+                kinds.append(keyword_codes.get(m.group(group), identifier))
+            elif group == 'symbol':
+                kinds.append(symbol_codes[m.group(group)])
+            elif group == 'number':
+                kinds.append(number)
+            elif group == 'short_string':
+                kinds.append(string)
+            elif group == 'long_string':
+                end = self.long_bracket_end(start, pos)
+                if end == -1:
+                    pos = self.error_token(kinds, group, start, pos)
+                else:
+                    pos = end
+                    kinds.append(string)
+            elif group == 'eof':
+                kinds.append(TokenKind.EOF.value)
+            else:
+                pos = self.error_token(kinds, group, start, pos)
+            starts.append(start)
+            ends.append(pos)
+            if group == 'eof':
+                self.cur_pos = pos
+                return -1
+
+    # Message and end offset of a bad token found by the master regex: group
+    # is its re_token group, or unexpected_symbol where no token matched, and
+    # pos the end of what the group matched.
+    def bad_token(self, group, start, pos):
+        if group == 'unfinished_short_string':
+            end = self.re_rest_of_line.match(self.chunk, start).end()
+            return "unfinished string near '%s'" % self.text(start, end), end
+        elif group == 'invalid_long_string_delimiter':
+            return "invalid long string delimiter near '%s'" % self.text(start, pos), pos
+        elif group == 'long_string':
+            return self.unfinished_long(start), len(self.chunk)
+        elif group == 'unfinished_long_comment':
+            return self.unfinished_long(start + 2), len(self.chunk)
+        return "unexpected symbol near '%s'" % self.text(start, start + 1), start + 1
+
+    # append the ERROR token for a bad token, or raise its error when not
+    # recovering; returns its end offset
+    def error_token(self, kinds, group, start, pos):
+        msg, end = self.bad_token(group, start, pos)
+        if self.errors is None:
+            raise self.error(msg, start)
+        self.errors[len(kinds)] = msg
+        kinds.append(TokenKind.ERROR.value)
+        return end
+
+    # message of the bad token at start, scanned again
+    def error_message(self, start):
+        m = self.re_token.match(self.chunk, start)
+        if m is None:
+            return self.bad_token('unexpected_symbol', start, start)[0]
+        return self.bad_token(m.lastgroup, start, m.end(m.lastgroup))[0]
+
+    def error(self, msg, pos):
+        return ParseError(msg, self.file_name, self.line_table.line_of(pos), self.line_table.column_of(pos))
+
+    # value of a string literal token at start, see decode_string
+    def string_value(self, text, start):
+        try:
+            return self.decode_string(text)
+        except ValueError as e:
+            raise self.error(str(e), start)
+
+    def text(self, start, end):
+        return decode_text(self.chunk[start:end])
+
+    # Token lookahead never reaches more than this many characters past the
+    # end of a token, as in the exponent of '1e+5'.
+    max_look_ahead = 3
+
+    @classmethod
+    def relex(cls, stream, offset, removed, inserted):
+        """Apply an edit replacing chunk[offset:offset+removed] with inserted
+        to a TokenStream from tokenize. Only the tokens from the last one that
+        the edit cannot affect up to the point where the new tokens line up
+        with the old ones again are scanned. Returns the new stream and the
+        change (first, old_stop, new_stop): stream.kinds[first:old_stop] were
+        replaced by new_stream.kinds[first:new_stop]."""
+        chunk = stream.chunk
+        new_chunk = chunk[:offset] + inserted + chunk[offset+removed:]
+        delta = len(inserted) - removed
+        # restart at a token whose predecessor ends far enough before the
+        # edit; long strings and comments before it are closed before it
+        first = bisect_right(stream.ends, offset - cls.max_look_ahead) - 1
+        if first < 0:
+            first = 0
+            restart_pos = 0
+        else:
+            restart_pos = stream.starts[first]
+        lex = cls(new_chunk, stream.file_name)
+        lex.cur_pos = restart_pos
+        if stream.errors is not None:
+            lex.errors = dict((idx, msg) for idx, msg in stream.errors.items() if idx < first)
+        kinds = stream.kinds[:first]
+        starts = stream.starts[:first]
+        ends = stream.ends[:first]
+        old_stop = lex.scan_tokens(kinds, starts, ends, stream.starts, offset + len(inserted), delta)
+        new_stop = len(kinds)
+        if old_stop >= 0:
+            kinds.extend(stream.kinds[old_stop:])
+            if delta == 0:
+                starts.extend(stream.starts[old_stop:])
+                ends.extend(stream.ends[old_stop:])
+            else:
+                starts.extend(map(delta.__add__, stream.starts[old_stop:]))
+                ends.extend(map(delta.__add__, stream.ends[old_stop:]))
+        else:
+            old_stop = len(stream.kinds)
+        if stream.errors is not None:
+            # the messages of moved bad tokens are made again, as the
+            # lines they name may have changed
+            for idx in stream.errors:
+                if idx >= old_stop:
+                    idx += new_stop - old_stop
+                    lex.errors[idx] = lex.error_message(starts[idx])
+        new_stream = TokenStream(new_chunk, stream.file_name, kinds, starts, ends, lex.line_table, lex.errors)
+        return new_stream, (first, old_stop, new_stop)
+
+    # end offset of the long bracket opened by chunk[start:open_end], -1 if
+    # it is not closed
+    def long_bracket_end(self, start, open_end):
+        close = ']' + '=' * (open_end - start - 2) + ']'
+        if isinstance(self.chunk, str):
+            end = self.chunk.find(close, open_end)
+        else:
+            # memoryview has no find
+            m = re.compile(re.escape(close.encode())).search(self.chunk, open_end)
+            end = m.start() if m else -1
+        return end if end == -1 else end + len(close)
+
+    def find_long_bracket_end(self, start, open_end):
+        end = self.long_bracket_end(start, open_end)
+        if end == -1:
+            self.cur_pos = len(self.chunk)
+            raise self.error(self.unfinished_long(start), start)
+        return end
+
+    def unfinished_long(self, start):
+        what = 'comment' if self.text(start - 2, start) == '--' else 'string'
+        return 'unfinished long %s (starting at line %d) near <eof>' % (what, self.line_table.line_of(start))
+
+    # Value of a string literal token, given its text with delimiters. Lua
+    # strings are bytes: escapes producing a byte that is not valid UTF-8 are
+    # held as the surrogate escape of that byte, so encoding the value with
+    # 'utf-8', 'surrogateescape' gives back the bytes of the Lua string.
+    @classmethod
+    def decode_string(cls, text):
+        if text[0] == '[':
+            sep_len = text.index('[', 1) + 1
+            data = text[sep_len:-sep_len]
+            if data.startswith(('\r\n', '\n\r')):
+                data = data[2:]
+            elif data.startswith(('\r', '\n')):
+                data = data[1:]
+            if '\r' in data:
+                data = cls.re_new_line.sub('\n', data)
+            return data
+        data = text[1:-1]
+        if '\\' not in data:
+            return data
+        data = cls.re_escape.sub(cls.unescape, data)
+        if cls.re_raw_byte.search(data):
+            # merge escaped bytes that together form UTF-8 characters
+            data = data.encode('utf-8', 'surrogateescape').decode('utf-8', 'surrogateescape')
+        return data
+
+    @classmethod
+    def unescape(cls, m):
+        group = m.lastgroup
+        if group == 'char':
+            return cls.esc_table[m.group(group)]
+        elif group == 'new_line':
+            return '\n'
+        elif group == 'skip':
+            return ''
+        elif group == 'hex':
+            return cls.byte_char(int(m.group(group), 16))
+        elif group == 'dec':
+            val = int(m.group(group))
+            if val > 255:
+                raise ValueError('decimal escape too large near \'%s\'' % m.group())
+            return cls.byte_char(val)
+        elif group == 'utf8':
+            val = int(m.group(group), 16)
+            if val > 0x10FFFF:
+                raise ValueError('UTF-8 value too large near \'%s\'' % m.group())
+            return cls.utf8_char(val)
+        c = m.group(group)
+        if c == 'x':
+            raise ValueError('hexadecimal digit expected near \'%s\'' % m.group())
+        elif c == 'u':
+            raise ValueError('missing \'{\' or \'}\' in \\u{xxxx}')
+        raise ValueError('invalid escape sequence near \'%s\'' % m.group())
+
+    @staticmethod
+    def byte_char(val):
+        return chr(val) if val < 0x80 else chr(0xdc00 + val)
+
+    # UTF-8 sequence of val, surrogates encoded as Lua does
+    @classmethod
+    def utf8_char(cls, val):
+        if val < 0x80:
+            return chr(val)
+        buf = []
+        mfb = 0x3f
+        while True:
+            buf.append(0x80 | (val & 0x3f))
+            val = val >> 6
+            mfb = mfb >> 1
+            if val <= mfb:
+                break
+        buf.append(((~mfb << 1) & 0xff) | val)
+        return bytes(reversed(buf)).decode('utf-8', 'surrogateescape')
 
     def skip_white_spaces(self):
         while not self.is_chunk_end():
             if self.is_start_with('--'):
                 self.move_point(2)
                 self.skip_comment()
-            elif self.is_start_with('\r\n') or self.is_start_with('\n\r'):
-                self.move_point(2)
-                self.cur_line = self.cur_line + 1
-            elif self.chunk[self.cur_pos] in self.special_symbols['new_line']:
-                self.move_point(1)
-                self.cur_line = self.cur_line + 1
             elif self.chunk[self.cur_pos] in self.special_symbols['white_space']:
                 self.move_point(1)
             else:
                 break
 
     def skip_comment(self):
-        if self.chunk[self.cur_pos] == '[':
-            token = self.scan_long_string()
+        if self.re_opening_long_bracket.match(self.chunk, self.cur_pos):
+            self.scan_long_string()
         else:
             while not self.is_chunk_end():
                 if self.chunk[self.cur_pos] in '\n\r':
-                    self.cur_line = self.cur_line + 1
                     self.move_point(1)
                     break
                 else:
@@ -266,11 +807,12 @@ class Lexer:
         return self.chunk.startswith(prefix, self.cur_pos)
     
     def scan_number(self):
+        start = self.cur_pos
         token = self.re_match(self.re_number)
         self.move_point(len(token))
         # print("get number: ")
         # print(eval(token))
-        return Token(TokenKind.NUMBER, self.cur_line, token)
+        return Token(TokenKind.NUMBER, start, token, self.line_table)
     
     def re_match(self, pattern):
         m = pattern.match(self.chunk, self.cur_pos)
@@ -280,9 +822,10 @@ class Lexer:
         raise Exception('unreachable')
 
     def scan_identifier(self):
+        start = self.cur_pos
         token = self.re_match(self.re_Identifier)
         self.move_point(len(token))
-        return Token(TokenKind.IDENTIFIER, self.cur_line, token)
+        return Token(TokenKind.IDENTIFIER, start, token, self.line_table)
 
     def skip_sep(self, sep):
         count = 0
@@ -293,86 +836,23 @@ class Lexer:
 
     # [=*[]=*]
     def scan_long_string(self):
-        self.move_point(1)
-        sep_num = self.skip_sep('=')
-        if self.chunk[self.cur_pos] != '[':
-            raise Exception("invalid long string delimiter near '%s'"%('['+'='*sep_num))
-        self.move_point(1)
-        token = ''
-        is_finish = False
-        while not self.is_chunk_end():
-            if self.chunk[self.cur_pos] == ']':
-                self.move_point(1)
-                close_sep_num = self.skip_sep('=')
-                if close_sep_num == sep_num and self.chunk[self.cur_pos] == ']':
-                    self.move_point(1)
-                    is_finish = True
-                    break
-                token = token + ']'+'='*close_sep_num
-            elif self.chunk[self.cur_pos] in '\n\r':
-                self.cur_line = self.cur_line + 1
-                token = token + '\n'
-                self.move_point(1)
-            else:
-                token = token + self.chunk[self.cur_pos]
-                self.move_point(1)
-        if not is_finish:
-            raise Exception('unfinished long string (starting at line %d) near <eof>'%(self.cur_line))
-        return Token(TokenKind.STRING, self.cur_line, token)
-
-
-    def scan_long_string_re(self):
-        opening_bracket = self.re_match(self.re_opening_long_bracket)
-        start_pos = self.chunk.find(opening_bracket, self.cur_pos)
-        if start_pos == -1:
-            raise Exception('unreachable')
-        closing_bracket = opening_bracket.replace('[', ']')
-        end_pos = self.chunk.find(closing_bracket, self.cur_pos)
-        if end_pos == -1:
-            raise Exception('unreachable')
-        self.move_point(end_pos-start_pos+len(closing_bracket))
-        start_pos = start_pos + len(opening_bracket)
-        return Token(TokenKind.STRING, self.cur_line,  self.chunk[start_pos:end_pos])
+        start = self.cur_pos
+        m = self.re_opening_long_bracket.match(self.chunk, start)
+        if m is None:
+            self.move_point(1)
+            self.skip_sep('=')
+            raise self.error("invalid long string delimiter near '%s'" % self.text(start, self.cur_pos), start)
+        self.cur_pos = self.find_long_bracket_end(start, m.end())
+        return Token(TokenKind.STRING, start, self.string_value(self.chunk[start:self.cur_pos], start), self.line_table)
 
     def scan_short_string(self):
-        begin_c = self.chunk[self.cur_pos]
-        self.move_point(1)
-        is_finish = False
-        token = ''
-        esc_table = {'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v', '\\': '\\', '"': '"', "'": "'"}
-        while not self.is_chunk_end():
-            if self.chunk[self.cur_pos] == begin_c:
-                is_finish = True
-                self.move_point(1)
-                break
-            elif self.chunk[self.cur_pos] in '\r\n':
-                raise Exception("unfinished string near '%s'"%(token))
-            elif self.chunk[self.cur_pos] == '\\':
-                self.move_point(1)
-                if self.chunk[self.cur_pos] in esc_table:
-                    token = token + esc_table[self.chunk[self.cur_pos]]
-                    self.move_point(1)
-                elif self.chunk[self.cur_pos] == 'x':
-                    pass
-                elif self.chunk[self.cur_pos] == 'u':
-                    pass
-                elif self.chunk[self.cur_pos] in '\n\r':
-                    self.cur_line = self.cur_line + 1
-                    token = token + '\n'
-                else:
-                    raise Exception('invalid escape sequence')
-            else:
-                token = token + self.chunk[self.cur_pos]
-                self.move_point(1)
-        if not is_finish:
-                raise Exception('unfinished long string (starting at line %d) near <eof>'%(self.cur_line))
-        return Token(TokenKind.STRING, self.cur_line, token)
-
-    def scan_short_string_re(self):
-        short_string = self.re_match(self.re_short_string)
-        self.move_point(len(short_string))
-        short_string = short_string[1:-1]
-        return Token(TokenKind.STRING, self.cur_line, short_string)
+        start = self.cur_pos
+        m = self.re_short_string.match(self.chunk, start)
+        if m is None:
+            msg, self.cur_pos = self.bad_token('unfinished_short_string', start, start)
+            raise self.error(msg, start)
+        self.cur_pos = m.end()
+        return Token(TokenKind.STRING, start, self.string_value(m.group(), start), self.line_table)
 
     def move_point(self, step=1):
         self.cur_pos = self.cur_pos + step
@@ -1,3 +1,4 @@
+import mmap
 import lexer
 from parser import Parser
 from code import CodeGenerator
@@ -39,8 +40,8 @@ def main():
     return 2+3, 3, 5
     """
     test_lua = r'/Users/qinggang/PersonalData/open-src/xmake/xmake/core/base/option.lua' #r'/Users/qinggang/PersonalData/open-src/xmake/xmake/core/main.lua'
-    with open(test_lua, 'r') as f:
-        src_code = f.read()
+    with open(test_lua, 'rb') as f:
+        src_code = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
     lex = lexer.Lexer(src_code, 'main.lua')
     # token = lex.next_token()
     # while token.kind != lexer.TokenKind.EOF:
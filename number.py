@@ -0,0 +1,72 @@
+import re
+from functools import lru_cache
+
+MAX_INTEGER = (1 << 63) - 1
+MIN_INTEGER = -(1 << 63)
+
+re_decimal_integer = re.compile(r'[0-9]+\Z')
+re_hex_integer = re.compile(r'0[xX]([0-9a-fA-F]+)\Z')
+re_decimal_float = re.compile(r'(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?\Z')
+re_hex_float = re.compile(r'0[xX](?:[0-9a-fA-F]+\.?[0-9a-fA-F]*|\.[0-9a-fA-F]+)(?:[pP][+-]?[0-9]+)?\Z')
+
+
+# wrap an integer around to a signed 64-bit value
+def wrap_integer(val):
+    val &= 0xffffffffffffffff
+    return val - (1 << 64) if val > MAX_INTEGER else val
+
+
+# convert a Lua numeral to int or float, None if it is malformed
+@lru_cache(maxsize=4096)
+def parse_numeral(text):
+    if re_decimal_integer.match(text):
+        val = int(text)
+        # decimal integers that do not fit become floats
+        return val if val <= MAX_INTEGER else float(text)
+    m = re_hex_integer.match(text)
+    if m:
+        # hex integers wrap around
+        return wrap_integer(int(m.group(1), 16))
+    if re_decimal_float.match(text):
+        return float(text)
+    if re_hex_float.match(text):
+        try:
+            return float.fromhex(text)
+        except OverflowError:
+            return float('inf')
+    return None
+
+
+# convert a string to a number as Lua's arithmetic coercion does: optional
+# surrounding spaces and sign, then a numeral; None if it is not one
+def str_to_number(text):
+    text = text.strip(' \t\n\v\f\r')
+    neg = text[:1] == '-'
+    if text[:1] in ('-', '+'):
+        text = text[1:]
+    val = parse_numeral(text)
+    if val is None or not neg:
+        return val
+    return wrap_integer(-val) if type(val) is int else -val
+
+
+# the integer a number or string stands for exactly, None if there is none
+def to_integer(val):
+    if type(val) is str:
+        val = str_to_number(val)
+    if type(val) is int:
+        return val
+    if type(val) is float and val.is_integer() and MIN_INTEGER <= val < -MIN_INTEGER:
+        return int(val)
+    return None
+
+
+# a number as tostring() and the .. operator show it
+def number_to_string(val):
+    if type(val) is int:
+        return '%d' % val
+    text = '%.14g' % val
+    # floats that look like integers get a '.0'
+    if not text.lstrip('-').isdigit():
+        return text
+    return text + '.0'
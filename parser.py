@@ -1,145 +1,450 @@
+import re
+from bisect import bisect_left
 import lexer
 import ast
+import number
+
+# token kind codes and states of the explicit-stack expression parser
+CODE_NAME = lexer.TokenKind.IDENTIFIER.value
+CODE_STRING = lexer.TokenKind.STRING.value
+CODE_DOT = lexer.TokenKind.SEP_DOT.value
+CODE_COLON = lexer.TokenKind.SEP_COLON.value
+CODE_COMMA = lexer.TokenKind.SEP_COMMA.value
+CODE_SEMI = lexer.TokenKind.SEP_SEMI.value
+CODE_ASSIGN = lexer.TokenKind.OP_ASSIGN.value
+CODE_LPAREN = lexer.TokenKind.SEP_LPAREN.value
+CODE_LBRACK = lexer.TokenKind.SEP_LBRACK.value
+CODE_LCURLY = lexer.TokenKind.SEP_LCURLY.value
+CODE_RCURLY = lexer.TokenKind.SEP_RCURLY.value
+CODE_RPAREN = lexer.TokenKind.SEP_RPAREN.value
+
+EXPECT_OPERAND = 0   # start of an exp
+EXPECT_SUFFIX = 1    # after a prefixexp: . : [ or args may follow
+EXPECT_OPERATOR = 2  # after an operand: a binop, or the exp is complete
+EXPECT_FIELD = 3     # start of a field, or the closing }
+
+FRAME_PAREN = 0  # ( exp )
+FRAME_INDEX = 1  # prefixexp [ exp ]
+FRAME_ARGS = 2   # prefixexp ( explist )
+FRAME_TABLE = 3  # { fieldlist }
 
 
 class Parser:
     block_end_tokens = [lexer.TokenKind.KW_RETURN, lexer.TokenKind.EOF,
                         lexer.TokenKind.KW_END, lexer.TokenKind.KW_ELSE,
                         lexer.TokenKind.KW_ELSEIF, lexer.TokenKind.KW_UNTIL]
-    priority_table = {
-        lexer.TokenKind.OP_ADD: {'left': 10, 'right': 10},  # +
-        lexer.TokenKind.OP_SUB: {'left': 10, 'right': 10},  # -
-        lexer.TokenKind.OP_MUL: {'left': 11, 'right': 11},  # *
-        lexer.TokenKind.OP_MOD: {'left': 11, 'right': 11},  # %
-        lexer.TokenKind.OP_DIV: {'left': 11, 'right': 11},  # /
-        lexer.TokenKind.OP_IDIV: {'left': 11, 'right': 11},  # //
-        lexer.TokenKind.OP_POW: {'left': 14, 'right': 13},  # ^
-        lexer.TokenKind.OP_BAND: {'left': 6, 'right': 6},  # &
-        lexer.TokenKind.OP_BOR: {'left': 4, 'right': 4},  # |
-        lexer.TokenKind.OP_BNOT: {'left': 5, 'right': 5},  # ~
-        lexer.TokenKind.OP_SHL: {'left': 7, 'right': 7},  # <<
-        lexer.TokenKind.OP_SHR: {'left': 7, 'right': 7},  # >>
-        lexer.TokenKind.OP_CONCAT: {'left': 9, 'right': 8},  # ..
-        lexer.TokenKind.OP_EQ: {'left': 3, 'right': 3},  # ==
-        lexer.TokenKind.OP_LE: {'left': 3, 'right': 3},  # <=
-        lexer.TokenKind.OP_LT: {'left': 3, 'right': 3},  # <
-        lexer.TokenKind.OP_NE: {'left': 3, 'right': 3},  # ~=
-        lexer.TokenKind.OP_GT: {'left': 3, 'right': 3},  # >
-        lexer.TokenKind.OP_GE: {'left': 3, 'right': 3},  # >=
-        lexer.TokenKind.OP_AND: {'left': 2, 'right': 2},  # and
-        lexer.TokenKind.OP_OR: {'left': 1, 'right': 1},  # or
-    }
-
-    unops = [
-        lexer.TokenKind.OP_SUB, lexer.TokenKind.OP_NOT,
-        lexer.TokenKind.OP_LEN, lexer.TokenKind.OP_BNOT
-    ]
-
-    binops = [
-        lexer.TokenKind.OP_ADD, lexer.TokenKind.OP_SUB,
-        lexer.TokenKind.OP_MUL, lexer.TokenKind.OP_MOD,
-        lexer.TokenKind.OP_POW, lexer.TokenKind.OP_DIV,
-        lexer.TokenKind.OP_IDIV, lexer.TokenKind.OP_BAND,
-        lexer.TokenKind.OP_BOR, lexer.TokenKind.OP_BXOR,
-        lexer.TokenKind.OP_SHL, lexer.TokenKind.OP_SHR,
-        lexer.TokenKind.OP_CONCAT, lexer.TokenKind.OP_NE,
-        lexer.TokenKind.OP_EQ, lexer.TokenKind.OP_LT,
-        lexer.TokenKind.OP_LE, lexer.TokenKind.OP_GT,
-        lexer.TokenKind.OP_GE, lexer.TokenKind.OP_AND,
-        lexer.TokenKind.OP_OR
-    ]
+    # binding powers of binary operators indexed by kind code, 0 for other tokens
+    left_priority = [0] * 256
+    right_priority = [0] * 256
+    for kind, left, right in [
+        (lexer.TokenKind.OP_OR, 1, 1),  # or
+        (lexer.TokenKind.OP_AND, 2, 2),  # and
+        (lexer.TokenKind.OP_LT, 3, 3),  # <
+        (lexer.TokenKind.OP_GT, 3, 3),  # >
+        (lexer.TokenKind.OP_LE, 3, 3),  # <=
+        (lexer.TokenKind.OP_GE, 3, 3),  # >=
+        (lexer.TokenKind.OP_NE, 3, 3),  # ~=
+        (lexer.TokenKind.OP_EQ, 3, 3),  # ==
+        (lexer.TokenKind.OP_BOR, 4, 4),  # |
+        (lexer.TokenKind.OP_BXOR, 5, 5),  # ~
+        (lexer.TokenKind.OP_BAND, 6, 6),  # &
+        (lexer.TokenKind.OP_SHL, 7, 7),  # <<
+        (lexer.TokenKind.OP_SHR, 7, 7),  # >>
+        (lexer.TokenKind.OP_CONCAT, 9, 8),  # ..
+        (lexer.TokenKind.OP_ADD, 10, 10),  # +
+        (lexer.TokenKind.OP_SUB, 10, 10),  # -
+        (lexer.TokenKind.OP_MUL, 11, 11),  # *
+        (lexer.TokenKind.OP_DIV, 11, 11),  # /
+        (lexer.TokenKind.OP_IDIV, 11, 11),  # //
+        (lexer.TokenKind.OP_MOD, 11, 11),  # %
+        (lexer.TokenKind.OP_POW, 14, 13),  # ^
+    ]:
+        left_priority[kind.value] = left
+        right_priority[kind.value] = right
+
+    is_unop = [False] * 256
+    for kind in [lexer.TokenKind.OP_UNM, lexer.TokenKind.OP_NOT,
+                 lexer.TokenKind.OP_LEN, lexer.TokenKind.OP_BNOT]:
+        is_unop[kind.value] = True
+    del kind, left, right
+
+    kind_list = lexer.TokenStream.kind_list
 
     unary_priority = 12
 
-    def __init__(self, lex):
+    # tokens a recovering parser resumes at after a syntax error
+    sync_tokens = block_end_tokens + [
+        lexer.TokenKind.SEP_SEMI, lexer.TokenKind.SEP_LABEL, lexer.TokenKind.KW_BREAK,
+        lexer.TokenKind.KW_GOTO, lexer.TokenKind.KW_DO, lexer.TokenKind.KW_WHILE,
+        lexer.TokenKind.KW_REPEAT, lexer.TokenKind.KW_IF, lexer.TokenKind.KW_FOR,
+        lexer.TokenKind.KW_FUNCTION, lexer.TokenKind.KW_LOCAL]
+    # expressions with any number of values, which parentheses cut to one
+    multi_value_exps = ('function_call_exp', 'vararg_exp')
+
+    # token kinds opening and closing blocks mapped to '(' and ')', to find
+    # the 'end' of a function body in the kinds of a token stream
+    block_mark_table = bytearray(b'.' * 256)
+    for kind in [lexer.TokenKind.KW_FUNCTION, lexer.TokenKind.KW_DO,
+                 lexer.TokenKind.KW_IF, lexer.TokenKind.KW_REPEAT]:
+        block_mark_table[kind.value] = ord('(')
+    for kind in [lexer.TokenKind.KW_END, lexer.TokenKind.KW_UNTIL]:
+        block_mark_table[kind.value] = ord(')')
+    block_mark_table = bytes(block_mark_table)
+    del kind
+    re_block_mark = re.compile(rb'[()]')
+    # kind codes of the tokens starting compound statements
+    compound_codes = frozenset(kind.value for kind in [
+        lexer.TokenKind.KW_DO, lexer.TokenKind.KW_WHILE, lexer.TokenKind.KW_FOR,
+        lexer.TokenKind.KW_IF, lexer.TokenKind.KW_REPEAT, lexer.TokenKind.KW_FUNCTION])
+
+    def __init__(self, lex, use_stack=True, recover=False, lazy=False):
+        if recover and isinstance(lex, lexer.Lexer):
+            # lexical errors have to be tokens to recover from them
+            if lex.cached_token is not None:
+                lex.cur_pos = lex.cached_token.pos
+            lex = lex.tokenize(recover=True)
         self.lex = lex
+        self.use_stack = use_stack
+        # with recover set, syntax errors are collected in diagnostics and
+        # parsing goes on at the next statement, giving a partial AST
+        self.recover = recover
+        self.diagnostics = []
+        # with lazy set, function bodies are skipped and parsed when first
+        # used; this needs a TokenStream to come back to them
+        self.lazy = lazy and isinstance(lex, lexer.TokenStream)
+        self.block_marks = None
 
     def parse(self):
         block = self.parse_block()
+        while self.recover and self.lex.look_kind() != lexer.TokenKind.EOF:
+            # a stray end, else, elseif or until
+            self.add_diagnostic(lexer.unexpected_token(self.lex.look_ahead(), self.lex.file_name, "'<eof>' expected"))
+            self.lex.skip_token()
+            block.stats.extend(self.parse_block().stats)
         self.lex.next_token_of_kind(lexer.TokenKind.EOF)
         return block
 
+    def add_diagnostic(self, error):
+        # an error left unconsumed is reported again by each enclosing block
+        last = self.diagnostics[-1] if self.diagnostics else None
+        if last is None or (last.line, last.column) != (error.line, error.column):
+            self.diagnostics.append(error)
+
+    # skip to the start of the next statement or the end of the block,
+    # reporting the lexical errors skipped over
+    def skip_to_stat(self):
+        while True:
+            kind = self.lex.look_kind()
+            if kind in self.sync_tokens:
+                return
+            if kind == lexer.TokenKind.ERROR:
+                self.add_diagnostic(lexer.unexpected_token(self.lex.look_ahead(), self.lex.file_name))
+            self.lex.skip_token()
+
+    # Skip the rest of a statement that failed to parse, starting at offset
+    # pos. A compound statement is skipped up to its matching end or until,
+    # so its own end is not reported again as a stray one.
+    def skip_stat(self, pos):
+        if isinstance(self.lex, lexer.TokenStream):
+            end = self.find_stat_end(bisect_left(self.lex.starts, pos))
+            if end >= self.lex.pos:
+                self.lex.pos = end + 1
+                if self.lex.kinds[end] == lexer.TokenKind.KW_END.value:
+                    return
+        self.skip_to_stat()
+
+    # index of the end or until closing the compound statement at token
+    # start, -1 for other statements or if block keywords do not balance
+    def find_stat_end(self, start):
+        kinds = self.lex.kinds
+        code = kinds[start]
+        if code == lexer.TokenKind.KW_LOCAL.value:
+            code = kinds[start + 1]
+        if code not in self.compound_codes:
+            return -1
+        depth = 0
+        # depths of while and for loops whose 'do' is yet to come
+        loops = []
+        for idx in range(start, len(kinds)):
+            code = kinds[idx]
+            if code == lexer.TokenKind.KW_WHILE.value or code == lexer.TokenKind.KW_FOR.value:
+                depth += 1
+                loops.append(depth)
+            elif code == lexer.TokenKind.KW_DO.value and loops and loops[-1] == depth:
+                loops.pop()
+            elif code in self.compound_codes:
+                depth += 1
+            elif code == lexer.TokenKind.KW_END.value or code == lexer.TokenKind.KW_UNTIL.value:
+                depth -= 1
+                if depth == 0:
+                    return idx
+        return -1
+
     # explist ::= exp {‘,’ exp}
     def parse_exp_list(self):
         exp_list = []
-        exp_list.append(self.parse_exp(0)[1])
-        while self.lex.look_ahead().kind == lexer.TokenKind.SEP_COMMA:
+        exp_list.append(self.parse_exp(0))
+        while self.lex.look_kind() == lexer.TokenKind.SEP_COMMA:
             self.lex.next_token()
-            exp_list.append(self.parse_exp(0)[1])
+            exp_list.append(self.parse_exp(0))
         return exp_list
 
     # exp ::= (simpleexp | unop exp) {binop exp}
     def parse_exp(self, prev_priority):
-        token = self.lex.look_ahead()
-        if token.kind in self.unops:
-            self.lex.next_token()
-            op_left = ast.UnopExp(self.parse_exp(self.unary_priority)[1], token.kind)
+        if self.use_stack:
+            return self.parse_exp_stack()
+        lex = self.lex
+        code = lex.look_code()
+        if self.is_unop[code]:
+            pos = lex.look_pos()
+            lex.skip_token()
+            op_left = ast.UnopExp(self.parse_exp(self.unary_priority), self.kind_list[code], pos)
         else:
             op_left = self.parse_simple_exp()
-        bin_op = self.lex.look_ahead().kind
-        while bin_op in self.binops and self.priority_table[bin_op]['left'] > prev_priority:
-            bin_op, op_left = self.parse_binop_exp(op_left, self.priority_table[bin_op]['right'])
-        return bin_op, op_left
-    
+        code = lex.look_code()
+        while self.left_priority[code] > prev_priority:
+            lex.skip_token()
+            op_left = ast.BinopExp(op_left, self.parse_exp(self.right_priority[code]), self.kind_list[code], op_left.pos)
+            code = lex.look_code()
+        return op_left
+
+    # the same grammar as parse_exp, parse_prefix_exp and parse_field_list,
+    # but brackets, call args and table constructors open frames on an
+    # explicit stack, so nesting is bounded by memory, not the recursion limit
+    def parse_exp_stack(self):
+        lex = self.lex
+        kind_list = self.kind_list
+        left_priority = self.left_priority
+        is_unop = self.is_unop
+        vals = []    # operands
+        ops = []     # pending operators: (right priority, kind code, is unary, pos)
+        frames = []  # open frames: [frame kind, ops floor of the enclosing frame, ...]
+        floor = 0    # ops below this index belong to enclosing frames
+        state = EXPECT_OPERAND
+        while True:
+            if state == EXPECT_OPERAND:
+                code = lex.look_code()
+                if is_unop[code]:
+                    ops.append((self.unary_priority, code, True, lex.look_pos()))
+                    lex.skip_token()
+                elif code == CODE_NAME:
+                    token = lex.next_token()
+                    vals.append(ast.NameExp(token.data, token.pos))
+                    state = EXPECT_SUFFIX
+                elif code == CODE_LPAREN:
+                    lex.skip_token()
+                    frames.append([FRAME_PAREN, floor])
+                    floor = len(ops)
+                elif code == CODE_LCURLY:
+                    pos = lex.look_pos()
+                    lex.skip_token()
+                    # table frame: keys, vals, pending key, key in brackets, call args, pos,
+                    # method name
+                    frames.append([FRAME_TABLE, floor, [], [], None, False, None, pos, None])
+                    floor = len(ops)
+                    state = EXPECT_FIELD
+                else:
+                    vals.append(self.parse_simple_exp())
+                    state = EXPECT_OPERATOR
+            elif state == EXPECT_SUFFIX:
+                code = lex.look_code()
+                args = None
+                method = None
+                if code == CODE_DOT:
+                    lex.skip_token()
+                    token = lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER)
+                    vals[-1] = ast.TableAccessExp(vals[-1], ast.StringExp(token.data, token.pos), vals[-1].pos)
+                elif code == CODE_COLON:
+                    lex.skip_token()
+                    token = lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER)
+                    args = []
+                    method = ast.StringExp(token.data, token.pos)
+                    code = lex.look_code()
+                elif code == CODE_LPAREN or code == CODE_LCURLY or code == CODE_STRING:
+                    args = []
+                elif code == CODE_LBRACK:
+                    lex.skip_token()
+                    frames.append([FRAME_INDEX, floor])
+                    floor = len(ops)
+                    state = EXPECT_OPERAND
+                else:
+                    state = EXPECT_OPERATOR
+                if args is not None:
+                    if code == CODE_LPAREN:
+                        lex.skip_token()
+                        if lex.look_code() == CODE_RPAREN:
+                            lex.skip_token()
+                            vals[-1] = ast.FunctionCallExp(vals[-1], method, args, vals[-1].pos)
+                        else:
+                            frames.append([FRAME_ARGS, floor, args, method])
+                            floor = len(ops)
+                            state = EXPECT_OPERAND
+                    elif code == CODE_LCURLY:
+                        pos = lex.look_pos()
+                        lex.skip_token()
+                        frames.append([FRAME_TABLE, floor, [], [], None, False, args, pos, method])
+                        floor = len(ops)
+                        state = EXPECT_FIELD
+                    else:
+                        token = lex.next_token_of_kind(lexer.TokenKind.STRING)
+                        args.append(ast.StringExp(token.data, token.pos))
+                        vals[-1] = ast.FunctionCallExp(vals[-1], method, args, vals[-1].pos)
+            elif state == EXPECT_OPERATOR:
+                code = lex.look_code()
+                priority = left_priority[code]
+                if priority:
+                    while len(ops) > floor and ops[-1][0] >= priority:
+                        self.reduce_op(ops, vals)
+                    lex.skip_token()
+                    ops.append((self.right_priority[code], code, False, -1))
+                    state = EXPECT_OPERAND
+                    continue
+                # the exp of the innermost frame is complete
+                while len(ops) > floor:
+                    self.reduce_op(ops, vals)
+                if not frames:
+                    return vals.pop()
+                frame = frames[-1]
+                if frame[0] == FRAME_PAREN:
+                    lex.next_token_of_kind(lexer.TokenKind.SEP_RPAREN)
+                    if vals[-1].name in self.multi_value_exps:
+                        vals[-1] = ast.ParensExp(vals[-1], vals[-1].pos)
+                    state = EXPECT_SUFFIX
+                elif frame[0] == FRAME_INDEX:
+                    lex.next_token_of_kind(lexer.TokenKind.SEP_RBRACK)
+                    idx_exp = vals.pop()
+                    vals[-1] = ast.TableAccessExp(vals[-1], idx_exp, vals[-1].pos)
+                    state = EXPECT_SUFFIX
+                elif frame[0] == FRAME_ARGS:
+                    frame[2].append(vals.pop())
+                    if code == CODE_COMMA:
+                        lex.skip_token()
+                        state = EXPECT_OPERAND
+                        continue
+                    lex.next_token_of_kind(lexer.TokenKind.SEP_RPAREN)
+                    vals[-1] = ast.FunctionCallExp(vals[-1], frame[3], frame[2], vals[-1].pos)
+                    state = EXPECT_SUFFIX
+                else:
+                    exp = vals.pop()
+                    state = EXPECT_OPERAND
+                    if frame[5]:
+                        # ‘[’ exp ‘]’ ‘=’ exp
+                        lex.next_token_of_kind(lexer.TokenKind.SEP_RBRACK)
+                        lex.next_token_of_kind(lexer.TokenKind.OP_ASSIGN)
+                        frame[4] = exp
+                        frame[5] = False
+                        continue
+                    if code == CODE_ASSIGN and frame[4] is None:
+                        # Name ‘=’ exp
+                        if not isinstance(exp, ast.NameExp):
+                            raise lexer.unexpected_token(lex.look_ahead(), lex.file_name)
+                        lex.skip_token()
+                        frame[4] = ast.StringExp(exp.id_name, exp.pos)
+                        continue
+                    frame[2].append(frame[4] if frame[4] is not None else ast.NilExp())
+                    frame[3].append(exp)
+                    frame[4] = None
+                    if code == CODE_COMMA or code == CODE_SEMI:
+                        lex.skip_token()
+                        state = EXPECT_FIELD
+                        continue
+                    lex.next_token_of_kind(lexer.TokenKind.SEP_RCURLY)
+                    state = self.close_table(frame, vals)
+                frames.pop()
+                floor = frame[1]
+            else:
+                code = lex.look_code()
+                if code == CODE_RCURLY:
+                    lex.skip_token()
+                    frame = frames.pop()
+                    floor = frame[1]
+                    state = self.close_table(frame, vals)
+                else:
+                    if code == CODE_LBRACK:
+                        lex.skip_token()
+                        frames[-1][5] = True
+                    state = EXPECT_OPERAND
+
+    @staticmethod
+    def reduce_op(ops, vals):
+        _, code, is_unop, pos = ops.pop()
+        if is_unop:
+            vals[-1] = ast.UnopExp(vals[-1], Parser.kind_list[code], pos)
+        else:
+            op_right = vals.pop()
+            vals[-1] = ast.BinopExp(vals[-1], op_right, Parser.kind_list[code], vals[-1].pos)
+
+    # push the constructor of a finished table frame, returns the next state
+    @staticmethod
+    def close_table(frame, vals):
+        table = ast.TableConstructorExp(frame[2], frame[3], frame[7])
+        if frame[6] is None:
+            vals.append(table)
+            return EXPECT_OPERATOR
+        frame[6].append(table)
+        vals[-1] = ast.FunctionCallExp(vals[-1], frame[8], frame[6], vals[-1].pos)
+        return EXPECT_SUFFIX
+
     # args ::=  ‘(’ [explist] ‘)’ | tableconstructor | LiteralString 
     # tableconstructor ::= ‘{’ [fieldlist] ‘}’
     def parse_func_args(self):
-        look_token = self.lex.look_ahead()
+        kind = self.lex.look_kind()
         exp_list = []
-        if look_token.kind == lexer.TokenKind.SEP_LPAREN:
+        if kind == lexer.TokenKind.SEP_LPAREN:
             self.lex.next_token()
-            if self.lex.look_ahead().kind != lexer.TokenKind.SEP_RPAREN:
+            if self.lex.look_kind() != lexer.TokenKind.SEP_RPAREN:
                 exp_list = self.parse_exp_list()
             self.lex.next_token_of_kind(lexer.TokenKind.SEP_RPAREN)
-        elif look_token.kind == lexer.TokenKind.SEP_LCURLY:
+        elif kind == lexer.TokenKind.SEP_LCURLY:
             exp_list = [self.parse_table_constructor_exp()]
         else:
-            exp_list = [ast.String(self.lex.next_token_of_kind(lexer.TokenKind.STRING)).data]
+            token = self.lex.next_token_of_kind(lexer.TokenKind.STRING)
+            exp_list = [ast.StringExp(token.data, token.pos)]
         return exp_list
 
     # simpleexp ::= nil | false | true | Numeral | LiteralString | ‘...’ | 
     #                           functiondef | prefixexp | tableconstructor
     def parse_simple_exp(self):
-        look_token = self.lex.look_ahead()
-        if look_token.kind == lexer.TokenKind.KW_NIL:
-            self.lex.next_token()
-            return ast.NilExp()
-        elif look_token.kind == lexer.TokenKind.KW_FALSE:
-            self.lex.next_token()
-            return ast.BoolConstExp(False)
-        elif look_token.kind == lexer.TokenKind.KW_TRUE:
-            self.lex.next_token()
-            return ast.BoolConstExp(True)
-        elif look_token.kind == lexer.TokenKind.NUMBER:
+        kind = self.lex.look_kind()
+        pos = self.lex.look_pos()
+        if kind == lexer.TokenKind.KW_NIL:
+            self.lex.skip_token()
+            return ast.NilExp(pos)
+        elif kind == lexer.TokenKind.KW_FALSE:
+            self.lex.skip_token()
+            return ast.BoolConstExp(False, pos)
+        elif kind == lexer.TokenKind.KW_TRUE:
+            self.lex.skip_token()
+            return ast.BoolConstExp(True, pos)
+        elif kind == lexer.TokenKind.NUMBER:
             return self.parse_number_exp()
-        elif look_token.kind == lexer.TokenKind.STRING:
-            self.lex.next_token()
-            return ast.StringExp(look_token.data)
-        elif look_token.kind == lexer.TokenKind.VARARG:
-            self.lex.next_token()
-            return ast.VarargExp()
-        elif look_token.kind == lexer.TokenKind.KW_FUNCTION:
+        elif kind == lexer.TokenKind.STRING:
+            return ast.StringExp(self.lex.next_token().data, pos)
+        elif kind == lexer.TokenKind.VARARG:
+            self.lex.skip_token()
+            return ast.VarargExp(pos)
+        elif kind == lexer.TokenKind.KW_FUNCTION:
             return self.parse_func_def_exp()
-        elif look_token.kind == lexer.TokenKind.SEP_LCURLY:
+        elif kind == lexer.TokenKind.SEP_LCURLY:
             return self.parse_table_constructor_exp()
         else:
             return self.parse_prefix_exp()
 
     def parse_func_def_exp(self):
-        self.lex.next_token_of_kind(lexer.TokenKind.KW_FUNCTION)
-        func_body_exp = self.parse_func_body_exp(False)
+        pos = self.lex.next_token_of_kind(lexer.TokenKind.KW_FUNCTION).pos
+        func_body_exp = self.parse_func_body_exp(False, pos)
         return func_body_exp
 
     # tableconstructor ::= ‘{’ [fieldlist] ‘}’
     def parse_table_constructor_exp(self):
-        self.lex.next_token_of_kind(lexer.TokenKind.SEP_LCURLY)
-        if self.lex.look_ahead().kind != lexer.TokenKind.SEP_RCURLY:
+        pos = self.lex.next_token_of_kind(lexer.TokenKind.SEP_LCURLY).pos
+        if self.lex.look_kind() != lexer.TokenKind.SEP_RCURLY:
             key_list, val_list = self.parse_field_list()
         else:
             key_list = []
             val_list = []
         self.lex.next_token_of_kind(lexer.TokenKind.SEP_RCURLY)
-        return ast.TableConstructorExp(key_list, val_list)
+        return ast.TableConstructorExp(key_list, val_list, pos)
 
     # fieldlist ::= field {fieldsep field} [fieldsep]
 	# fieldsep ::= ‘,’ | ‘;’
@@ -147,9 +452,9 @@ class Parser:
         key, val = self.parse_field()
         key_list = [key]
         val_list = [val]
-        while self.lex.look_ahead().kind in [lexer.TokenKind.SEP_COMMA, lexer.TokenKind.SEP_SEMI]:
+        while self.lex.look_kind() in [lexer.TokenKind.SEP_COMMA, lexer.TokenKind.SEP_SEMI]:
             self.lex.next_token()
-            if self.lex.look_ahead().kind == lexer.TokenKind.SEP_RCURLY:
+            if self.lex.look_kind() == lexer.TokenKind.SEP_RCURLY:
                 break
             else:
                 key, val = self.parse_field()
@@ -159,60 +464,62 @@ class Parser:
 
     # field ::= ‘[’ exp ‘]’ ‘=’ exp | Name ‘=’ exp | exp
     def parse_field(self):
-        if self.lex.look_ahead().kind == lexer.TokenKind.SEP_LBRACK:
+        if self.lex.look_kind() == lexer.TokenKind.SEP_LBRACK:
             self.lex.next_token()
-            key_exp = self.parse_exp(0)[1]
+            key_exp = self.parse_exp(0)
             self.lex.next_token_of_kind(lexer.TokenKind.SEP_RBRACK)
             self.lex.next_token_of_kind(lexer.TokenKind.OP_ASSIGN)
-            val_exp = self.parse_exp(0)[1]
+            val_exp = self.parse_exp(0)
             return key_exp, val_exp
-        exp = self.parse_exp(0)[1]
-        if self.lex.look_ahead().kind == lexer.TokenKind.OP_ASSIGN:
+        exp = self.parse_exp(0)
+        if self.lex.look_kind() == lexer.TokenKind.OP_ASSIGN:
             if not isinstance(exp, ast.NameExp):
-                raise Exception("syntax error near '%s'" % token)
+                raise lexer.unexpected_token(self.lex.look_ahead(), self.lex.file_name)
             self.lex.next_token()
-            key_exp = ast.StringExp(exp.id_name)
-            val_exp = self.parse_exp(0)[1]
+            key_exp = ast.StringExp(exp.id_name, exp.pos)
+            val_exp = self.parse_exp(0)
             return key_exp, val_exp
         return ast.NilExp(), exp
 
-    # binop exp
-    def parse_binop_exp(self, op_left, prev_priority):
-        token = self.lex.next_token()
-        if token.kind not in self.binops:
-           raise Exception("syntax error near '%s'" % token)
-        bin_op, op_right = self.parse_exp(prev_priority)
-        return bin_op, ast.BinopExp(op_left, op_right, token.kind)
-
     def parse_number_exp(self):
         token = self.lex.next_token_of_kind(lexer.TokenKind.NUMBER)
-        val = eval(token.data)
+        val = number.parse_numeral(token.data)
+        if val is None:
+            raise lexer.unexpected_token(token, self.lex.file_name, 'malformed number')
         if isinstance(val, int):
-            return ast.IntegerExp(val)
+            return ast.IntegerExp(val, token.pos)
         else:
-            return ast.FloatExp(val)
+            return ast.FloatExp(val, token.pos)
 
     # retstat ::= return [explist] [‘;’]
     def parse_retstat(self):
-        self.lex.next_token_of_kind(lexer.TokenKind.KW_RETURN)
+        pos = self.lex.next_token_of_kind(lexer.TokenKind.KW_RETURN).pos
         exp_list = []
-        token = self.lex.look_ahead()
-        if not self.is_block_end(token.kind) and token.kind != lexer.TokenKind.SEP_SEMI:
+        kind = self.lex.look_kind()
+        if not self.is_block_end(kind) and kind != lexer.TokenKind.SEP_SEMI:
             exp_list = self.parse_exp_list()
-        return ast.RetStat(exp_list)
+        if self.lex.look_kind() == lexer.TokenKind.SEP_SEMI:
+            self.lex.skip_token()
+        return ast.RetStat(exp_list, pos)
 
     # block ::= {stat} [retstat]
     def parse_block(self):
+        pos = self.lex.look_pos()
         stats = self.parse_stats()
-        block = ast.Block(stats)
-        if self.lex.look_ahead().kind == lexer.TokenKind.KW_RETURN:
-            retstat = self.parse_retstat()
-            block.append_stat(retstat)
+        block = ast.Block(stats, pos)
+        if self.lex.look_kind() == lexer.TokenKind.KW_RETURN:
+            try:
+                block.append_stat(self.parse_retstat())
+            except lexer.ParseError as e:
+                if not self.recover:
+                    raise
+                self.add_diagnostic(e)
+                self.skip_to_stat()
         return block
 
     def parse_goto_stat(self):
         self.lex.next_token_of_kind(lexer.TokenKind.KW_GOTO)
-        label = self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER)
+        label = self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data
         return ast.GotoStat(label)
 
     def parse_do_stat(self):
@@ -223,7 +530,7 @@ class Parser:
 
     def parse_while_stat(self):
         self.lex.next_token_of_kind(lexer.TokenKind.KW_WHILE)
-        exp = self.parse_exp(0)[1]
+        exp = self.parse_exp(0)
         self.lex.next_token_of_kind(lexer.TokenKind.KW_DO)
         block = self.parse_block()
         self.lex.next_token_of_kind(lexer.TokenKind.KW_END)
@@ -233,24 +540,24 @@ class Parser:
         self.lex.next_token_of_kind(lexer.TokenKind.KW_REPEAT)
         block = self.parse_block()
         self.lex.next_token_of_kind(lexer.TokenKind.KW_UNTIL)
-        exp = self.parse_exp(0)[1]
+        exp = self.parse_exp(0)
         return ast.RepeatStat(exp, block)
 
     def parse_if_stat(self):
         exp_list = []
         block_list = []
         self.lex.next_token_of_kind(lexer.TokenKind.KW_IF)
-        exp = self.parse_exp(0)[1]
+        exp = self.parse_exp(0)
         exp_list.append(exp)
         self.lex.next_token_of_kind(lexer.TokenKind.KW_THEN)
         block = self.parse_block()
         block_list.append(block)
-        while self.lex.look_ahead().kind == lexer.TokenKind.KW_ELSEIF:
+        while self.lex.look_kind() == lexer.TokenKind.KW_ELSEIF:
             self.lex.next_token_of_kind(lexer.TokenKind.KW_ELSEIF)
-            exp_list.append(self.parse_exp(0)[1])
+            exp_list.append(self.parse_exp(0))
             self.lex.next_token_of_kind(lexer.TokenKind.KW_THEN)
             block_list.append(self.parse_block())
-        if self.lex.look_ahead().kind == lexer.TokenKind.KW_ELSE:
+        if self.lex.look_kind() == lexer.TokenKind.KW_ELSE:
             self.lex.next_token_of_kind(lexer.TokenKind.KW_ELSE)
             exp_list.append(ast.BoolConstExp(True))
             block_list.append(self.parse_block())
@@ -260,20 +567,20 @@ class Parser:
     def parse_for_stat(self):
         self.lex.next_token_of_kind(lexer.TokenKind.KW_FOR)
         name = ast.NameExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data)
-        if self.lex.look_ahead().kind == lexer.TokenKind.OP_ASSIGN:
+        if self.lex.look_kind() == lexer.TokenKind.OP_ASSIGN:
             return self.finish_for_num_stat(name)
         else:
             return self.finish_for_in_stat(name)
 
     def finish_for_num_stat(self, var):
         self.lex.next_token_of_kind(lexer.TokenKind.OP_ASSIGN)
-        init_exp = self.parse_exp(0)[1]
+        init_exp = self.parse_exp(0)
         self.lex.next_token_of_kind(lexer.TokenKind.SEP_COMMA)
-        limit_exp = self.parse_exp(0)[1]
+        limit_exp = self.parse_exp(0)
         step_exp = None
-        if self.lex.look_ahead().kind == lexer.TokenKind.SEP_COMMA:
+        if self.lex.look_kind() == lexer.TokenKind.SEP_COMMA:
             self.lex.next_token()
-            step_exp = self.parse_exp(0)[1]
+            step_exp = self.parse_exp(0)
         self.lex.next_token_of_kind(lexer.TokenKind.KW_DO)
         block = self.parse_block()
         self.lex.next_token_of_kind(lexer.TokenKind.KW_END)
@@ -289,9 +596,9 @@ class Parser:
         return ast.ForInStat(var_list, exp_list, block)
 
     def parse_func_def_stat(self):
-        self.lex.next_token_of_kind(lexer.TokenKind.KW_FUNCTION)
+        pos = self.lex.next_token_of_kind(lexer.TokenKind.KW_FUNCTION).pos
         func_name_exp, has_colon = self.parse_func_name_exp()
-        func_body_exp = self.parse_func_body_exp(has_colon)
+        func_body_exp = self.parse_func_body_exp(has_colon, pos)
         return ast.AssignStat([func_name_exp], [func_body_exp])
 
     # parlist ::= namelist [‘,’ ‘...’] | ‘...’
@@ -299,16 +606,16 @@ class Parser:
     def parse_parlist(self):
         parlist = []
         is_var_arg = False
-        if self.lex.look_ahead().kind == lexer.TokenKind.SEP_RPAREN:
+        if self.lex.look_kind() == lexer.TokenKind.SEP_RPAREN:
             return parlist, is_var_arg
-        if self.lex.look_ahead().kind == lexer.TokenKind.VARARG:
+        if self.lex.look_kind() == lexer.TokenKind.VARARG:
             is_var_arg = True
             self.lex.next_token()
             return parlist, is_var_arg
         parlist.append(ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data))
-        while self.lex.look_ahead().kind == lexer.TokenKind.SEP_COMMA:
+        while self.lex.look_kind() == lexer.TokenKind.SEP_COMMA:
             self.lex.next_token()
-            if self.lex.look_ahead().kind == lexer.TokenKind.IDENTIFIER:
+            if self.lex.look_kind() == lexer.TokenKind.IDENTIFIER:
                 parlist.append(ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data))
             else:
                 self.lex.next_token_of_kind(lexer.TokenKind.VARARG)
@@ -317,24 +624,63 @@ class Parser:
         return parlist, is_var_arg
 
     # funcbody ::= ‘(’ [parlist] ‘)’ block end
-    def parse_func_body_exp(self, has_colon):
+    def parse_func_body_exp(self, has_colon, pos=-1):
         self.lex.next_token_of_kind(lexer.TokenKind.SEP_LPAREN)
         parlist, is_var_arg = self.parse_parlist()
         self.lex.next_token_of_kind(lexer.TokenKind.SEP_RPAREN)
         if has_colon:
             parlist.insert(0, ast.StringExp('self'))
+        if self.lazy:
+            body_end = self.find_body_end()
+            if body_end >= 0:
+                body_start = self.lex.pos
+                self.lex.pos = body_end + 1
+                return ast.LazyFunctionDefExp(parlist, is_var_arg, self, body_start, body_end, pos)
         body = self.parse_block()
         self.lex.next_token_of_kind(lexer.TokenKind.KW_END)
-        return ast.FunctionDefExp(parlist, is_var_arg, body)
+        return ast.FunctionDefExp(parlist, is_var_arg, body, pos)
+
+    # index of the 'end' closing the function body at the current token,
+    # -1 if block keywords do not balance, leaving the errors to parse_block
+    def find_body_end(self):
+        if self.block_marks is None:
+            self.block_marks = bytes(self.lex.kinds).translate(self.block_mark_table)
+        block_marks = self.block_marks
+        depth = 0
+        for m in self.re_block_mark.finditer(block_marks, self.lex.pos):
+            if block_marks[m.start()] == 0x28:  # (
+                depth += 1
+            elif depth:
+                depth -= 1
+            elif self.lex.kinds[m.start()] == lexer.TokenKind.KW_END.value:
+                return m.start()
+            else:
+                return -1
+        return -1
+
+    # parse the body of a lazy function, ending at the 'end' at body_end
+    def parse_body_range(self, body_start, body_end):
+        saved_pos = self.lex.pos
+        self.lex.pos = body_start
+        try:
+            body = self.parse_block()
+            if self.lex.pos != body_end:
+                error = lexer.unexpected_token(self.lex.look_ahead(), self.lex.file_name, "'end' expected")
+                if not self.recover:
+                    raise error
+                self.add_diagnostic(error)
+        finally:
+            self.lex.pos = saved_pos
+        return body
 
     # funcname ::= Name {‘.’ Name} [‘:’ Name]
     def parse_func_name_exp(self):
         has_colon = False
         name_exp = ast.NameExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data)
-        while self.lex.look_ahead().kind == lexer.TokenKind.SEP_DOT:
+        while self.lex.look_kind() == lexer.TokenKind.SEP_DOT:
             self.lex.next_token()
             name_exp = ast.TableAccessExp(name_exp, ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data))
-        if self.lex.look_ahead().kind == lexer.TokenKind.SEP_COLON:
+        if self.lex.look_kind() == lexer.TokenKind.SEP_COLON:
             self.lex.next_token()
             name_exp = ast.TableAccessExp(name_exp, ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data))
             has_colon = True
@@ -342,7 +688,7 @@ class Parser:
 
     def parse_local_def_stat(self):
         self.lex.next_token_of_kind(lexer.TokenKind.KW_LOCAL)
-        if self.lex.look_ahead().kind == lexer.TokenKind.KW_FUNCTION:
+        if self.lex.look_kind() == lexer.TokenKind.KW_FUNCTION:
             return self.parse_local_func_def_stat()
         else:
             return self.parse_local_var_decl_stat()
@@ -353,23 +699,24 @@ class Parser:
             var_list = [name]
         else:
             var_list = [ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data)]
-        while self.lex.look_ahead().kind == lexer.TokenKind.SEP_COMMA:
+        while self.lex.look_kind() == lexer.TokenKind.SEP_COMMA:
             self.lex.next_token()
             var_list.append(ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data))
         return var_list
 
     # local function Name funcbody
     def parse_local_func_def_stat(self):
-        self.lex.next_token_of_kind(lexer.TokenKind.KW_FUNCTION)
-        var_list = [ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data)]
-        exp_list = [self.parse_func_body_exp(False)]
-        return ast.LocalDeclStat(var_list, exp_list)
+        pos = self.lex.next_token_of_kind(lexer.TokenKind.KW_FUNCTION).pos
+        token = self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER)
+        var_list = [ast.StringExp(token.data, token.pos)]
+        exp_list = [self.parse_func_body_exp(False, pos)]
+        return ast.LocalFuncDefStat(var_list, exp_list)
 
     # local namelist [‘=’ explist] 
     def parse_local_var_decl_stat(self):
         var_list = self.parse_name_list()
         exp_list = []
-        if self.lex.look_ahead().kind == lexer.TokenKind.OP_ASSIGN:
+        if self.lex.look_kind() == lexer.TokenKind.OP_ASSIGN:
             self.lex.next_token_of_kind(lexer.TokenKind.OP_ASSIGN)
             exp_list = self.parse_exp_list()
         return ast.LocalDeclStat(var_list, exp_list)
@@ -386,34 +733,34 @@ class Parser:
     # args ::=  ‘(’ [explist] ‘)’ | tableconstructor | LiteralString 
     # tableconstructor ::= ‘{’ [fieldlist] ‘}’
     def parse_prefix_exp(self):
-        look_token = self.lex.look_ahead()
-        if look_token.kind == lexer.TokenKind.SEP_LPAREN:
-            self.lex.next_token()
-            exp = self.parse_exp(0)[1]
+        kind = self.lex.look_kind()
+        if kind == lexer.TokenKind.SEP_LPAREN:
+            self.lex.skip_token()
+            exp = self.parse_exp(0)
             self.lex.next_token_of_kind(lexer.TokenKind.SEP_RPAREN)
+            if exp.name in self.multi_value_exps:
+                exp = ast.ParensExp(exp, exp.pos)
         else:
             name = self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER)
-            exp = ast.NameExp(name.data)
+            exp = ast.NameExp(name.data, name.pos)
         while True:
-            look_token = self.lex.look_ahead()
-            if look_token.kind == lexer.TokenKind.SEP_DOT:
-                self.lex.next_token()
-                idx_exp = ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data)
-                exp = ast.TableAccessExp(exp, idx_exp)
-            elif look_token.kind ==  lexer.TokenKind.SEP_COLON:
-                self.lex.next_token()
-                args_exp = [exp]
-                idx_exp = ast.StringExp(self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data)
-                exp = ast.TableAccessExp(exp, idx_exp)
-                args_exp.extend(self.parse_func_args())
-                exp = ast.FunctionCallExp(exp, args_exp)
-            elif look_token.kind in [lexer.TokenKind.SEP_LPAREN, lexer.TokenKind.SEP_LCURLY, lexer.TokenKind.STRING]:
+            kind = self.lex.look_kind()
+            if kind == lexer.TokenKind.SEP_DOT:
+                self.lex.skip_token()
+                token = self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER)
+                exp = ast.TableAccessExp(exp, ast.StringExp(token.data, token.pos), exp.pos)
+            elif kind ==  lexer.TokenKind.SEP_COLON:
+                self.lex.skip_token()
+                token = self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER)
+                args_exp = self.parse_func_args()
+                exp = ast.FunctionCallExp(exp, ast.StringExp(token.data, token.pos), args_exp, exp.pos)
+            elif kind in [lexer.TokenKind.SEP_LPAREN, lexer.TokenKind.SEP_LCURLY, lexer.TokenKind.STRING]:
                 args_exp = self.parse_func_args()
-                exp = ast.FunctionCallExp(exp, args_exp)
-            elif look_token.kind == lexer.TokenKind.SEP_LBRACK:
-                self.lex.next_token()
-                idx_exp = self.parse_exp(0)[1]
-                exp = ast.TableAccessExp(exp, idx_exp)
+                exp = ast.FunctionCallExp(exp, None, args_exp, exp.pos)
+            elif kind == lexer.TokenKind.SEP_LBRACK:
+                self.lex.skip_token()
+                idx_exp = self.parse_exp(0)
+                exp = ast.TableAccessExp(exp, idx_exp, exp.pos)
                 self.lex.next_token_of_kind(lexer.TokenKind.SEP_RBRACK)
             else:
                 break
@@ -429,19 +776,19 @@ class Parser:
         elif isinstance(exp, ast.FunctionCallExp):
             return exp
         else:
-            raise Exception("syntax error near '%s'" % look_token)
+            raise lexer.unexpected_token(look_token, self.lex.file_name)
 
     def check_var(self, exp):
         if isinstance(exp, ast.TableAccessExp) or isinstance(exp, ast.NameExp):
             return exp
-        raise Exception("syntax error near '%s'" % token)
+        raise lexer.unexpected_token(self.lex.look_ahead(), self.lex.file_name)
 
     # varlist ‘=’ explist
     # varlist ::= var {‘,’ var}
     # var ::=  Name | prefixexp ‘[’ exp ‘]’ | prefixexp ‘.’ Name
     def finsh_assign_stat(self, first_var):
         var_list = [first_var]
-        while self.lex.look_ahead().kind == lexer.TokenKind.SEP_COMMA:
+        while self.lex.look_kind() == lexer.TokenKind.SEP_COMMA:
             self.lex.next_token()
             var_list.append(self.check_var(self.parse_prefix_exp()))
         self.lex.next_token_of_kind(lexer.TokenKind.OP_ASSIGN)
@@ -466,28 +813,28 @@ class Parser:
         functioncall 
     """
     def parse_stat(self):
-        token = self.lex.look_ahead()
-        if token.kind == lexer.TokenKind.SEP_SEMI:
+        kind = self.lex.look_kind()
+        if kind == lexer.TokenKind.SEP_SEMI:
             return self.parse_empty_stat()
-        elif token.kind == lexer.TokenKind.KW_BREAK:
+        elif kind == lexer.TokenKind.KW_BREAK:
             return self.parse_break_stat()
-        elif token.kind == lexer.TokenKind.SEP_LABEL:
+        elif kind == lexer.TokenKind.SEP_LABEL:
             return self.parse_label_stat()
-        elif token.kind == lexer.TokenKind.KW_GOTO:
+        elif kind == lexer.TokenKind.KW_GOTO:
             return self.parse_goto_stat()
-        elif token.kind == lexer.TokenKind.KW_DO:
+        elif kind == lexer.TokenKind.KW_DO:
             return self.parse_do_stat()
-        elif token.kind == lexer.TokenKind.KW_WHILE:
+        elif kind == lexer.TokenKind.KW_WHILE:
             return self.parse_while_stat()
-        elif token.kind == lexer.TokenKind.KW_REPEAT:
+        elif kind == lexer.TokenKind.KW_REPEAT:
             return self.parse_repeat_stat()
-        elif token.kind == lexer.TokenKind.KW_IF:
+        elif kind == lexer.TokenKind.KW_IF:
             return self.parse_if_stat()
-        elif token.kind == lexer.TokenKind.KW_FOR:
+        elif kind == lexer.TokenKind.KW_FOR:
             return self.parse_for_stat()
-        elif token.kind == lexer.TokenKind.KW_FUNCTION:
+        elif kind == lexer.TokenKind.KW_FUNCTION:
             return self.parse_func_def_stat()
-        elif token.kind == lexer.TokenKind.KW_LOCAL:
+        elif kind == lexer.TokenKind.KW_LOCAL:
             return self.parse_local_def_stat()
         else:
             return self.parse_assign_or_func_call_stat()
@@ -501,15 +848,24 @@ class Parser:
 
     def parse_label_stat(self):
         self.lex.next_token_of_kind(lexer.TokenKind.SEP_LABEL)
-        label = self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER)
+        label = self.lex.next_token_of_kind(lexer.TokenKind.IDENTIFIER).data
         self.lex.next_token_of_kind(lexer.TokenKind.SEP_LABEL)
         return ast.LabelStat(label)
 
     def parse_stats(self):
         stats = []
-        while not self.is_block_end(self.lex.look_ahead().kind):
-            stat = self.parse_stat()
+        while not self.is_block_end(self.lex.look_kind()):
+            pos = self.lex.look_pos()
+            try:
+                stat = self.parse_stat()
+            except lexer.ParseError as e:
+                if not self.recover:
+                    raise
+                self.add_diagnostic(e)
+                self.skip_stat(pos)
+                continue
             if stat:
+                stat.pos = pos
                 stats.append(stat)
         return stats
 
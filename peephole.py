@@ -0,0 +1,143 @@
+from code import OpCode, POS_A, POS_C, POS_Bx, SIZE_OP, MAXARG_A, MAXARG_C, \
+    MAXARG_Bx, MAXARG_sBx
+
+OP_MASK = (1 << SIZE_OP) - 1
+OP_JMP = OpCode.OP_JMP.value
+OP_RETURN = OpCode.OP_RETURN.value
+OP_LOADBOOL = OpCode.OP_LOADBOOL.value
+OP_LOADKX = OpCode.OP_LOADKX.value
+OP_SETLIST = OpCode.OP_SETLIST.value
+# instructions with an sBx jump offset from the next pc
+JUMP_OPS = (OP_JMP, OpCode.OP_FORPREP.value, OpCode.OP_FORLOOP.value, OpCode.OP_TFORLOOP.value)
+# instructions that may skip the next one, which then must stay in place
+SKIP_OPS = (OpCode.OP_EQ.value, OpCode.OP_LT.value, OpCode.OP_LE.value, OpCode.OP_TEST.value,
+            OpCode.OP_TESTSET.value)
+
+
+def target_of(pc, inst):
+    return pc + 1 + (inst >> POS_Bx & MAXARG_Bx) - MAXARG_sBx
+
+
+def with_target(pc, inst, target):
+    sbx = target - pc - 1
+    if sbx > MAXARG_sBx or sbx < -MAXARG_sBx:
+        raise Exception("control structure too long")
+    return inst & ~(MAXARG_Bx << POS_Bx) | (sbx + MAXARG_sBx) << POS_Bx
+
+
+# whether inst may skip the instruction after it
+def may_skip(inst):
+    op = inst & OP_MASK
+    return op in SKIP_OPS or (op == OP_LOADBOOL and inst >> POS_C & MAXARG_C)
+
+
+# whether the instruction after inst is its EXTRAARG operand
+def has_extra_arg(inst):
+    op = inst & OP_MASK
+    return op == OP_LOADKX or (op == OP_SETLIST and inst >> POS_C & MAXARG_C == 0)
+
+
+# pcs that control can go to from the instruction at pc
+def successors(pc, inst):
+    op = inst & OP_MASK
+    if op == OP_RETURN:
+        return ()
+    if op == OP_JMP or op == OpCode.OP_FORPREP.value:
+        return (target_of(pc, inst),)
+    if op in JUMP_OPS:
+        return (pc + 1, target_of(pc, inst))
+    if op == OP_LOADBOOL and inst >> POS_C & MAXARG_C:
+        return (pc + 2,)
+    if op in SKIP_OPS:
+        return (pc + 1, pc + 2)
+    if has_extra_arg(inst):
+        return (pc + 2,)
+    return (pc + 1,)
+
+
+# retarget jumps to unconditional jumps at the end of the chain
+def thread_jumps(code):
+    changed = False
+    for pc, inst in enumerate(code):
+        if inst & OP_MASK != OP_JMP:
+            continue
+        target = target_of(pc, inst)
+        seen = {pc}
+        # a jump that closes upvalues has to run, so the chain stops there
+        while target < len(code) and target not in seen and code[target] & OP_MASK == OP_JMP and \
+                code[target] >> POS_A & MAXARG_A == 0:
+            seen.add(target)
+            target = target_of(target, code[target])
+        if target != target_of(pc, inst):
+            code[pc] = with_target(pc, inst, target)
+            changed = True
+    return changed
+
+
+# pcs reachable from the entry, with EXTRAARG operands counted with their instruction
+def reachable(code):
+    seen = [False] * (len(code) + 1)
+    stack = [0]
+    while stack:
+        pc = stack.pop()
+        if seen[pc]:
+            continue
+        seen[pc] = True
+        if pc == len(code):
+            continue
+        inst = code[pc]
+        if has_extra_arg(inst):
+            seen[pc + 1] = True
+        for succ in successors(pc, inst):
+            if not seen[succ]:
+                stack.append(succ)
+    return seen
+
+
+# drop unreachable instructions and jumps to the next one, fixing jump offsets
+def remove_dead(code):
+    keep = reachable(code)
+    for pc, inst in enumerate(code):
+        # the instruction a LOADBOOL skips stays, even when nothing else reaches it
+        if keep[pc] and inst & OP_MASK == OP_LOADBOOL and inst >> POS_C & MAXARG_C:
+            keep[pc + 1] = True
+    for pc, inst in enumerate(code):
+        if keep[pc] and inst & OP_MASK == OP_JMP and inst >> POS_A & MAXARG_A == 0 and \
+                target_of(pc, inst) == pc + 1 and not (pc > 0 and keep[pc - 1] and may_skip(code[pc - 1])):
+            keep[pc] = False
+    if all(keep[:len(code)]):
+        return code, False
+    # new pc of each old one, removed ones going to the next kept instruction
+    new_pc = []
+    count = 0
+    for pc in range(len(code) + 1):
+        new_pc.append(count)
+        if pc < len(code) and keep[pc]:
+            count += 1
+    new_code = []
+    for pc, inst in enumerate(code):
+        if not keep[pc]:
+            continue
+        if inst & OP_MASK in JUMP_OPS:
+            inst = with_target(new_pc[pc], inst, new_pc[target_of(pc, inst)])
+        new_code.append(inst)
+    return new_code, True
+
+
+def optimize_code(code):
+    changed = True
+    while changed:
+        changed = thread_jumps(code)
+        code, removed = remove_dead(code)
+        changed = changed or removed
+    return code
+
+
+def optimize(proto):
+    """Peephole pass over a prototype tree: threads jumps to jumps, removes
+    jumps to the next instruction and unreachable code, then fixes the
+    jump offsets. Instructions a test may skip are left in place."""
+    proto.inst_list = optimize_code(proto.inst_list)
+    for sub_proto in proto.sub_proto_list:
+        optimize(sub_proto)
+    return proto
@@ -0,0 +1,240 @@
+from visitor import Visitor
+
+# kinds of a resolved name
+LOCAL = 0    # (LOCAL, register slot)
+UPVALUE = 1  # (UPVALUE, index in the function's upvalues)
+GLOBAL = 2   # (GLOBAL, resolution of _ENV), the name is a field of _ENV
+
+MAX_VARS = 200
+MAX_UPVALUES = 255
+
+
+class LocalVar:
+    def __init__(self, name, slot):
+        self.name = name
+        self.slot = slot
+        # referenced from an inner function, so its scope must close it
+        self.captured = False
+        # index of the last statement of the declaring scope that uses it,
+        # -1 if none, None if it must live to the end of the scope
+        self.last_use = None
+        # nesting depth of the declaring scope in its function
+        self.depth = 0
+
+
+class UpvalDesc:
+    def __init__(self, name, instack, idx):
+        self.name = name
+        # 1 if it captures a local of the enclosing function, 0 if an upvalue of it
+        self.instack = instack
+        # slot of that local, or index of that upvalue
+        self.idx = idx
+
+
+class FuncScope:
+    """Names of one function. active maps the names in scope to their
+    LocalVar, and upvalue_index maps names to upvalue indexes, so a name is
+    looked up in the enclosing functions only on its first use here."""
+    def __init__(self, parent):
+        self.parent = parent
+        self.active = {}
+        self.num_active = 0
+        # saved (name, shadowed LocalVar or None) to restore at scope exit
+        self.shadowed = []
+        self.local_vars = []
+        self.upvalues = []
+        self.upvalue_index = {}
+        self.max_locals = 0
+        # index of the statement being visited in each open scope
+        self.stat_index = []
+
+    def declare(self, name):
+        if self.num_active >= MAX_VARS:
+            raise Exception("too many local variables (limit is %d)" % MAX_VARS)
+        var = LocalVar(name, self.num_active)
+        self.shadowed.append((name, self.active.get(name)))
+        self.active[name] = var
+        self.num_active += 1
+        self.max_locals = max(self.max_locals, self.num_active)
+        self.local_vars.append(var)
+        return var
+
+    # the number of locals to keep at the end of a scope
+    def mark(self):
+        return self.num_active
+
+    def exit_scope(self, mark):
+        while self.num_active > mark:
+            name, prev = self.shadowed.pop()
+            if prev is None:
+                del self.active[name]
+            else:
+                self.active[name] = prev
+            self.num_active -= 1
+
+    def add_upvalue(self, name, instack, idx):
+        if len(self.upvalues) >= MAX_UPVALUES:
+            raise Exception("too many upvalues (limit is %d)" % MAX_UPVALUES)
+        index = self.upvalue_index[name] = len(self.upvalues)
+        self.upvalues.append(UpvalDesc(name, instack, idx))
+        return index
+
+    # (LOCAL, slot), (UPVALUE, index) or None for a global
+    def find(self, name):
+        var = self.active.get(name)
+        if var is not None:
+            return LOCAL, var.slot
+        index = self.upvalue_index.get(name)
+        if index is not None:
+            return UPVALUE, index
+        if self.parent is None:
+            return None
+        var = self.parent.active.get(name)
+        if var is not None:
+            var.captured = True
+            return UPVALUE, self.add_upvalue(name, 1, var.slot)
+        found = self.parent.find(name)
+        if found is None:
+            return None
+        return UPVALUE, self.add_upvalue(name, 0, found[1])
+
+
+class SymbolTable:
+    """Result of resolving the names of a chunk. names maps each NameExp
+    to its resolution, decls maps each declared name node (parameters,
+    local and loop variables) to its LocalVar, functions maps each
+    FunctionDefExp to its FuncScope, and main is the FuncScope of the
+    chunk. scope_vars maps the nodes that open a scope (blocks, loops,
+    function definitions) to the LocalVars they declare."""
+    def __init__(self):
+        self.names = {}
+        self.decls = {}
+        self.functions = {}
+        self.scope_vars = {}
+        self.main = None
+
+    def resolve_name(self, node):
+        return self.names[node]
+
+    def local_of(self, node):
+        return self.decls[node]
+
+
+class ScopeResolver(Visitor):
+    """Walks a chunk in evaluation order, tracking the locals in scope.
+    Local slots are the number of locals active at the declaration, as
+    Lua numbers them, with the three hidden locals of each for loop. Each
+    LocalVar also gets the last statement of its scope that uses it."""
+    def __init__(self):
+        self.symbols = SymbolTable()
+        self.func = None
+
+    def resolve_chunk(self, block):
+        main = self.symbols.main = FuncScope(None)
+        # the chunk's only upvalue is _ENV
+        main.add_upvalue('_ENV', 1, 0)
+        self.func = main
+        self.symbols.functions[block] = main
+        self.visit_scope(block, block.stats)
+        return self.symbols
+
+    def declare(self, node, name):
+        var = self.func.declare(name)
+        var.depth = len(self.func.stat_index) - 1
+        var.last_use = self.func.stat_index[-1]
+        self.symbols.decls[node] = var
+        return var
+
+    def declare_hidden(self, names):
+        for name in names:
+            self.func.declare(name)
+
+    # visit stats (and an exp after them) in a new scope opened by node
+    def visit_scope(self, node, stats, exp=None, names=()):
+        func = self.func
+        mark = func.mark()
+        first = len(func.local_vars)
+        stat_index = func.stat_index
+        stat_index.append(-1)
+        for decl in names:
+            self.declare(decl, decl.string if decl.name == 'string_exp' else decl.id_name)
+        for idx, stat in enumerate(stats):
+            stat_index[-1] = idx
+            self.visit(stat)
+        if exp is not None:
+            stat_index[-1] = len(stats)
+            self.visit(exp)
+        stat_index.pop()
+        scope_vars = self.symbols.scope_vars[node] = func.local_vars[first:]
+        if any(stat.name == 'label_stat' for stat in stats):
+            # a goto back to a label may use any local declared before it
+            depth = len(stat_index)
+            for var in scope_vars:
+                if var.depth == depth:
+                    var.last_use = None
+        func.exit_scope(mark)
+
+    def visit_block(self, node):
+        self.visit_scope(node, node.stats)
+
+    # resolution of a name, noting the use of a local of this function
+    def find(self, name):
+        func = self.func
+        found = func.find(name)
+        if found is not None and found[0] == LOCAL:
+            var = func.active[name]
+            if var.last_use is not None:
+                var.last_use = func.stat_index[var.depth]
+        return found
+
+    def visit_name_exp(self, node):
+        found = self.find(node.id_name)
+        if found is None:
+            found = (GLOBAL, self.find('_ENV'))
+        self.symbols.names[node] = found
+
+    def visit_local_decl_stat(self, node):
+        for exp in node.exp_list:
+            self.visit(exp)
+        for decl in node.val_list:
+            self.declare(decl, decl.string)
+
+    def visit_local_func_def_stat(self, node):
+        # the name is in scope in the function's body
+        decl = node.val_list[0]
+        self.declare(decl, decl.string)
+        self.visit(node.exp_list[0])
+
+    def visit_repeat_stat(self, node):
+        # the condition sees the locals of the body
+        self.visit_scope(node, node.block.stats, node.exp)
+
+    def visit_for_num_stat(self, node):
+        self.visit(node.init_exp)
+        self.visit(node.limit_exp)
+        if node.step_exp is not None:
+            self.visit(node.step_exp)
+        mark = self.func.mark()
+        self.declare_hidden(['(for index)', '(for limit)', '(for step)'])
+        self.visit_scope(node, node.block.stats, names=[node.var_name])
+        self.func.exit_scope(mark)
+
+    def visit_for_in_stat(self, node):
+        for exp in node.exp_list:
+            self.visit(exp)
+        mark = self.func.mark()
+        self.declare_hidden(['(for generator)', '(for state)', '(for control)'])
+        self.visit_scope(node, node.block.stats, names=node.name_list)
+        self.func.exit_scope(mark)
+
+    def visit_function_def_exp(self, node):
+        parent = self.func
+        self.func = FuncScope(parent)
+        self.symbols.functions[node] = self.func
+        self.visit_scope(node, node.body.stats, names=node.parlist)
+        self.func = parent
+
+
+# resolve the names of a chunk's main block
+def resolve(block):
+    return ScopeResolver().resolve_chunk(block)
@@ -0,0 +1,119 @@
+class DispatchTable(dict):
+    """Methods of a visitor class by node class, looked up by name on the
+    first node of each class. Node classes sharing a name, like
+    LazyFunctionDefExp and FunctionDefExp, get the same method."""
+    def __init__(self, visitor_class, prefix):
+        super().__init__()
+        self.visitor_class = visitor_class
+        self.prefix = prefix
+
+    def __missing__(self, node_class):
+        method = getattr(self.visitor_class, self.prefix + node_class.name, None)
+        self[node_class] = method
+        return method
+
+
+# child nodes in source order, with lists flattened and missing children left out
+def iter_children(node):
+    for name, is_list in node.child_fields:
+        child = getattr(node, name)
+        if is_list:
+            yield from child
+        elif child is not None:
+            yield child
+
+
+class Visitor:
+    """Calls visit_<node name>(node) methods by node class.
+
+    visit() dispatches one node, falling back to generic_visit(), which goes
+    down to the nearest descendants that have a visit_ method. walk() goes
+    over a whole tree in pre-order: a visit_ method returning False skips the
+    node's children, and leave_<node name>(node) is called after them.
+    Neither recurses, so only visit_ methods that call visit() themselves
+    use the Python stack."""
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.visit_table = DispatchTable(cls, 'visit_')
+        cls.leave_table = DispatchTable(cls, 'leave_')
+
+    def visit(self, node):
+        method = self.visit_table[type(node)]
+        if method is None:
+            return self.generic_visit(node)
+        return method(self, node)
+
+    def generic_visit(self, node):
+        table = self.visit_table
+        stack = list(iter_children(node))
+        stack.reverse()
+        while stack:
+            node = stack.pop()
+            method = table[type(node)]
+            if method is None:
+                children = list(iter_children(node))
+                children.reverse()
+                stack += children
+            else:
+                method(self, node)
+
+    def walk(self, node):
+        visit_table = self.visit_table
+        leave_table = self.leave_table
+        # (node, True) entries are nodes whose children are done
+        stack = [(node, False)]
+        while stack:
+            node, leaving = stack.pop()
+            if leaving:
+                leave_table[type(node)](self, node)
+                continue
+            method = visit_table[type(node)]
+            if method is not None and method(self, node) is False:
+                continue
+            if leave_table[type(node)] is not None:
+                stack.append((node, True))
+            children = [(child, False) for child in iter_children(node)]
+            children.reverse()
+            stack += children
+
+
+class Transformer:
+    """Rebuilds a tree bottom-up: transform() calls visit_<node name>(node)
+    on each node after its children, and the node is replaced by what the
+    method returns. Returning None removes a node from a list, or leaves an
+    optional child empty. Nodes without a method are kept. Children are
+    replaced in place, and the tree is walked with an explicit stack."""
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.visit_table = DispatchTable(cls, 'visit_')
+
+    def transform(self, node):
+        table = self.visit_table
+        # transformed nodes, children of a node in order at the end
+        results = []
+        stack = [(node, False)]
+        while stack:
+            node, done = stack.pop()
+            if not done:
+                stack.append((node, True))
+                children = [(child, False) for child in iter_children(node)]
+                children.reverse()
+                stack += children
+                continue
+            for name, is_list in reversed(node.child_fields):
+                child = getattr(node, name)
+                if is_list:
+                    if child:
+                        count = len(child)
+                        setattr(node, name, [it for it in results[-count:] if it is not None])
+                        del results[-count:]
+                elif child is not None:
+                    setattr(node, name, results.pop())
+            method = table[type(node)]
+            results.append(node if method is None else method(self, node))
+        return results[0]
+
+
+Visitor.visit_table = DispatchTable(Visitor, 'visit_')
+Visitor.leave_table = DispatchTable(Visitor, 'leave_')
+Transformer.visit_table = DispatchTable(Transformer, 'visit_')